@@ -1,28 +1,131 @@
-from fastapi import FastAPI
+import asyncio
+import os
+import time
+from typing import Any, Dict, cast
+
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse
 from langchain_core.runnables.config import RunnableConfig
 from langserve import add_routes
 
-from core.langfuse_utils import init_langfuse
-from runnables.chain_factory import (
-    create_chain,
-    create_chain_with_error,
-    create_streaming_chain,
-    create_nested_chain,
-    create_nested_streaming_chain,
-    create_retry_chain,
+from core import langfuse_utils, metrics
+from core.admission import AdmissionMiddleware, controllers_from_env
+from core.chain_registry import ChainRegistry, load_chain_specs
+from core.deadline import (
+    TIMEOUT_HEADER,
+    DisconnectMiddleware,
+    default_timeout,
+    parse_timeout_header,
+    with_timeout,
+)
+from core.langfuse_utils import (
+    LOCAL_SINK,
+    init_trace_handler,
+    langfuse_health,
+    monitor_langfuse,
+    shutdown_langfuse,
+    trace_sink,
+)
+from core.profiling import PROFILE_HEADER, PROFILE_KEY
+from core.sampling import (
+    TraceSampler,
+    FORCE_SAMPLE_HEADER,
+    FORCE_SAMPLE_KEY,
+    parse_force_header,
 )
+from core.stream_shaping import (
+    STREAM_SHAPING_HEADER,
+    parse_shaping_header,
+    with_shaping,
+)
+from core.sync_offload import run_sync
+from core.trace_sampling_runnable import TraceSamplingRunnable
+from core.worker import WorkerStatsMiddleware, worker_stats
+from runnables.chain_factory import ROUTES, get_response_cache
+
+# Отсчёт инициализации модуля: сборка приложения без импортов зависимостей
+# (время импорта замеряет benchmarks/bench_startup.py)
+_started = time.perf_counter()
+
+# Конфиг для runnable. Callback'и трейсинга подключает корневой
+# TraceSamplingRunnable каждого endpoint'а - только для запросов, попавших
+# в выборку. Langfuse handler создаётся на старте каждого процесса
+# (init_tracing): при запуске через server.py - уже после fork.
+config = RunnableConfig()
+sampler = TraceSampler.from_env()
+
+# Реестр цепочек: endpoint'ы из ROUTES (или CHAIN_ROUTES_FILE), цепочки
+# собираются при первом запросе или фоновым прогревом (CHAIN_WARMUP)
+chain_registry = ChainRegistry(load_chain_specs(ROUTES), config)
+
+
+# Корневые runnable endpoint'ов, которым init_tracing подключает handler
+traced_endpoints = {}
+
+
+def traced(runnable, endpoint: str) -> TraceSamplingRunnable:
+    traced_endpoints[endpoint] = TraceSamplingRunnable(
+        inner_runnable=runnable,
+        sampler=sampler,
+        endpoint=endpoint,
+    )
+    return traced_endpoints[endpoint]
+
+
+def trace_sampling_modifier(config: RunnableConfig, request: Request) -> RunnableConfig:
+    """
+    Заголовок X-Trace-Sample: 1/0 принудительно включает/выключает трейсинг запроса.
+    """
+    forced = parse_force_header(request.headers.get(FORCE_SAMPLE_HEADER))
+    if forced is None:
+        return config
+    configurable = {**config.get("configurable", {}), FORCE_SAMPLE_KEY: forced}
+    return {**config, "configurable": configurable}
+
+
+def deadline_modifier(config: RunnableConfig, request: Request) -> RunnableConfig:
+    """
+    Бюджет запроса: заголовок X-Request-Timeout (сек), не больше REQUEST_TIMEOUT.
+    """
+    timeout = parse_timeout_header(request.headers.get(TIMEOUT_HEADER))
+    limit = default_timeout()
+    if limit is not None:
+        timeout = min(timeout, limit) if timeout is not None else limit
+    if timeout is None:
+        return config
+    return with_timeout(config, timeout)
+
+
+def profile_modifier(config: RunnableConfig, request: Request) -> RunnableConfig:
+    """
+    Заголовок X-Profile: 1/0 включает/выключает профилирование запроса.
+    """
+    profile = parse_force_header(request.headers.get(PROFILE_HEADER))
+    if profile is None:
+        return config
+    configurable = {**config.get("configurable", {}), PROFILE_KEY: profile}
+    return {**config, "configurable": configurable}
+
+
+def stream_shaping_modifier(config: RunnableConfig, request: Request) -> RunnableConfig:
+    """
+    Заголовок X-Stream-Coalesce: "512:20" (байты:мс), "on" или "off" задаёт
+    объединение чанков стрима для запроса.
+    """
+    shaping = parse_shaping_header(request.headers.get(STREAM_SHAPING_HEADER))
+    if shaping is None:
+        return config
+    return with_shaping(config, shaping)
+
 
-# Инициализация Langfuse handler и конфиг для runnable
-langfuse_handler = init_langfuse()
-config = RunnableConfig(callbacks=[langfuse_handler])
+def request_config_modifier(config: Dict[str, Any], request: Request) -> Dict[str, Any]:
+    # langserve передаёт и ожидает конфиг простым словарём
+    runnable_config = cast(RunnableConfig, config)
+    runnable_config = trace_sampling_modifier(runnable_config, request)
+    runnable_config = stream_shaping_modifier(runnable_config, request)
+    runnable_config = profile_modifier(runnable_config, request)
+    return cast(Dict[str, Any], deadline_modifier(runnable_config, request))
 
-# Создание цепочек
-chain = create_chain(config)
-chain_with_error = create_chain_with_error(config)
-streaming_chain = create_streaming_chain(config)
-nested_chain = create_nested_chain(config)
-nested_streaming_chain = create_nested_streaming_chain(config)
-retry_chain = create_retry_chain(config)
 
 # FastAPI приложение
 app = FastAPI(
@@ -31,26 +134,128 @@ app = FastAPI(
     version="1.0.0",
 )
 
-# Endpoint обычной цепочки
-add_routes(app, chain, path="/v1", enabled_endpoints=["invoke"])
+# Ограничение одновременных запусков по endpoint'ам (ADMISSION_* переменные)
+admission_controllers = controllers_from_env(list(chain_registry.specs))
+if admission_controllers:
+    app.add_middleware(
+        AdmissionMiddleware,
+        controllers=admission_controllers,
+        reject_status=int(os.getenv("ADMISSION_REJECT_STATUS", "503")),
+    )
 
-# Endpoint цепочки с ошибкой
-add_routes(app, chain_with_error, path="/v2", enabled_endpoints=["invoke"])
+# Отмена обработки при отключении клиента (в том числе ожидающей в очереди)
+app.add_middleware(DisconnectMiddleware)
 
-# Endpoint стриминговой цепочки
-add_routes(app, streaming_chain, path="/v3", enabled_endpoints=["invoke", "stream"])
+# Счётчики запросов процесса для /health
+app.add_middleware(WorkerStatsMiddleware)
 
-# Endpoint цепочки с вложенным runnable
-add_routes(app, nested_chain, path="/v4", enabled_endpoints=["invoke"])
+for spec in chain_registry.specs.values():
+    add_routes(
+        app,
+        traced(chain_registry.runnable(spec.path), spec.path),
+        path=spec.path,
+        enabled_endpoints=spec.endpoints,
+        per_req_config_modifier=request_config_modifier,
+    )
+
+
+# Сброс кэша ответов LLM-этапа
+@app.delete("/cache")
+def invalidate_cache():
+    cache = get_response_cache()
+    if cache is not None:
+        cache.clear()
+    return {"cleared": cache is not None}
+
+
+# Счётчики экспорта трейсов (буферизованный режим и локальная запись)
+@app.get("/trace-export/stats")
+def trace_export_stats():
+    exporter = langfuse_utils.trace_exporter
+    return exporter.stats() if exporter is not None else {}
+
+
+# Очереди и отклонённые запросы admission control
+@app.get("/admission/stats")
+def admission_stats():
+    return {
+        endpoint: controller.stats()
+        for endpoint, controller in admission_controllers.items()
+    }
+
+
+# Метрики runnable'ов и endpoint'ов в формате Prometheus (METRICS_ENABLED)
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    return PlainTextResponse(
+        metrics.metrics.render(), media_type="text/plain; version=0.0.4"
+    )
+
+
+# Состояние подключения к Langfuse, сборки цепочек и время старта
+@app.get("/health")
+def health():
+    return {
+        "status": "ok",
+        "trace_sink": trace_sink(),
+        "langfuse": langfuse_health.snapshot(),
+        "chains": chain_registry.stats(),
+        "startup": startup_stats,
+        "worker": worker_stats.snapshot(),
+    }
+
+
+startup_stats = {"app_init_ms": round((time.perf_counter() - _started) * 1e3, 2)}
+_background_tasks = set()
+
+
+@app.on_event("startup")
+def init_tracing():
+    """
+    Handler трейсинга (и экспортёр буферизованного режима или локальной
+    записи) принадлежат процессу: потоки отправки не переживают fork.
+    """
+    worker_stats.reset()
+    trace_handler = init_trace_handler()
+    for runnable in traced_endpoints.values():
+        runnable.callbacks = [trace_handler]
+
+
+@app.on_event("startup")
+async def start_background_checks():
+    """
+    CHAIN_WARMUP: background (по умолчанию) - сборка цепочек в фоне,
+    eager - до приёма запросов, lazy - при первом запросе.
+    LANGFUSE_HEALTH_INTERVAL - период проверки Langfuse, сек (0 - однократно);
+    LANGFUSE_REQUIRED=1 - не стартовать, если Langfuse недоступен.
+    """
+    warmup = os.getenv("CHAIN_WARMUP", "background")
+    if warmup == "eager":
+        chain_registry.warm_up()
+    elif warmup == "background":
+        chain_registry.start_warm_up()
+
+    if trace_sink() != LOCAL_SINK:
+        if os.getenv("LANGFUSE_REQUIRED") == "1" and not await run_sync(
+            langfuse_health.check
+        ):
+            raise RuntimeError(f"Langfuse is unavailable: {langfuse_health.error}")
+        interval = float(os.getenv("LANGFUSE_HEALTH_INTERVAL", "60"))
+        task = asyncio.ensure_future(monitor_langfuse(interval))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+    startup_stats["ready_ms"] = round((time.perf_counter() - _started) * 1e3, 2)
+
+
+@app.on_event("shutdown")
+def flush_traces():
+    for task in list(_background_tasks):
+        task.cancel()
+    shutdown_langfuse()
 
-# Endpoint для вложенного стриминга
-add_routes(
-    app, nested_streaming_chain, path="/v5", enabled_endpoints=["invoke", "stream"]
-)
-# Endpoint для RetryRunnable chain
-add_routes(app, retry_chain, path="/v6", enabled_endpoints=["invoke", "stream"])
 
 if __name__ == "__main__":
     import uvicorn
 
+    # Один процесс для разработки; несколько worker'ов - server.py
     uvicorn.run(app, host="0.0.0.0", port=8000)
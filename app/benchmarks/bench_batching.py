@@ -0,0 +1,133 @@
+"""
+Пропускная способность LLM-этапа с микробатчингом и без него.
+
+SimpleLLM моделирует backend с ограниченным числом слотов
+(SIMPLE_LLM_MAX_CONCURRENCY): без пачек каждый запрос занимает слот целиком,
+с пачками один слот обслуживает до --max-batch-size запросов. Замер
+выполняется в процессе на цепочке create_chain (ainvoke/astream).
+
+Запуск:
+    python -m benchmarks.bench_batching --requests 200 --concurrency 64
+    python -m benchmarks.bench_batching --mode astream --window-ms 5 --output batching.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+INPUT = {"input": "привет"}
+
+
+def _ms(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1e3, 2)
+
+
+async def _call(chain: Any, mode: str) -> None:
+    if mode == "ainvoke":
+        await chain.ainvoke(INPUT)
+    else:
+        async for _ in chain.astream(INPUT):
+            pass
+
+
+async def run(chain: Any, mode: str, requests: int, concurrency: int) -> Dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    errors = 0
+
+    async def one() -> None:
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await _call(chain, mode)
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    elapsed = time.perf_counter() - started
+    return {
+        "rps": round(requests / elapsed, 2),
+        "errors": errors,
+        "latency_p50_ms": _ms(latencies, 0.5),
+        "latency_p99_ms": _ms(latencies, 0.99),
+    }
+
+
+def find_batcher(chain: Any) -> Any:
+    from core.micro_batching import MicroBatchingChatModel
+
+    for step in getattr(chain, "steps", []):
+        if isinstance(step, MicroBatchingChatModel):
+            return step.batcher
+    return None
+
+
+def measure(batching: bool, args: argparse.Namespace) -> Dict:
+    os.environ["LLM_BATCHING"] = "1" if batching else "0"
+    from runnables.chain_factory import create_chain
+
+    chain = create_chain({})
+    result = asyncio.run(run(chain, args.mode, args.requests, args.concurrency))
+    result["batching"] = batching
+    batcher = find_batcher(getattr(chain, "bound", chain))
+    if batcher is not None:
+        result["batcher"] = batcher.stats()
+    print(
+        f"batching={str(batching):<5} {args.mode:<8} rps={result['rps']} "
+        f"p50={result['latency_p50_ms']}ms p99={result['latency_p99_ms']}ms "
+        f"errors={result['errors']}",
+        file=sys.stderr,
+    )
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--mode", choices=("ainvoke", "astream"), default="ainvoke")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--max-batch-size", type=int, default=16)
+    parser.add_argument("--window-ms", type=float, default=10.0)
+    parser.add_argument("--slots", type=int, default=2, help="слоты backend'а")
+    parser.add_argument("--first-token-latency", type=float, default=0.2)
+    parser.add_argument("--tokens-per-second", type=float, default=100.0)
+    parser.add_argument("--batch-item-latency", type=float, default=0.005)
+    parser.add_argument("--output", help="файл для JSON-результата")
+    args = parser.parse_args()
+
+    os.environ["SIMPLE_LLM_MAX_CONCURRENCY"] = str(args.slots)
+    os.environ["SIMPLE_LLM_FIRST_TOKEN_LATENCY"] = str(args.first_token_latency)
+    os.environ["SIMPLE_LLM_TOKENS_PER_SECOND"] = str(args.tokens_per_second)
+    os.environ["SIMPLE_LLM_BATCH_ITEM_LATENCY"] = str(args.batch_item_latency)
+    os.environ["LLM_BATCH_MAX_SIZE"] = str(args.max_batch_size)
+    os.environ["LLM_BATCH_WINDOW_MS"] = str(args.window_ms)
+
+    results = [measure(batching, args) for batching in (False, True)]
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            **{k: v for k, v in vars(args).items() if k != "output"},
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+    payload = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(payload)
+    else:
+        print(payload)
@@ -0,0 +1,89 @@
+"""
+Бенчмарк экспорта трейсов: пропускная способность TraceExporter и
+поведение политик переполнения при медленном или недоступном Langfuse.
+
+Запуск: python -m benchmarks.bench_export --events 50000 --latency 0.05 --overflow sample
+"""
+
+import argparse
+import json
+import time
+
+from benchmarks.fake_langfuse import start_fake_langfuse
+from core.trace_export import (
+    LangfuseIngestionTransport,
+    TraceExporter,
+    OVERFLOW_POLICIES,
+    DROP_OLDEST,
+)
+
+
+def run(
+    events: int,
+    latency: float,
+    fail_rate: float,
+    overflow: str,
+    queue_size: int,
+    batch_size: int,
+    flush_interval: float,
+) -> dict:
+    server = start_fake_langfuse(latency=latency, fail_rate=fail_rate)
+    transport = LangfuseIngestionTransport(server.url, "pk", "sk")
+    exporter = TraceExporter(
+        transport,
+        max_queue_size=queue_size,
+        batch_size=batch_size,
+        flush_interval=flush_interval,
+        overflow=overflow,
+    )
+    event = {"type": "span-create", "body": {"id": "x", "input": "payload" * 10}}
+
+    started = time.perf_counter()
+    for idx in range(events):
+        exporter.submit({**event, "id": str(idx)})
+    submit_seconds = time.perf_counter() - started
+    exporter.shutdown(timeout=60)
+    total_seconds = time.perf_counter() - started
+    transport.close()
+    server.shutdown()
+
+    stats = exporter.stats()
+    return {
+        "overflow": overflow,
+        "events": events,
+        "submit_seconds": round(submit_seconds, 4),
+        "submit_us_per_event": round(submit_seconds / events * 1e6, 3),
+        "total_seconds": round(total_seconds, 4),
+        "sent_per_second": round(stats["sent"] / total_seconds, 1),
+        "exporter": stats,
+        "server": server.stats,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--events", type=int, default=20000)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument(
+        "--overflow", choices=OVERFLOW_POLICIES + ("all",), default=DROP_OLDEST
+    )
+    parser.add_argument("--queue-size", type=int, default=10000)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--flush-interval", type=float, default=1.0)
+    args = parser.parse_args()
+
+    policies = OVERFLOW_POLICIES if args.overflow == "all" else (args.overflow,)
+    results = [
+        run(
+            args.events,
+            args.latency,
+            args.fail_rate,
+            policy,
+            args.queue_size,
+            args.batch_size,
+            args.flush_interval,
+        )
+        for policy in policies
+    ]
+    print(json.dumps(results, indent=2, ensure_ascii=False))
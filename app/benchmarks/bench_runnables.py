@@ -0,0 +1,374 @@
+"""
+Микро-бенчмарк накладных расходов BaseTraceableRunnable, invoke_nested и
+RetryRunnable в сравнении с обычными RunnableLambda, а также шести
+демонстрационных цепочек из chain_factory.
+
+Каждый кейс прогоняется в режимах sync/async x invoke/stream и с тремя
+вариантами callback'ов: без callback'ов, с пустым handler'ом и с
+записывающим handler'ом. Результат (p50/p95/p99, throughput, аллокации)
+пишется в JSON; с --compare выполняется проверка регрессий.
+
+Запуск:
+    python -m benchmarks.bench_runnables --output bench.json
+    python -m benchmarks.bench_runnables --compare bench.json --tolerance 0.25
+"""
+
+import argparse
+import asyncio
+import json
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda
+
+from core.retry_runnable import RetryRunnable
+from core.stage_fusion import fuse_stages
+from runnables.chain_factory import (
+    create_chain,
+    create_chain_with_error,
+    create_streaming_chain,
+    create_nested_chain,
+    create_nested_streaming_chain,
+    create_retry_chain,
+)
+from runnables.custom_runnable import (
+    EchoRunnable,
+    UppercaseRunnable,
+    RaiseExceptionRunnable,
+    StreamingEchoRunnable,
+    NestedRunnable,
+    NestedStreamingRunnable,
+)
+
+MODES = ("invoke", "ainvoke", "stream", "astream")
+
+
+class NullHandler(BaseCallbackHandler):
+    """
+    Handler без логики: стоимость диспетчеризации callback'ов.
+    """
+
+
+class RecordingHandler(BaseCallbackHandler):
+    """
+    Handler, который запоминает все события (приближение к реальному экспорту).
+    """
+
+    def __init__(self) -> None:
+        self.events: List[tuple] = []
+
+    def on_chain_start(self, serialized, inputs, **kwargs: Any) -> None:
+        self.events.append(("chain_start", kwargs.get("name"), inputs))
+
+    def on_chain_end(self, outputs, **kwargs: Any) -> None:
+        self.events.append(("chain_end", outputs))
+
+    def on_chain_error(self, error, **kwargs: Any) -> None:
+        self.events.append(("chain_error", error))
+
+    def on_chat_model_start(self, serialized, messages, **kwargs: Any) -> None:
+        self.events.append(("chat_model_start", messages))
+
+    def on_llm_end(self, response, **kwargs: Any) -> None:
+        self.events.append(("llm_end", response))
+
+
+HANDLERS: Dict[str, Callable[[], List[BaseCallbackHandler]]] = {
+    "none": lambda: [],
+    "null": lambda: [NullHandler()],
+    "recording": lambda: [RecordingHandler()],
+}
+
+
+@dataclass
+class Case:
+    name: str
+    runnable: Runnable
+    input: Any
+    # Кейсы с искусственными задержками прогоняются меньшее число раз
+    slow: bool = False
+    expect_error: bool = False
+
+
+def build_cases() -> List[Case]:
+    chain_input = {"input": "привет"}
+    upper = RunnableLambda(lambda x: x.upper(), name="upper")
+    return [
+        # Базовые линии на чистом LangChain
+        Case("baseline.lambda_upper", upper, "hello"),
+        Case(
+            "baseline.lambda_nested",
+            RunnableLambda(lambda x, config: upper.invoke(x, config)),
+            "hello",
+        ),
+        Case(
+            "baseline.lambda_sequence",
+            RunnableLambda(lambda x: x) | upper,
+            "hello",
+        ),
+        # Кастомные runnable
+        Case("custom.UppercaseRunnable", UppercaseRunnable(), "hello"),
+        Case("custom.EchoRunnable", EchoRunnable(), "hello"),
+        Case(
+            "custom.RaiseExceptionRunnable",
+            RaiseExceptionRunnable(),
+            "hello",
+            expect_error=True,
+        ),
+        Case("custom.NestedRunnable", NestedRunnable(), "hello"),
+        Case("custom.StreamingEchoRunnable", StreamingEchoRunnable(), "ab", slow=True),
+        Case(
+            "custom.NestedStreamingRunnable",
+            NestedStreamingRunnable(),
+            "ab",
+            slow=True,
+        ),
+        Case(
+            "custom.RetryRunnable.success",
+            RetryRunnable(inner_runnable=UppercaseRunnable(), max_retries=3),
+            "hello",
+        ),
+        Case(
+            "custom.RetryRunnable.exhausted",
+            RetryRunnable(
+                inner_runnable=RaiseExceptionRunnable(), max_retries=3, delay=0
+            ),
+            "hello",
+            expect_error=True,
+        ),
+        # Цепочки из chain_factory
+        Case("chain.create_chain", create_chain({}), chain_input),
+        Case(
+            "chain.create_chain_with_error",
+            create_chain_with_error({}),
+            chain_input,
+            expect_error=True,
+        ),
+        Case(
+            "chain.create_streaming_chain",
+            create_streaming_chain({}),
+            chain_input,
+            slow=True,
+        ),
+        Case(
+            "chain.create_chain.fused_single",
+            fuse_stages(create_chain({}), "single"),
+            chain_input,
+        ),
+        Case(
+            "chain.create_chain.fused_children",
+            fuse_stages(create_chain({}), "children"),
+            chain_input,
+        ),
+        Case("chain.create_nested_chain", create_nested_chain({}), chain_input),
+        Case(
+            "chain.create_nested_streaming_chain",
+            create_nested_streaming_chain({}),
+            chain_input,
+            slow=True,
+        ),
+        Case(
+            "chain.create_retry_chain",
+            create_retry_chain({}),
+            chain_input,
+            slow=True,
+            expect_error=True,
+        ),
+    ]
+
+
+def _call_sync(case: Case, mode: str, config: RunnableConfig) -> None:
+    try:
+        if mode == "invoke":
+            case.runnable.invoke(case.input, config)
+        else:
+            for _ in case.runnable.stream(case.input, config):
+                pass
+    except Exception:
+        if not case.expect_error:
+            raise
+
+
+async def _call_async(case: Case, mode: str, config: RunnableConfig) -> None:
+    try:
+        if mode == "ainvoke":
+            await case.runnable.ainvoke(case.input, config)
+        else:
+            async for _ in case.runnable.astream(case.input, config):
+                pass
+    except Exception:
+        if not case.expect_error:
+            raise
+
+
+def _percentile(ordered: List[float], q: float) -> float:
+    idx = min(len(ordered) - 1, int(q * len(ordered)))
+    return ordered[idx]
+
+
+def measure(
+    case: Case, mode: str, handlers: str, iterations: int, warmup: int
+) -> Dict[str, Any]:
+    def make_config() -> RunnableConfig:
+        return {"callbacks": HANDLERS[handlers]()}
+
+    durations: List[float] = []
+    if mode in ("invoke", "stream"):
+        for _ in range(warmup):
+            _call_sync(case, mode, make_config())
+        started = time.perf_counter()
+        for _ in range(iterations):
+            config = make_config()
+            t0 = time.perf_counter()
+            _call_sync(case, mode, config)
+            durations.append(time.perf_counter() - t0)
+        wall = time.perf_counter() - started
+
+        tracemalloc.start()
+        snapshot_before = tracemalloc.get_traced_memory()[0]
+        _call_sync(case, mode, make_config())
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    else:
+
+        async def run() -> float:
+            for _ in range(warmup):
+                await _call_async(case, mode, make_config())
+            started = time.perf_counter()
+            for _ in range(iterations):
+                config = make_config()
+                t0 = time.perf_counter()
+                await _call_async(case, mode, config)
+                durations.append(time.perf_counter() - t0)
+            return time.perf_counter() - started
+
+        async def run_traced() -> tuple:
+            tracemalloc.start()
+            before = tracemalloc.get_traced_memory()[0]
+            await _call_async(case, mode, make_config())
+            memory = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            return before, memory
+
+        wall = asyncio.run(run())
+        snapshot_before, (current, peak) = asyncio.run(run_traced())
+
+    ordered = sorted(durations)
+    return {
+        "case": case.name,
+        "mode": mode,
+        "handlers": handlers,
+        "iterations": iterations,
+        "p50_us": round(_percentile(ordered, 0.50) * 1e6, 2),
+        "p95_us": round(_percentile(ordered, 0.95) * 1e6, 2),
+        "p99_us": round(_percentile(ordered, 0.99) * 1e6, 2),
+        "mean_us": round(statistics.fmean(ordered) * 1e6, 2),
+        "throughput_per_s": round(iterations / wall, 1) if wall else None,
+        "peak_alloc_bytes": peak - snapshot_before,
+    }
+
+
+def run_suite(
+    iterations: int,
+    slow_iterations: int,
+    warmup: int,
+    modes: List[str],
+    handlers: List[str],
+    only: Optional[str],
+) -> Dict[str, Any]:
+    results = []
+    for case in build_cases():
+        if only and only not in case.name:
+            continue
+        count = slow_iterations if case.slow else iterations
+        for mode in modes:
+            for handler in handlers:
+                result = measure(case, mode, handler, count, 0 if case.slow else warmup)
+                results.append(result)
+                print(
+                    f"{case.name:<40} {mode:<8} {handler:<10} "
+                    f"p50={result['p50_us']:>10.1f}us p99={result['p99_us']:>10.1f}us",
+                    file=sys.stderr,
+                )
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "iterations": iterations,
+            "slow_iterations": slow_iterations,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+
+
+def _key(result: Dict[str, Any]) -> tuple:
+    return result["case"], result["mode"], result["handlers"]
+
+
+def compare(
+    current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float, metric: str
+) -> List[str]:
+    """
+    Возвращает список регрессий: кейсы, где метрика выросла больше,
+    чем на `tolerance` относительно базового прогона.
+    """
+    previous = {_key(r): r for r in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        before = previous.get(_key(result))
+        if before is None or not before[metric]:
+            continue
+        ratio = result[metric] / before[metric]
+        if ratio > 1 + tolerance:
+            regressions.append(
+                f"{result['case']} [{result['mode']}/{result['handlers']}]: "
+                f"{metric} {before[metric]} -> {result[metric]} (x{ratio:.2f})"
+            )
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--iterations", type=int, default=500)
+    parser.add_argument("--slow-iterations", type=int, default=3)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--handlers", default=",".join(HANDLERS))
+    parser.add_argument("--only", help="подстрока имени кейса")
+    parser.add_argument("--output", help="файл для JSON-результата")
+    parser.add_argument("--compare", help="JSON базового прогона")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--metric", default="p50_us")
+    args = parser.parse_args()
+
+    report = run_suite(
+        args.iterations,
+        args.slow_iterations,
+        args.warmup,
+        args.modes.split(","),
+        args.handlers.split(","),
+        args.only,
+    )
+    payload = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(payload)
+    else:
+        print(payload)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance, args.metric)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,150 @@
+"""
+Время холодного старта приложения: импорт app.py, запуск (startup-события),
+сборка цепочек и первый запрос к каждому endpoint'у. Каждый замер -
+отдельный процесс, чтобы импорт был действительно холодным.
+
+Запуск:
+    python -m benchmarks.bench_startup --warmup lazy,background,eager
+    python -m benchmarks.bench_startup --langfuse-down --output startup.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List
+
+import httpx
+
+from benchmarks.fake_langfuse import start_fake_langfuse
+from core.chain_registry import import_string
+
+PAYLOAD = {"input": {"input": "привет"}}
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1e3, 2)
+
+
+async def _first_requests(app: Any, paths: List[str]) -> Dict[str, float]:
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    results = {}
+    async with httpx.AsyncClient(transport=transport, base_url="http://app") as client:
+        for path in paths:
+            started = time.perf_counter()
+            await client.post(f"{path}/invoke", json=PAYLOAD)
+            results[path] = _ms(time.perf_counter() - started)
+    return results
+
+
+async def _run_app(app: Any, registry: Any) -> Dict[str, Any]:
+    started = time.perf_counter()
+    async with app.router.lifespan_context(app):
+        startup = time.perf_counter() - started
+        first_requests = await _first_requests(app, list(registry.specs))
+    return {
+        "startup_ms": _ms(startup),
+        "first_request_ms": first_requests,
+        "chains": registry.stats(),
+    }
+
+
+def child() -> Dict[str, Any]:
+    """
+    Замер в текущем процессе (запускается из measure()).
+    """
+    started = time.perf_counter()
+    app = import_string("app:app")
+    chain_registry = import_string("app:chain_registry")
+    import_ms = _ms(time.perf_counter() - started)
+    result = asyncio.run(_run_app(app, chain_registry))
+    return {"import_ms": import_ms, **result}
+
+
+def measure(warmup: str, langfuse_url: str) -> Dict[str, Any]:
+    env = {
+        **os.environ,
+        "CHAIN_WARMUP": warmup,
+        "LANGFUSE_URL": langfuse_url,
+        "LANGFUSE_INIT_PROJECT_PUBLIC_KEY": "pk-lf-startup",
+        "LANGFUSE_INIT_PROJECT_SECRET_KEY": "sk-lf-startup",
+    }
+    started = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench_startup", "--child"],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    result["process_ms"] = _ms(time.perf_counter() - started)
+    result["warmup"] = warmup
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--warmup", default="lazy,background,eager")
+    parser.add_argument(
+        "--langfuse-latency",
+        type=float,
+        default=0.0,
+        help="задержка ответа заглушки Langfuse, с",
+    )
+    parser.add_argument(
+        "--langfuse-down",
+        action="store_true",
+        help="Langfuse недоступен (закрытый порт)",
+    )
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--output", help="файл для JSON-результата")
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(child()))
+        sys.exit(0)
+
+    sink = None
+    if args.langfuse_down:
+        url = "http://127.0.0.1:9"
+    else:
+        sink = start_fake_langfuse(latency=args.langfuse_latency)
+        url = sink.url
+    results = []
+    for warmup in args.warmup.split(","):
+        result = measure(warmup, url)
+        first = result["first_request_ms"]
+        print(
+            f"{warmup:<12} import={result['import_ms']}ms "
+            f"startup={result['startup_ms']}ms "
+            f"first_request_max={max(first.values(), default=0)}ms "
+            f"process={result['process_ms']}ms",
+            file=sys.stderr,
+        )
+        results.append(result)
+    if sink is not None:
+        sink.shutdown()
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "langfuse_latency": args.langfuse_latency,
+            "langfuse_down": args.langfuse_down,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+    payload = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(payload)
+    else:
+        print(payload)
@@ -0,0 +1,190 @@
+"""
+Объединение чанков стрима в кадры: число SSE-кадров и байт на стрим, время
+до первого кадра, длительность стрима и CPU сервера на стрим при разных
+настройках X-Stream-Coalesce.
+
+Сервер (server.py, один worker) запускается отдельным процессом с быстрым
+стримом посимвольного эхо (профиль симуляции `fast_stream`), запросы идут
+по сети, поэтому время до первого кадра - реальное время до первого байта.
+CPU worker'а читается из /proc (только Linux).
+
+Запуск:
+    python -m benchmarks.bench_stream_shaping --modes off,on,1024:50
+    python -m benchmarks.bench_stream_shaping --path /v5 --streams 200 --output shaping.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from benchmarks.bench_workers import wait_ready
+from benchmarks.fake_langfuse import start_fake_langfuse
+
+PROFILE = {
+    "fast_stream": {
+        "llm": {"tokens_per_second": 2000, "chunk_size": 4},
+        "streaming_echo": {"tokens_per_second": 1000},
+    }
+}
+
+
+def _ms(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1e3, 2)
+
+
+def cpu_seconds(pid: int) -> Optional[float]:
+    try:
+        with open(f"/proc/{pid}/stat", encoding="ascii") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    # utime и stime - 14-е и 15-е поля stat
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+async def one_stream(client: httpx.AsyncClient, path: str, mode: str) -> Dict:
+    started = time.perf_counter()
+    first = None
+    frames = size = 0
+    async with client.stream(
+        "POST",
+        f"{path}/stream",
+        json={"input": {"input": args.text}},
+        headers={"X-Stream-Coalesce": mode, "X-Trace-Sample": "0"},
+    ) as response:
+        async for line in response.aiter_lines():
+            size += len(line) + 1
+            if line.startswith("event: data"):
+                frames += 1
+                if first is None:
+                    first = time.perf_counter() - started
+    return {
+        "first_frame": first,
+        "total": time.perf_counter() - started,
+        "frames": frames,
+        "bytes": size,
+    }
+
+
+async def run_mode(url: str, worker_pid: int, mode: str) -> Dict[str, Any]:
+    semaphore = asyncio.Semaphore(args.concurrency)
+    async with httpx.AsyncClient(base_url=url, timeout=60) as client:
+
+        async def limited() -> Dict:
+            async with semaphore:
+                return await one_stream(client, args.path, mode)
+
+        cpu_before = cpu_seconds(worker_pid)
+        streams = await asyncio.gather(*(limited() for _ in range(args.streams)))
+        cpu_after = cpu_seconds(worker_pid)
+    result: Dict[str, Any] = {
+        "mode": mode,
+        "frames_per_stream": round(sum(s["frames"] for s in streams) / len(streams), 1),
+        "bytes_per_stream": round(sum(s["bytes"] for s in streams) / len(streams)),
+        "first_frame_p50_ms": _ms([s["first_frame"] for s in streams], 0.5),
+        "first_frame_p99_ms": _ms([s["first_frame"] for s in streams], 0.99),
+        "stream_p50_ms": _ms([s["total"] for s in streams], 0.5),
+        "server_cpu_ms_per_stream": None,
+    }
+    if cpu_before is not None and cpu_after is not None:
+        result["server_cpu_ms_per_stream"] = round(
+            (cpu_after - cpu_before) / len(streams) * 1e3, 2
+        )
+    return result
+
+
+def main() -> List[Dict[str, Any]]:
+    sink = start_fake_langfuse()
+    url = f"http://127.0.0.1:{args.port}"
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+        json.dump(PROFILE, f)
+        profiles_file = f.name
+    env = {
+        **os.environ,
+        "SIMULATION_PROFILES_FILE": profiles_file,
+        "SIMULATION_PROFILE": "fast_stream",
+        "CHAIN_WARMUP": "eager",
+        "LANGFUSE_URL": sink.url,
+        "LANGFUSE_INIT_PROJECT_PUBLIC_KEY": "pk-lf-shaping",
+        "LANGFUSE_INIT_PROJECT_SECRET_KEY": "sk-lf-shaping",
+    }
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "server.py",
+            "--host",
+            "127.0.0.1",
+            "--port",
+            str(args.port),
+            "--no-access-log",
+            "--log-level",
+            "warning",
+        ],
+        env=env,
+    )
+    results = []
+    try:
+        wait_ready(url, 60.0)
+        worker_pid = httpx.get(f"{url}/health").json()["worker"]["pid"]
+        # Прогрев: первый запрос собирает цепочку и прогревает пути
+        asyncio.run(run_mode(url, worker_pid, "off"))
+        for mode in args.modes.split(","):
+            result = asyncio.run(run_mode(url, worker_pid, mode))
+            print(
+                f"{mode:<10} frames={result['frames_per_stream']} "
+                f"bytes={result['bytes_per_stream']} "
+                f"first_frame_p50={result['first_frame_p50_ms']}ms "
+                f"stream_p50={result['stream_p50_ms']}ms "
+                f"cpu={result['server_cpu_ms_per_stream']}ms",
+                file=sys.stderr,
+            )
+            results.append(result)
+    finally:
+        server.terminate()
+        server.wait(timeout=60)
+        sink.shutdown()
+        os.unlink(profiles_file)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--modes", default="off,on,1024:50")
+    parser.add_argument("--path", default="/v3")
+    parser.add_argument("--streams", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--text", default="привет " * 20, help="вход запроса")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--output", help="файл для JSON-результата")
+    args = parser.parse_args()
+
+    results = main()
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            **{k: v for k, v in vars(args).items() if k != "output"},
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+    payload = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(payload)
+    else:
+        print(payload)
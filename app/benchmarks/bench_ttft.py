@@ -0,0 +1,128 @@
+"""
+Время до первого токена (TTFT) и полное время стрима для цепочек из
+chain_factory при заданной скорости генерации SimpleLLM.
+
+Замер выполняется в процессе, без HTTP: видно, на каком этапе цепочки
+стрим "склеивается" (например, шаг без поддержки transform ждёт весь
+ответ модели). TTFT по HTTP показывает benchmarks.load_test.
+
+Запуск:
+    python -m benchmarks.bench_ttft --tokens-per-second 50 --chunk-size 4
+    python -m benchmarks.bench_ttft --first-token-latency 0.2 --output ttft.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from langchain_core.runnables import Runnable
+
+CHAINS = (
+    "create_chain",
+    "create_streaming_chain",
+    "create_nested_chain",
+    "create_nested_streaming_chain",
+)
+
+
+def _ms(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1e3, 2)
+
+
+def measure_sync(runnable: Runnable, input: Any) -> Tuple[float, float, int]:
+    started = time.perf_counter()
+    first = None
+    count = 0
+    for _ in runnable.stream(input):
+        if first is None:
+            first = time.perf_counter() - started
+        count += 1
+    return first or 0.0, time.perf_counter() - started, count
+
+
+async def measure_async(runnable: Runnable, input: Any) -> Tuple[float, float, int]:
+    started = time.perf_counter()
+    first = None
+    count = 0
+    async for _ in runnable.astream(input):
+        if first is None:
+            first = time.perf_counter() - started
+        count += 1
+    return first or 0.0, time.perf_counter() - started, count
+
+
+def run_chain(name: str, build: Callable[[dict], Runnable], iterations: int) -> Dict:
+    runnable = build({})
+    input = {"input": "привет"}
+    result: Dict[str, Any] = {"chain": name}
+    for mode in ("stream", "astream"):
+        samples = []
+        for _ in range(iterations):
+            if mode == "stream":
+                samples.append(measure_sync(runnable, input))
+            else:
+                samples.append(asyncio.run(measure_async(runnable, input)))
+        ttft = [s[0] for s in samples]
+        total = [s[1] for s in samples]
+        result[mode] = {
+            "ttft_p50_ms": _ms(ttft, 0.5),
+            "ttft_p95_ms": _ms(ttft, 0.95),
+            "total_p50_ms": _ms(total, 0.5),
+            "chunks": round(statistics.fmean(s[2] for s in samples), 1),
+        }
+        print(
+            f"{name:<32} {mode:<8} ttft={result[mode]['ttft_p50_ms']}ms "
+            f"total={result[mode]['total_p50_ms']}ms chunks={result[mode]['chunks']}",
+            file=sys.stderr,
+        )
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--chunk-size", type=int, default=4)
+    parser.add_argument("--first-token-latency", type=float, default=0.1)
+    parser.add_argument("--iterations", type=int, default=3)
+    parser.add_argument("--chains", default=",".join(CHAINS))
+    parser.add_argument("--output", help="файл для JSON-результата")
+    args = parser.parse_args()
+
+    # Цепочки создают SimpleLLM.from_env()
+    os.environ["SIMPLE_LLM_TOKENS_PER_SECOND"] = str(args.tokens_per_second)
+    os.environ["SIMPLE_LLM_CHUNK_SIZE"] = str(args.chunk_size)
+    os.environ["SIMPLE_LLM_FIRST_TOKEN_LATENCY"] = str(args.first_token_latency)
+    from runnables import chain_factory
+
+    results = [
+        run_chain(name, getattr(chain_factory, name), args.iterations)
+        for name in args.chains.split(",")
+    ]
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "tokens_per_second": args.tokens_per_second,
+            "chunk_size": args.chunk_size,
+            "first_token_latency": args.first_token_latency,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+    payload = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(payload)
+    else:
+        print(payload)
@@ -0,0 +1,143 @@
+"""
+Масштабирование пропускной способности по числу worker'ов server.py.
+
+Для каждого числа worker'ов сервер запускается отдельным процессом (с
+заглушкой Langfuse и CPU-нагруженным профилем симуляции), после чего по
+сети гоняется benchmarks.load_test. В отчёте - RPS и латентность по
+сценариям и ускорение относительно первого прогона.
+
+Запуск:
+    python -m benchmarks.bench_workers --workers 1,2,4
+    python -m benchmarks.bench_workers --profile cpu_bound --scenarios v4.invoke --output workers.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+import httpx
+
+from benchmarks.fake_langfuse import start_fake_langfuse
+
+
+def wait_ready(url: str, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"{url}/health", timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise TimeoutError(f"server at {url} is not ready")
+
+
+def measure(workers: int, args: argparse.Namespace, langfuse_url: str) -> Dict:
+    url = f"http://127.0.0.1:{args.port}"
+    env = {
+        **os.environ,
+        "SIMULATION_PROFILE": args.profile,
+        "CHAIN_WARMUP": "eager",
+        "LANGFUSE_URL": langfuse_url,
+        "LANGFUSE_INIT_PROJECT_PUBLIC_KEY": "pk-lf-workers",
+        "LANGFUSE_INIT_PROJECT_SECRET_KEY": "sk-lf-workers",
+    }
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "server.py",
+            "--host",
+            "127.0.0.1",
+            "--port",
+            str(args.port),
+            "--workers",
+            str(workers),
+            "--preload",
+            "--no-access-log",
+            "--log-level",
+            "warning",
+        ],
+        env=env,
+    )
+    try:
+        wait_ready(url, args.startup_timeout)
+        with tempfile.NamedTemporaryFile(suffix=".json") as output:
+            subprocess.run(
+                [
+                    sys.executable,
+                    "-m",
+                    "benchmarks.load_test",
+                    "--url",
+                    url,
+                    "--scenarios",
+                    args.scenarios,
+                    "--duration",
+                    str(args.duration),
+                    "--concurrency",
+                    str(args.concurrency),
+                    "--output",
+                    output.name,
+                ],
+                check=True,
+            )
+            with open(output.name, encoding="utf-8") as f:
+                report = json.load(f)
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=60)
+    return {
+        "workers": workers,
+        "results": report["results"],
+        "rps": round(sum(r["rps"] for r in report["results"]), 2),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--workers", default=f"1,2,{os.cpu_count() or 4}")
+    parser.add_argument("--profile", default="cpu_bound")
+    parser.add_argument("--scenarios", default="v1.invoke,v4.invoke")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--startup-timeout", type=float, default=60.0)
+    parser.add_argument("--output", help="файл для JSON-результата")
+    args = parser.parse_args()
+
+    sink = start_fake_langfuse()
+    runs: List[Dict[str, Any]] = []
+    for workers in sorted({int(w) for w in args.workers.split(",")}):
+        run = measure(workers, args, sink.url)
+        run["speedup"] = round(run["rps"] / runs[0]["rps"], 2) if runs else 1.0
+        print(
+            f"workers={workers:<3} rps={run['rps']} speedup={run['speedup']}",
+            file=sys.stderr,
+        )
+        runs.append(run)
+    sink.shutdown()
+
+    report: Dict[str, Any] = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            **{k: v for k, v in vars(args).items() if k != "output"},
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "runs": runs,
+    }
+    payload = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(payload)
+    else:
+        print(payload)
@@ -0,0 +1,145 @@
+"""
+Локальная заглушка Langfuse Ingestion API для офлайн-бенчмарков.
+
+Запуск: python -m benchmarks.fake_langfuse --port 3001 --latency 0.05 --fail-rate 0.1
+"""
+
+import argparse
+import gzip
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Tuple
+
+from opentelemetry.proto.collector.trace.v1.trace_service_pb2 import (
+    ExportTraceServiceRequest,
+)
+
+
+class FakeLangfuseServer(ThreadingHTTPServer):
+    """
+    HTTP-сервер, принимающий POST /api/public/ingestion и OTLP-экспорт
+    /api/public/otel/v1/traces с настраиваемой задержкой и долей ошибок.
+    Счётчики доступны через GET /stats: `events` - события Ingestion API,
+    `spans` - span'ы OTLP.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: Tuple[str, int],
+        latency: float = 0.0,
+        fail_rate: float = 0.0,
+    ) -> None:
+        super().__init__(address, _Handler)
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "events": 0, "spans": 0, "failed_requests": 0}
+
+    @property
+    def url(self) -> str:
+        host, port = self.socket.getsockname()[:2]
+        return f"http://{host}:{port}"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: FakeLangfuseServer
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+    def _reply(self, status: int, payload: dict) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        if self.path == "/api/public/health":
+            self._reply(200, {"status": "OK"})
+        elif self.path == "/api/public/projects":
+            # Ответ для Langfuse.auth_check()
+            self._reply(
+                200, {"data": [{"id": "fake-project", "name": "fake", "metadata": {}}]}
+            )
+        elif self.path == "/stats":
+            with self.server.lock:
+                self._reply(200, dict(self.server.stats))
+        else:
+            self._reply(404, {"error": "not found"})
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length", 0))
+        raw = self.rfile.read(length)
+        if self.path not in ("/api/public/ingestion", "/api/public/otel/v1/traces"):
+            self._reply(404, {"error": "not found"})
+            return
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        with self.server.lock:
+            self.server.stats["requests"] += 1
+        if random.random() < self.server.fail_rate:
+            with self.server.lock:
+                self.server.stats["failed_requests"] += 1
+            self._reply(503, {"error": "unavailable"})
+            return
+        if self.path == "/api/public/otel/v1/traces":
+            spans = self._count_spans(raw)
+            with self.server.lock:
+                self.server.stats["spans"] += spans
+            self._reply(200, {})
+            return
+        batch = json.loads(raw or b"{}").get("batch", [])
+        with self.server.lock:
+            self.server.stats["events"] += len(batch)
+        self._reply(
+            207,
+            {"successes": [{"id": e.get("id"), "status": 201} for e in batch]},
+        )
+
+    def _count_spans(self, raw: bytes) -> int:
+        # Экспортёр OTLP/HTTP шлёт protobuf (или JSON), возможно со сжатием
+        if self.headers.get("Content-Encoding") == "gzip":
+            raw = gzip.decompress(raw)
+        if "json" in self.headers.get("Content-Type", ""):
+            data = json.loads(raw or b"{}")
+            return sum(
+                len(scope.get("spans", []))
+                for resource in data.get("resourceSpans", [])
+                for scope in resource.get("scopeSpans", [])
+            )
+        request = ExportTraceServiceRequest()
+        request.ParseFromString(raw)
+        return sum(
+            len(scope.spans)
+            for resource in request.resource_spans
+            for scope in resource.scope_spans
+        )
+
+
+def start_fake_langfuse(
+    port: int = 0, latency: float = 0.0, fail_rate: float = 0.0
+) -> FakeLangfuseServer:
+    """
+    Запускает заглушку в фоновом потоке (port=0 - свободный порт).
+    """
+    server = FakeLangfuseServer(("127.0.0.1", port), latency, fail_rate)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=3001)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    server = FakeLangfuseServer(("0.0.0.0", args.port), args.latency, args.fail_rate)
+    print(f"Fake Langfuse ingestion listening on {server.url}")
+    server.serve_forever()
@@ -0,0 +1,428 @@
+"""
+Нагрузочный тест endpoint'ов langserve (/v1-/v7).
+
+По умолчанию FastAPI-приложение запускается в этом же процессе и
+вызывается напрямую через ASGI, Langfuse подменяется локальной заглушкой
+(benchmarks.fake_langfuse), так что сеть не нужна. С --url нагрузка
+подаётся на уже запущенный uvicorn.
+
+Два режима подачи нагрузки:
+- замкнутый (по умолчанию): `--concurrency` воркеров шлют запросы подряд;
+- открытый (--rate): запросы приходят пуассоновским потоком с заданной
+  интенсивностью, `--concurrency` ограничивает число одновременных.
+
+Для каждого сценария считаются RPS, перцентили латентности, доля ошибок,
+а для stream-endpoint'ов - время до первого чанка и паузы между чанками.
+
+Запуск:
+    python -m benchmarks.load_test --duration 10 --concurrency 16
+    python -m benchmarks.load_test --scenarios v3.stream,v6.stream --rate 50
+    python -m benchmarks.load_test --url http://localhost:8000 --output load.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+from benchmarks.fake_langfuse import start_fake_langfuse
+from core.chain_registry import import_string
+
+PAYLOAD = {"input": {"input": "привет"}}
+
+
+@dataclass
+class Scenario:
+    name: str
+    path: str
+    stream: bool = False
+
+
+SCENARIOS: Dict[str, Scenario] = {
+    s.name: s
+    for s in (
+        Scenario("v1.invoke", "/v1/invoke"),
+        Scenario("v2.invoke", "/v2/invoke"),
+        Scenario("v3.stream", "/v3/stream", stream=True),
+        Scenario("v4.invoke", "/v4/invoke"),
+        Scenario("v5.stream", "/v5/stream", stream=True),
+        Scenario("v6.stream", "/v6/stream", stream=True),
+        Scenario("v7.stream", "/v7/stream", stream=True),
+    )
+}
+
+
+@dataclass
+class Sample:
+    """
+    Результат одного запроса. Времена - секунды от его отправки.
+    """
+
+    status: int
+    latency: float
+    chunks: List[float] = field(default_factory=list)
+    error: Optional[str] = None
+
+
+Sender = Callable[[Scenario], Awaitable[Sample]]
+
+
+def _stream_error(body: bytes) -> Optional[str]:
+    # langserve отдаёт ошибку стрима событием SSE при статусе 200
+    if b"event: error" in body:
+        return "sse_error"
+    return None
+
+
+def _root_cause(error: BaseException) -> str:
+    # sse_starlette заворачивает ошибку генератора в ExceptionGroup
+    nested = getattr(error, "exceptions", None)
+    while nested:
+        error = nested[0]
+        nested = getattr(error, "exceptions", None)
+    return type(error).__name__
+
+
+def asgi_sender(app: Any, headers: Dict[str, str]) -> Sender:
+    """
+    Вызывает ASGI-приложение напрямую. httpx.ASGITransport отдаёт тело
+    только целиком, поэтому для замера чанков используется свой send().
+    """
+    body = json.dumps(PAYLOAD).encode("utf-8")
+    raw_headers = [(b"content-type", b"application/json")] + [
+        (k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers.items()
+    ]
+
+    async def send_request(scenario: Scenario) -> Sample:
+        started = time.perf_counter()
+        done = asyncio.Event()
+        request_sent = False
+        status = 0
+        chunks: List[float] = []
+        content: List[bytes] = []
+
+        async def receive() -> Dict[str, Any]:
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            # Дальше клиент "висит" на соединении до конца ответа
+            await done.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message: Dict[str, Any]) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                chunk = message.get("body", b"")
+                if chunk:
+                    chunks.append(time.perf_counter() - started)
+                    content.append(chunk)
+                if not message.get("more_body", False):
+                    done.set()
+
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "POST",
+            "scheme": "http",
+            "path": scenario.path,
+            "raw_path": scenario.path.encode("ascii"),
+            "query_string": b"",
+            "root_path": "",
+            "headers": raw_headers,
+            "client": ("127.0.0.1", 50000),
+            "server": ("testserver", 80),
+        }
+        try:
+            await app(scope, receive, send)
+        except Exception as e:
+            # Так uvicorn оборвал бы соединение; статус мог уже уйти клиенту
+            done.set()
+            return Sample(
+                status or 500,
+                time.perf_counter() - started,
+                chunks,
+                error=f"exception:{_root_cause(e)}",
+            )
+        done.set()
+        return _make_sample(scenario, status, started, chunks, b"".join(content))
+
+    return send_request
+
+
+def http_sender(client: httpx.AsyncClient, headers: Dict[str, str]) -> Sender:
+    """
+    Запросы к запущенному серверу по сети.
+    """
+
+    async def send_request(scenario: Scenario) -> Sample:
+        started = time.perf_counter()
+        chunks: List[float] = []
+        content: List[bytes] = []
+        try:
+            async with client.stream(
+                "POST", scenario.path, json=PAYLOAD, headers=headers
+            ) as response:
+                async for chunk in response.aiter_bytes():
+                    chunks.append(time.perf_counter() - started)
+                    content.append(chunk)
+        except httpx.HTTPError as e:
+            return Sample(0, time.perf_counter() - started, error=type(e).__name__)
+        return _make_sample(
+            scenario, response.status_code, started, chunks, b"".join(content)
+        )
+
+    return send_request
+
+
+def _make_sample(
+    scenario: Scenario,
+    status: int,
+    started: float,
+    chunks: List[float],
+    content: bytes,
+) -> Sample:
+    error = None
+    if status >= 400:
+        error = f"http_{status}"
+    elif scenario.stream:
+        error = _stream_error(content)
+    return Sample(status, time.perf_counter() - started, chunks, error)
+
+
+async def run_closed(
+    send_request: Sender, scenario: Scenario, concurrency: int, deadline: float
+) -> List[Sample]:
+    samples: List[Sample] = []
+
+    async def worker() -> None:
+        while time.perf_counter() < deadline:
+            samples.append(await send_request(scenario))
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return samples
+
+
+async def run_open(
+    send_request: Sender,
+    scenario: Scenario,
+    rate: float,
+    concurrency: int,
+    deadline: float,
+) -> Tuple[List[Sample], int]:
+    """
+    Пуассоновский поток запросов. Запросы сверх лимита одновременных
+    не ставятся в очередь, а учитываются как `rejected`: так видна
+    точка насыщения, а не растущая очередь клиента.
+    """
+    samples: List[Sample] = []
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks = set()
+    rejected = 0
+
+    async def one() -> None:
+        try:
+            samples.append(await send_request(scenario))
+        finally:
+            semaphore.release()
+
+    while time.perf_counter() < deadline:
+        await asyncio.sleep(random.expovariate(rate))
+        if semaphore.locked():
+            rejected += 1
+            continue
+        await semaphore.acquire()
+        task = asyncio.create_task(one())
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.gather(*tasks)
+    return samples, rejected
+
+
+def _percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    if not values:
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None, "max_ms": None}
+    ordered = sorted(values)
+
+    def pick(q: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1e3, 2)
+
+    return {
+        "p50_ms": pick(0.50),
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99),
+        "max_ms": round(ordered[-1] * 1e3, 2),
+    }
+
+
+def summarize(
+    scenario: Scenario, samples: List[Sample], wall: float, rejected: int = 0
+) -> Dict[str, Any]:
+    errors: Dict[str, int] = {}
+    for sample in samples:
+        if sample.error:
+            errors[sample.error] = errors.get(sample.error, 0) + 1
+    failed = sum(errors.values())
+    result: Dict[str, Any] = {
+        "scenario": scenario.name,
+        "path": scenario.path,
+        "requests": len(samples),
+        "rejected": rejected,
+        "rps": round(len(samples) / wall, 1) if wall else None,
+        "error_rate": round(failed / len(samples), 4) if samples else None,
+        "errors": errors,
+        "latency": _percentiles([s.latency for s in samples]),
+    }
+    if scenario.stream:
+        ok = [s for s in samples if not s.error and s.chunks]
+        gaps = [b - a for s in ok for a, b in zip(s.chunks, s.chunks[1:])]
+        result["ttfc"] = _percentiles([s.chunks[0] for s in ok])
+        result["inter_chunk_gap"] = _percentiles(gaps)
+        result["chunks_per_request"] = (
+            round(statistics.fmean(len(s.chunks) for s in ok), 1) if ok else None
+        )
+    return result
+
+
+async def run_load(
+    send_request: Sender,
+    scenarios: List[Scenario],
+    duration: float,
+    concurrency: int,
+    rate: Optional[float],
+    warmup: int,
+) -> List[Dict[str, Any]]:
+    results = []
+    for scenario in scenarios:
+        for _ in range(warmup):
+            await send_request(scenario)
+        started = time.perf_counter()
+        deadline = started + duration
+        rejected = 0
+        if rate:
+            samples, rejected = await run_open(
+                send_request, scenario, rate, concurrency, deadline
+            )
+        else:
+            samples = await run_closed(send_request, scenario, concurrency, deadline)
+        result = summarize(scenario, samples, time.perf_counter() - started, rejected)
+        results.append(result)
+        print(
+            f"{scenario.name:<10} rps={result['rps']:>8} "
+            f"p50={result['latency']['p50_ms']}ms p99={result['latency']['p99_ms']}ms "
+            f"errors={result['error_rate']}",
+            file=sys.stderr,
+        )
+    return results
+
+
+def load_app(langfuse_latency: float) -> Tuple[Any, Any]:
+    """
+    Импортирует app.py с Langfuse, направленным на локальную заглушку.
+    """
+    sink = start_fake_langfuse(latency=langfuse_latency)
+    os.environ["LANGFUSE_URL"] = sink.url
+    os.environ.setdefault("LANGFUSE_INIT_PROJECT_PUBLIC_KEY", "pk-lf-load-test")
+    os.environ.setdefault("LANGFUSE_INIT_PROJECT_SECRET_KEY", "sk-lf-load-test")
+    # Модуль app.py импортируется по имени: статический "from app import app"
+    # путает mypy с пакетом app/ при проверке из корня репозитория
+    return import_string("app:app"), sink
+
+
+async def main(args: argparse.Namespace) -> Dict[str, Any]:
+    scenarios = [SCENARIOS[name] for name in args.scenarios.split(",")]
+    headers = {}
+    if args.trace_sample is not None:
+        headers["X-Trace-Sample"] = args.trace_sample
+
+    sink = None
+    lifespan: Any = None
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=args.timeout)
+        send_request = http_sender(client, headers)
+    else:
+        app, sink = load_app(args.langfuse_latency)
+        # Startup-события создают Langfuse handler и прогревают цепочки
+        lifespan = app.router.lifespan_context(app)
+        await lifespan.__aenter__()
+        send_request = asgi_sender(app, headers)
+
+    try:
+        results = await run_load(
+            send_request,
+            scenarios,
+            args.duration,
+            args.concurrency,
+            args.rate,
+            args.warmup,
+        )
+    finally:
+        if args.url:
+            await client.aclose()
+        else:
+            # Shutdown-событие отправляет накопленные трейсы
+            await lifespan.__aexit__(None, None, None)
+
+    report: Dict[str, Any] = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "target": args.url or "in-process",
+            "duration": args.duration,
+            "concurrency": args.concurrency,
+            "rate": args.rate,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+    if sink is not None:
+        with sink.lock:
+            report["langfuse_sink"] = dict(sink.stats)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--url", help="адрес запущенного сервера")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument(
+        "--rate", type=float, help="запросов в секунду (открытый режим)"
+    )
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument(
+        "--trace-sample", choices=("0", "1"), help="значение заголовка X-Trace-Sample"
+    )
+    parser.add_argument(
+        "--langfuse-latency",
+        type=float,
+        default=0.0,
+        help="задержка ответа заглушки Langfuse, с",
+    )
+    parser.add_argument("--output", help="файл для JSON-результата")
+    args = parser.parse_args()
+
+    report = asyncio.run(main(args))
+    payload = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(payload)
+    else:
+        print(payload)
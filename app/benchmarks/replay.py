@@ -0,0 +1,317 @@
+"""
+Replay записанных трейсов (TRACE_SINK=local) для офлайн-проверки регрессий.
+
+Из записи берутся корневые span'ы запросов (имя - endpoint, вход, выход,
+время начала и конца). Входы заново прогоняются через цепочку endpoint'а
+(фабрика из маршрутов chain_factory или --chain) в этом же процессе тем
+же методом (invoke или stream) и с исходными интервалами между запросами
+(--speed 2 - вдвое быстрее, --speed 0 - без пауз, с ограничением
+--concurrency). В отчёте - перцентили латентности записи и replay, их
+отношение, доля совпавших выходов и примеры расхождений.
+
+Латентность записи - длительность корневого span'а на сервере (без сети,
+с callback'ами трейсинга); replay выполняется без трейсинга. Профиль
+симуляции и остальные настройки цепочки берутся из окружения, как при
+записи. Для replay нужны полные входы: без PAYLOAD_* политики, которая
+обрезает или хэширует строки.
+
+Запуск:
+    python -m benchmarks.replay traces --endpoint /v1
+    python -m benchmarks.replay traces --endpoint /v3 --speed 2
+    python -m benchmarks.replay traces --endpoint /v1 --chain create_nested_chain --speed 0
+    python -m benchmarks.replay traces --endpoint /v4 --tolerance 0.2 --output replay.json
+"""
+
+import argparse
+import asyncio
+import json
+import platform
+import sys
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from langchain_core.runnables import Runnable, RunnableConfig
+
+from benchmarks.load_test import _percentiles
+from core.base_traceable_runnable import _aggregate_chunks
+from core.chain_registry import import_string, load_chain_specs
+from core.ingestion_handler import _jsonable
+from core.trace_sink import read_events
+from runnables.chain_factory import ROUTES
+
+
+@dataclass
+class Recording:
+    """
+    Записанный запрос: корневой span трейса.
+    """
+
+    name: str
+    start: datetime
+    end: datetime
+    input: Any
+    output: Any = None
+    error: Optional[str] = None
+    # Метод langserve, которым пришёл запрос (invoke, stream, ...)
+    method: Optional[str] = None
+
+    @property
+    def latency(self) -> float:
+        return (self.end - self.start).total_seconds()
+
+
+def load_recordings(paths: List[str], endpoint: Optional[str]) -> List[Recording]:
+    roots: Dict[str, Dict[str, Any]] = {}
+    for event in read_events(paths):
+        body = event["body"]
+        if body.get("id") != body.get("traceId"):
+            continue
+        if event["type"] == "span-create":
+            roots[body["id"]] = {
+                "name": body.get("name"),
+                "start": body["startTime"],
+                "input": body.get("input"),
+                "method": (body.get("metadata") or {}).get("__langserve_endpoint"),
+            }
+        elif event["type"] == "span-update" and body["id"] in roots:
+            root = roots[body["id"]]
+            root["end"] = body["endTime"]
+            root["output"] = body.get("output")
+            if "input" in body:
+                root["input"] = body["input"]
+            if body.get("level") == "ERROR":
+                root["error"] = body.get("statusMessage") or "error"
+    recordings = [
+        Recording(
+            name=root["name"],
+            start=datetime.fromisoformat(root["start"]),
+            end=datetime.fromisoformat(root["end"]),
+            input=root["input"],
+            output=root.get("output"),
+            error=root.get("error"),
+            method=root["method"],
+        )
+        for root in roots.values()
+        if "end" in root and (endpoint is None or root["name"] == endpoint)
+    ]
+    return sorted(recordings, key=lambda r: r.start)
+
+
+def build_chain(endpoint: Optional[str], chain: Optional[str]) -> Runnable:
+    """
+    Цепочка для replay: --chain ("модуль:функция" или имя фабрики из
+    runnables.chain_factory), иначе фабрика маршрута endpoint'а.
+    """
+    if chain is None:
+        specs = {spec.path: spec for spec in load_chain_specs(ROUTES)}
+        if endpoint not in specs:
+            raise SystemExit(f"unknown endpoint {endpoint!r}, use --chain")
+        chain = specs[endpoint].factory
+    elif ":" not in chain:
+        chain = f"runnables.chain_factory:{chain}"
+    return import_string(chain)(RunnableConfig())
+
+
+def _normalize(value: Any) -> Any:
+    # Выход replay приводится к JSON так же, как при записи
+    return json.loads(json.dumps(_jsonable(value), ensure_ascii=False, default=str))
+
+
+async def replay_one(
+    chain: Runnable, recording: Recording, mode: str = "auto"
+) -> Dict[str, Any]:
+    """
+    mode: invoke, stream или auto - тем же методом, что и при записи.
+    """
+    started = time.perf_counter()
+    output = error = None
+    try:
+        if mode == "auto":
+            mode = "stream" if recording.method == "stream" else "invoke"
+        if mode == "stream":
+            output = _aggregate_chunks(
+                [chunk async for chunk in chain.astream(recording.input)]
+            )
+        else:
+            output = await chain.ainvoke(recording.input)
+    except Exception as e:
+        error = repr(e)
+    return {
+        "latency": time.perf_counter() - started,
+        "output": _normalize(output) if error is None else None,
+        "error": error,
+    }
+
+
+async def replay(
+    chain: Runnable,
+    recordings: List[Recording],
+    mode: str = "auto",
+    speed: float = 1.0,
+    concurrency: int = 16,
+) -> List[Dict]:
+    """
+    Прогоняет записи с исходными интервалами, ускоренными в `speed` раз;
+    при speed=0 - без пауз, не больше `concurrency` запросов одновременно.
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+    first = recordings[0].start
+    began = loop.time()
+
+    async def one(recording: Recording) -> Dict[str, Any]:
+        lag = 0.0
+        if speed > 0:
+            due = (recording.start - first).total_seconds() / speed
+            delay = due - (loop.time() - began)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            lag = loop.time() - began - due
+            result = await replay_one(chain, recording, mode)
+        else:
+            async with semaphore:
+                result = await replay_one(chain, recording, mode)
+        result["lag"] = lag
+        return result
+
+    return await asyncio.gather(*(one(r) for r in recordings))
+
+
+def compare(
+    recordings: List[Recording],
+    results: List[Dict],
+    examples: int = 5,
+    tolerance: Optional[float] = None,
+    min_match: Optional[float] = None,
+) -> Dict[str, Any]:
+    """
+    Сводка replay: регрессия - рост p50/p99 больше `tolerance` или доля
+    совпавших выходов ниже `min_match`; в отчёт попадает не больше
+    `examples` расхождений.
+    """
+    matched = 0
+    mismatches: List[Dict[str, Any]] = []
+    for recording, result in zip(recordings, results):
+        if recording.error is not None or result["error"] is not None:
+            same = (recording.error is None) == (result["error"] is None)
+        else:
+            same = recording.output == result["output"]
+        if same:
+            matched += 1
+        elif len(mismatches) < examples:
+            mismatches.append(
+                {
+                    "input": recording.input,
+                    "recorded": recording.error or recording.output,
+                    "replayed": result["error"] or result["output"],
+                }
+            )
+    recorded = _percentiles([r.latency for r in recordings])
+    replayed = _percentiles([r["latency"] for r in results])
+    ratio: Dict[str, Optional[float]] = {}
+    for key in ("p50_ms", "p99_ms"):
+        before, after = recorded[key], replayed[key]
+        ratio[key] = round(after / before, 3) if before and after is not None else None
+    regressions = [
+        key
+        for key, value in ratio.items()
+        if tolerance is not None and value and value > 1 + tolerance
+    ]
+    if min_match is not None and matched / len(recordings) < min_match:
+        regressions.append("output_match")
+    return {
+        "requests": len(recordings),
+        "recorded_latency": recorded,
+        "replay_latency": replayed,
+        "latency_ratio": ratio,
+        "recorded_errors": sum(r.error is not None for r in recordings),
+        "replay_errors": sum(r["error"] is not None for r in results),
+        "output_match_rate": round(matched / len(recordings), 4),
+        "max_lag_ms": round(max(r["lag"] for r in results) * 1e3, 2),
+        "regressions": regressions,
+        "mismatches": mismatches,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("paths", nargs="+", help="файлы или каталоги записи")
+    parser.add_argument("--endpoint", help="только запросы этого endpoint'а")
+    parser.add_argument("--chain", help="фабрика цепочки вместо фабрики маршрута")
+    parser.add_argument(
+        "--mode",
+        choices=("auto", "invoke", "stream"),
+        default="auto",
+        help="auto - тем же методом, что и при записи",
+    )
+    parser.add_argument(
+        "--speed", type=float, default=1.0, help="масштаб темпа; 0 - без пауз"
+    )
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--limit", type=int, help="не больше N первых запросов")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        help="допустимый рост p50/p99 (0.2 - на 20%%), иначе код выхода 1",
+    )
+    parser.add_argument(
+        "--min-match", type=float, help="минимальная доля совпавших выходов"
+    )
+    parser.add_argument("--examples", type=int, default=5)
+    parser.add_argument("--output", help="файл для JSON-результата")
+    args = parser.parse_args()
+
+    recordings = load_recordings(args.paths, args.endpoint)[: args.limit]
+    if not recordings:
+        raise SystemExit("no recorded requests found")
+    names = {r.name for r in recordings}
+    if args.chain is None and len(names) > 1:
+        raise SystemExit(
+            f"recording has several endpoints {sorted(names)}, use --endpoint"
+        )
+    chain = build_chain(args.endpoint or names.pop(), args.chain)
+    results = asyncio.run(
+        replay(
+            chain,
+            recordings,
+            mode=args.mode,
+            speed=args.speed,
+            concurrency=args.concurrency,
+        )
+    )
+    summary = compare(
+        recordings,
+        results,
+        examples=args.examples,
+        tolerance=args.tolerance,
+        min_match=args.min_match,
+    )
+    print(
+        f"requests={summary['requests']} "
+        f"recorded_p50={summary['recorded_latency']['p50_ms']}ms "
+        f"replay_p50={summary['replay_latency']['p50_ms']}ms "
+        f"ratio={summary['latency_ratio']} "
+        f"match={summary['output_match_rate']}",
+        file=sys.stderr,
+    )
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            **{k: v for k, v in vars(args).items() if k != "output"},
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "summary": summary,
+    }
+    payload = json.dumps(report, indent=2, ensure_ascii=False, default=str)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(payload)
+    else:
+        print(payload)
+    if summary["regressions"]:
+        sys.exit(1)
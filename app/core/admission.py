@@ -0,0 +1,254 @@
+import asyncio
+import heapq
+import itertools
+import json
+import math
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from core.resilience import LatencyTracker
+
+PRIORITY_HEADER = "x-priority"
+PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+DEFAULT_PRIORITY = PRIORITIES["normal"]
+
+# Только запуски цепочек; схемы, playground и т.п. не ограничиваются
+RUN_SUFFIXES = ("/invoke", "/batch", "/stream", "/stream_log", "/stream_events")
+
+QUEUE_FULL = "queue_full"
+QUEUE_TIMEOUT = "queue_timeout"
+EVICTED = "evicted"
+
+
+class AdmissionRejected(Exception):
+    """
+    Запрос не допущен к выполнению: очередь переполнена или истекло
+    время ожидания в ней.
+    """
+
+    def __init__(self, reason: str, retry_after: int) -> None:
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def parse_priority(value: Optional[str]) -> int:
+    if value is None:
+        return DEFAULT_PRIORITY
+    return PRIORITIES.get(value.strip().lower(), DEFAULT_PRIORITY)
+
+
+class AdmissionController:
+    """
+    Ограничение числа одновременных запусков endpoint'а.
+
+    Запросы сверх `max_in_flight` ждут в очереди из не более чем `max_queue`
+    мест не дольше `queue_timeout` секунд; остальные сразу отклоняются.
+    Очередь упорядочена по приоритету: запрос с более высоким приоритетом
+    при полной очереди вытесняет самый низкоприоритетный из ожидающих.
+    Работает в одном event loop, поэтому обходится без блокировок.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int,
+        max_queue: int = 0,
+        queue_timeout: float = 1.0,
+    ) -> None:
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        # (приоритет, порядковый номер, future)
+        self._queue: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._wait_times = LatencyTracker(window=1000)
+        self._service_times = LatencyTracker(window=200)
+        self._counters = {"admitted": 0, "queued": 0, "completed": 0}
+        self._shed = {QUEUE_FULL: 0, QUEUE_TIMEOUT: 0, EVICTED: 0}
+
+    def retry_after(self) -> int:
+        """
+        Оценка, через сколько секунд освободится место: очередь, делённая
+        на параллелизм, умноженная на медианное время выполнения.
+        """
+        service = self._service_times.percentile(0.5) or 1.0
+        waves = (len(self._queue) + 1) / self.max_in_flight
+        return max(1, math.ceil(service * waves))
+
+    def _reject(self, reason: str) -> AdmissionRejected:
+        self._shed[reason] += 1
+        return AdmissionRejected(reason, self.retry_after())
+
+    async def acquire(self, priority: int = DEFAULT_PRIORITY) -> None:
+        if self.in_flight < self.max_in_flight and not self._queue:
+            self.in_flight += 1
+            self._counters["admitted"] += 1
+            self._wait_times.record(0.0)
+            return
+
+        if len(self._queue) >= self.max_queue:
+            lowest = max(self._queue) if self._queue else None
+            if lowest is None or lowest[0] <= priority:
+                raise self._reject(QUEUE_FULL)
+            # Вытесняем ожидающий запрос с самым низким приоритетом
+            self._queue.remove(lowest)
+            heapq.heapify(self._queue)
+            if not lowest[2].done():
+                lowest[2].set_exception(self._reject(EVICTED))
+
+        future = asyncio.get_running_loop().create_future()
+        entry = (priority, next(self._seq), future)
+        heapq.heappush(self._queue, entry)
+        self._counters["queued"] += 1
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.queue_timeout)
+        except asyncio.TimeoutError:
+            if future.done() and not future.exception():
+                # Место выдали одновременно с таймаутом - используем его
+                pass
+            else:
+                self._discard(entry)
+                raise self._reject(QUEUE_TIMEOUT)
+        except asyncio.CancelledError:
+            # Клиент ушёл, пока ждал: место, если уже выдано, возвращаем
+            self._discard(entry)
+            if future.done() and not future.cancelled() and not future.exception():
+                self.release(record=False)
+            raise
+        self._counters["admitted"] += 1
+        self._wait_times.record(time.monotonic() - started)
+
+    def _discard(self, entry: Tuple[int, int, asyncio.Future]) -> None:
+        if entry in self._queue:
+            self._queue.remove(entry)
+            heapq.heapify(self._queue)
+        if not entry[2].done():
+            entry[2].cancel()
+
+    def release(self, duration: Optional[float] = None, record: bool = True) -> None:
+        if record:
+            self._counters["completed"] += 1
+        if duration is not None:
+            self._service_times.record(duration)
+        # Место передаётся следующему ожидающему без уменьшения счётчика
+        while self._queue:
+            _, _, future = heapq.heappop(self._queue)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        def ms(q: float) -> Optional[float]:
+            value = self._wait_times.percentile(q)
+            return None if value is None else round(value * 1e3, 2)
+
+        return {
+            "in_flight": self.in_flight,
+            "queue_depth": len(self._queue),
+            "max_in_flight": self.max_in_flight,
+            "max_queue": self.max_queue,
+            **self._counters,
+            "shed": dict(self._shed),
+            "wait_p50_ms": ms(0.5),
+            "wait_p99_ms": ms(0.99),
+        }
+
+
+def controllers_from_env(endpoints: List[str]) -> Dict[str, AdmissionController]:
+    """
+    ADMISSION_MAX_IN_FLIGHT=32, ADMISSION_MAX_QUEUE=64, ADMISSION_QUEUE_TIMEOUT=1.0 -
+    значения для всех endpoint'ов; ADMISSION_LIMITS="/v3=8:16:0.5,/v6=4" -
+    переопределения (in_flight[:queue[:timeout]]). Без настроек ограничений нет.
+    """
+    overrides: Dict[str, List[str]] = {}
+    for item in os.getenv("ADMISSION_LIMITS", "").split(","):
+        if "=" in item:
+            endpoint, spec = item.split("=", 1)
+            overrides[endpoint.strip()] = spec.split(":")
+
+    default_in_flight = os.getenv("ADMISSION_MAX_IN_FLIGHT")
+    default_queue = os.getenv("ADMISSION_MAX_QUEUE", "0")
+    default_timeout = os.getenv("ADMISSION_QUEUE_TIMEOUT", "1.0")
+
+    controllers = {}
+    for endpoint in endpoints:
+        limits = overrides.get(endpoint, [])
+        in_flight = limits[0] if limits else default_in_flight
+        if not in_flight:
+            continue
+        controllers[endpoint] = AdmissionController(
+            max_in_flight=int(in_flight),
+            max_queue=int(limits[1] if len(limits) > 1 else default_queue),
+            queue_timeout=float(limits[2] if len(limits) > 2 else default_timeout),
+        )
+    return controllers
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware: пропускает запуски цепочек через AdmissionController
+    endpoint'а. Место освобождается после отправки ответа целиком, поэтому
+    стримы занимают его на всё время стриминга. Отклонённые запросы
+    получают `reject_status` с заголовком Retry-After.
+    """
+
+    def __init__(
+        self,
+        app: Any,
+        controllers: Dict[str, AdmissionController],
+        reject_status: int = 503,
+    ) -> None:
+        self.app = app
+        self.controllers = controllers
+        self.reject_status = reject_status
+
+    def _controller(self, path: str) -> Optional[AdmissionController]:
+        if not path.endswith(RUN_SUFFIXES):
+            return None
+        return self.controllers.get(path[: path.rfind("/")])
+
+    async def __call__(self, scope: Any, receive: Any, send: Any) -> None:
+        controller = None
+        if scope["type"] == "http":
+            controller = self._controller(scope["path"])
+        if controller is None:
+            await self.app(scope, receive, send)
+            return
+
+        priority = DEFAULT_PRIORITY
+        for name, value in scope["headers"]:
+            if name == PRIORITY_HEADER.encode("latin-1"):
+                priority = parse_priority(value.decode("latin-1"))
+                break
+        try:
+            await controller.acquire(priority)
+        except AdmissionRejected as e:
+            await self._send_rejection(send, e)
+            return
+
+        started = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            controller.release(time.monotonic() - started)
+
+    async def _send_rejection(self, send: Any, error: AdmissionRejected) -> None:
+        body = json.dumps(
+            {"detail": "Server is overloaded, retry later", "reason": error.reason}
+        ).encode("utf-8")
+        await send(
+            {
+                "type": "http.response.start",
+                "status": self.reject_status,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode("latin-1")),
+                    (b"retry-after", str(error.retry_after).encode("latin-1")),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
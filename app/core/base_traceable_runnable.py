@@ -1,27 +1,213 @@
 from abc import ABC, abstractmethod
-from typing import TypeVar, Any, Optional, Iterator, AsyncIterator
-from pydantic import ConfigDict
+from typing import (
+    TypeVar,
+    Any,
+    Optional,
+    Iterable,
+    Iterator,
+    AsyncIterator,
+    List,
+    Literal,
+    Sequence,
+    Tuple,
+    Union,
+    ClassVar,
+    Awaitable,
+    Callable,
+    Dict,
+    overload,
+)
+from concurrent.futures import CancelledError, as_completed
+import asyncio
+import io
+import time
+from pydantic import ConfigDict, Field
 from langchain_core.runnables import RunnableSerializable
 from langchain_core.callbacks.manager import (
     CallbackManager,
     AsyncCallbackManager,
+    AsyncCallbackManagerForChainRun,
     BaseRunManager,
+    CallbackManagerForChainRun,
+)
+from langchain_core.runnables.config import (
+    ensure_config,
+    get_config_list,
+    get_executor_for_config,
+    RunnableConfig,
 )
-from langchain_core.runnables.config import ensure_config, RunnableConfig
+from langchain_core.runnables.utils import AddableDict, gather_with_concurrency
 from langchain_core.runnables.base import Runnable
 from langchain_core.callbacks.manager import ParentRunManager, AsyncParentRunManager
+from core.sync_offload import run_sync, iterate_sync
+from core.deadline import (
+    DEADLINE_KEY,
+    aiter_until,
+    attach_deadline,
+    await_until,
+    check_deadline,
+    deadline_of,
+    get_deadline,
+    iter_until,
+)
+from core import metrics
+from core.payload_policy import (
+    PAYLOAD_PARENT_KEY,
+    PayloadPolicy,
+    fingerprint,
+    policy_for,
+)
+from core.sampling import (
+    NullRunManager,
+    AsyncNullRunManager,
+    is_unsampled,
+    TRACE_SAMPLED_KEY,
+    TRACE_BUFFER_KEY,
+)
 
 InputType = TypeVar("InputType")
 OutputType = TypeVar("OutputType")
 
+# Span шага: run manager callback'ов или заглушка несемплированного запроса
+SpanManager = Union[CallbackManagerForChainRun, NullRunManager]
+AsyncSpanManager = Union[AsyncCallbackManagerForChainRun, AsyncNullRunManager]
+
+
+async def _completed(value: Any) -> Any:
+    return value
+
+
+class _ChunkAccumulator:
+    """
+    Итог стрима, собираемый по мере поступления чанков: строки пишутся
+    в буфер, словари складываются как AddableDict, остальное - через `+`.
+    Если чанки не складываются, итогом считается последний чанк.
+    """
+
+    __slots__ = ("_text", "_value", "_mode")
+
+    def __init__(self) -> None:
+        self._text: Optional[io.StringIO] = None
+        self._value: Any = None
+        # None - чанков ещё не было; "text", "dict", "add" или "last"
+        self._mode: Optional[str] = None
+
+    def add(self, chunk: Any) -> None:
+        mode = self._mode
+        if mode == "text" and isinstance(chunk, str):
+            assert self._text is not None
+            self._text.write(chunk)
+        elif mode is None:
+            if isinstance(chunk, str):
+                self._text = io.StringIO(chunk)
+                self._text.seek(0, io.SEEK_END)
+                self._mode = "text"
+            elif isinstance(chunk, dict):
+                self._value = AddableDict(chunk)
+                self._mode = "dict"
+            else:
+                self._value = chunk
+                self._mode = "add"
+        elif mode == "dict" and isinstance(chunk, dict):
+            self._value = self._value + AddableDict(chunk)
+        elif mode == "last" or mode == "dict":
+            self._value = chunk
+            self._mode = "last"
+        else:
+            if mode == "text":
+                assert self._text is not None
+                self._value = self._text.getvalue()
+                self._text = None
+            try:
+                self._value = self._value + chunk
+                self._mode = "add"
+            except TypeError:
+                self._value = chunk
+                self._mode = "last"
+
+    def result(self) -> Any:
+        if self._mode == "text":
+            assert self._text is not None
+            return self._text.getvalue()
+        if self._mode == "dict":
+            return dict(self._value)
+        return self._value
+
+
+def _collect(chunks: Iterator[Any], collected: _ChunkAccumulator) -> Iterator[Any]:
+    for chunk in chunks:
+        collected.add(chunk)
+        yield chunk
+
+
+async def _acollect(
+    chunks: AsyncIterator[Any], collected: _ChunkAccumulator
+) -> AsyncIterator[Any]:
+    async for chunk in chunks:
+        collected.add(chunk)
+        yield chunk
+
+
+def _aggregate_chunks(chunks: Iterable[Any]) -> Any:
+    accumulator = _ChunkAccumulator()
+    for chunk in chunks:
+        accumulator.add(chunk)
+    return accumulator.result()
+
+
+class _StreamStats:
+    """
+    Метрики одного стрима шага: время до первого чанка, паузы между
+    чанками и число чанков.
+    """
+
+    __slots__ = ("runnable", "labels", "started", "last", "count")
+
+    def __init__(self, runnable: "BaseTraceableRunnable") -> None:
+        self.runnable = runnable
+        self.labels = (("runnable", runnable.get_name()),)
+        self.started = self.last = time.perf_counter()
+        self.count = 0
+
+    def chunk(self) -> None:
+        if not metrics.METRICS_ENABLED:
+            return
+        now = time.perf_counter()
+        if self.count:
+            metrics.observe("runnable_chunk_gap_seconds", self.labels, now - self.last)
+        else:
+            metrics.observe(
+                "runnable_first_chunk_seconds", self.labels, now - self.started
+            )
+        self.last = now
+        self.count += 1
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        if not metrics.METRICS_ENABLED:
+            return
+        self.runnable._record_run("stream", self.started, error)
+        if self.count:
+            metrics.inc("runnable_stream_chunks_total", self.labels, self.count)
+
 
 class BaseTraceableRunnable(RunnableSerializable[InputType, OutputType], ABC):
     """
     Базовый класс для кастомных runnable с поддержкой трейсинга через Langfuse callback.
     """
-    
+
     model_config = ConfigDict(arbitrary_types_allowed=True)
 
+    # Выполнять sync-логику (_run/_stream) в пуле потоков, когда наследник
+    # не реализует async-путь. Отключается для тривиально дешёвых шагов.
+    offload_sync: ClassVar[bool] = True
+
+    # Шагу нужен вход целиком: внутри цепочки upstream-стрим сначала
+    # собирается. Шаги, реализующие `_transform`, выставляют False.
+    buffers_input: ClassVar[bool] = True
+
+    # Ограничения входа/выхода в span'е (None - общая политика PAYLOAD_*)
+    payload_policy: Optional[PayloadPolicy] = Field(default=None)
+
     @abstractmethod
     def _run(
         self, input: InputType, *, run_manager: BaseRunManager, **kwargs: Any
@@ -31,6 +217,481 @@ class BaseTraceableRunnable(RunnableSerializable[InputType, OutputType], ABC):
         """
         pass
 
+    def _run_batch(
+        self,
+        inputs: List[InputType],
+        *,
+        run_managers: Sequence[BaseRunManager],
+        **kwargs: Any,
+    ) -> List[OutputType]:
+        """
+        Векторизованная обработка всего батча за один вызов.
+        Опциональный хук: если наследник его не переопределил, batch
+        выполняет `_run` для каждого элемента в пуле потоков.
+        """
+        raise NotImplementedError
+
+    async def _arun_batch(
+        self,
+        inputs: List[InputType],
+        *,
+        run_managers: Sequence[BaseRunManager],
+        **kwargs: Any,
+    ) -> List[OutputType]:
+        """
+        Асинхронная версия `_run_batch`. По умолчанию вызывает sync-метод
+        (в пуле потоков, если не отключено через `offload_sync`).
+        """
+        if self.offload_sync:
+            return await run_sync(
+                self._run_batch, inputs, run_managers=run_managers, **kwargs
+            )
+        return self._run_batch(inputs, run_managers=run_managers, **kwargs)
+
+    def _has_batch_hook(self) -> bool:
+        cls = type(self)
+        return (
+            cls._run_batch is not BaseTraceableRunnable._run_batch
+            or cls._arun_batch is not BaseTraceableRunnable._arun_batch
+        )
+
+    def _start_batch_runs(
+        self, inputs: Sequence[InputType], configs: List[RunnableConfig], **kwargs: Any
+    ) -> List[SpanManager]:
+        """
+        Конфигурирует callback manager один раз на группу одинаковых конфигов
+        и открывает span для каждого элемента батча.
+        """
+        managers: Dict[Any, CallbackManager] = {}
+        run_managers: List[SpanManager] = []
+        policy = self._payload_policy()
+        for input, config in zip(inputs, configs):
+            if is_unsampled(config):
+                run_managers.append(
+                    NullRunManager(
+                        config.get("run_name") or self.__class__.__name__,
+                        input,
+                        config["configurable"],
+                    )
+                )
+                continue
+            key = (id(config.get("callbacks")), tuple(config.get("tags") or ()))
+            callback_manager = managers.get(key)
+            if callback_manager is None:
+                callback_manager = CallbackManager.configure(
+                    config.get("callbacks"),
+                    None,
+                    verbose=kwargs.get("verbose", False),
+                    inheritable_tags=config.get("tags"),
+                )
+                managers[key] = callback_manager
+            run_manager = callback_manager.on_chain_start(
+                None,
+                self._span_input(policy, input, config),
+                name=config.get("run_name") or self.__class__.__name__,
+                run_id=config.pop("run_id", None),
+            )
+            self._attach_fingerprint(policy, run_manager, input)
+            run_managers.append(run_manager)
+        return run_managers
+
+    async def _astart_batch_runs(
+        self, inputs: Sequence[InputType], configs: List[RunnableConfig], **kwargs: Any
+    ) -> List[AsyncSpanManager]:
+        managers: Dict[Any, AsyncCallbackManager] = {}
+        starts: List[Awaitable[AsyncSpanManager]] = []
+        policy = self._payload_policy()
+        for input, config in zip(inputs, configs):
+            if is_unsampled(config):
+                starts.append(
+                    _completed(
+                        AsyncNullRunManager(
+                            config.get("run_name") or self.__class__.__name__,
+                            input,
+                            config["configurable"],
+                        )
+                    )
+                )
+                continue
+            key = (id(config.get("callbacks")), tuple(config.get("tags") or ()))
+            callback_manager = managers.get(key)
+            if callback_manager is None:
+                callback_manager = AsyncCallbackManager.configure(
+                    config.get("callbacks"),
+                    None,
+                    verbose=kwargs.get("verbose", False),
+                    inheritable_tags=config.get("tags"),
+                )
+                managers[key] = callback_manager
+            starts.append(
+                callback_manager.on_chain_start(
+                    None,
+                    self._span_input(policy, input, config),
+                    name=config.get("run_name") or self.__class__.__name__,
+                    run_id=config.pop("run_id", None),
+                )
+            )
+        # Все span'ы батча отправляются одной пачкой
+        run_managers = list(await asyncio.gather(*starts))
+        for input, run_manager in zip(inputs, run_managers):
+            self._attach_fingerprint(policy, run_manager, input)
+        return run_managers
+
+    @staticmethod
+    def _span_input(policy: PayloadPolicy, input: Any, config: RunnableConfig) -> Any:
+        return policy.apply_input(input, config["configurable"].get(PAYLOAD_PARENT_KEY))
+
+    @staticmethod
+    def _attach_fingerprint(
+        policy: PayloadPolicy, run_manager: Any, input: Any
+    ) -> None:
+        # По отпечатку вложенные шаги не дублируют совпадающий вход
+        if policy.dedupe_parent and not isinstance(run_manager, NullRunManager):
+            run_manager.payload_fingerprint = fingerprint(input)
+
+    def batch(
+        self,
+        inputs: List[InputType],
+        config: Optional[Union[RunnableConfig, List[RunnableConfig]]] = None,
+        *,
+        return_exceptions: bool = False,
+        **kwargs: Any,
+    ) -> List[OutputType]:
+        """
+        Синхронный батч с трейсингом: callback'и настраиваются один раз,
+        элементы выполняются через `_run_batch` или в пуле потоков
+        с ограничением `max_concurrency`.
+        """
+        if not inputs:
+            return []
+        configs = get_config_list(config, len(inputs))
+        run_managers = self._start_batch_runs(inputs, configs, **kwargs)
+
+        if self._has_batch_hook():
+            try:
+                results: List[Any] = list(
+                    self._run_batch(inputs, run_managers=run_managers, **kwargs)
+                )
+            except Exception as e:
+                results = [e] * len(inputs)
+        else:
+
+            def run_one(input: InputType, run_manager: SpanManager) -> Any:
+                try:
+                    return self._run(input, run_manager=run_manager, **kwargs)
+                except Exception as e:
+                    return e
+
+            with get_executor_for_config(configs[0]) as executor:
+                results = list(executor.map(run_one, inputs, run_managers))
+
+        return self._finish_batch(results, run_managers, return_exceptions)
+
+    def _finish_batch(
+        self,
+        results: List[Any],
+        run_managers: Sequence[SpanManager],
+        return_exceptions: bool,
+    ) -> List[Any]:
+        first_exc = None
+        for result, run_manager in zip(results, run_managers):
+            if isinstance(result, Exception):
+                run_manager.on_chain_error(result)
+                first_exc = first_exc or result
+            else:
+                run_manager.on_chain_end(self._payload_policy().apply(result))
+        if first_exc is not None and not return_exceptions:
+            raise first_exc
+        return results
+
+    async def abatch(
+        self,
+        inputs: List[InputType],
+        config: Optional[Union[RunnableConfig, List[RunnableConfig]]] = None,
+        *,
+        return_exceptions: bool = False,
+        **kwargs: Any,
+    ) -> List[OutputType]:
+        """
+        Асинхронный батч с трейсингом и ограничением `max_concurrency`.
+        """
+        if not inputs:
+            return []
+        configs = get_config_list(config, len(inputs))
+        run_managers = await self._astart_batch_runs(inputs, configs, **kwargs)
+
+        if self._has_batch_hook():
+            try:
+                results: List[Any] = list(
+                    await self._arun_batch(inputs, run_managers=run_managers, **kwargs)
+                )
+            except Exception as e:
+                results = [e] * len(inputs)
+        else:
+
+            async def run_one(input: InputType, run_manager: AsyncSpanManager) -> Any:
+                try:
+                    return await self._arun(input, run_manager=run_manager, **kwargs)
+                except Exception as e:
+                    return e
+
+            results = await gather_with_concurrency(
+                configs[0].get("max_concurrency"),
+                *(run_one(i, rm) for i, rm in zip(inputs, run_managers)),
+            )
+
+        first_exc = None
+        ends: List[Awaitable[None]] = []
+        for result, run_manager in zip(results, run_managers):
+            if isinstance(result, Exception):
+                ends.append(run_manager.on_chain_error(result))
+                first_exc = first_exc or result
+            else:
+                ends.append(
+                    run_manager.on_chain_end(self._payload_policy().apply(result))
+                )
+        await asyncio.gather(*ends)
+        if first_exc is not None and not return_exceptions:
+            raise first_exc
+        return results
+
+    @overload
+    def batch_as_completed(
+        self,
+        inputs: Sequence[InputType],
+        config: Optional[Union[RunnableConfig, Sequence[RunnableConfig]]] = None,
+        *,
+        return_exceptions: Literal[False] = False,
+        **kwargs: Any,
+    ) -> Iterator[Tuple[int, OutputType]]: ...
+
+    @overload
+    def batch_as_completed(
+        self,
+        inputs: Sequence[InputType],
+        config: Optional[Union[RunnableConfig, Sequence[RunnableConfig]]] = None,
+        *,
+        return_exceptions: Literal[True],
+        **kwargs: Any,
+    ) -> Iterator[Tuple[int, Union[OutputType, Exception]]]: ...
+
+    def batch_as_completed(
+        self,
+        inputs: Sequence[InputType],
+        config: Optional[Union[RunnableConfig, Sequence[RunnableConfig]]] = None,
+        *,
+        return_exceptions: bool = False,
+        **kwargs: Any,
+    ) -> Iterator[Tuple[int, Union[OutputType, Exception]]]:
+        """
+        Отдаёт пары (индекс, результат) по мере готовности элементов батча.
+        Если перебор прерван (ошибка без `return_exceptions`, закрытие
+        генератора), span'ы оставшихся элементов тоже закрываются.
+        """
+        if not inputs:
+            return
+        if self._has_batch_hook():
+            # Векторизованный путь завершает весь батч разом
+            results = self.batch(
+                list(inputs),
+                list(config) if isinstance(config, Sequence) else config,
+                return_exceptions=return_exceptions,
+                **kwargs,
+            )
+            yield from enumerate(results)
+            return
+
+        configs = get_config_list(config, len(inputs))
+        run_managers = self._start_batch_runs(inputs, configs, **kwargs)
+        ended = [False] * len(inputs)
+
+        def run_one(idx: int) -> Tuple[int, Any]:
+            try:
+                return idx, self._run(
+                    inputs[idx], run_manager=run_managers[idx], **kwargs
+                )
+            except Exception as e:
+                return idx, e
+
+        def end(idx: int, result: Any) -> None:
+            ended[idx] = True
+            if isinstance(result, BaseException):
+                run_managers[idx].on_chain_error(result)
+            else:
+                run_managers[idx].on_chain_end(self._payload_policy().apply(result))
+
+        with get_executor_for_config(configs[0]) as executor:
+            futures = [executor.submit(run_one, idx) for idx in range(len(inputs))]
+            try:
+                for future in as_completed(futures):
+                    idx, result = future.result()
+                    end(idx, result)
+                    if isinstance(result, Exception) and not return_exceptions:
+                        raise result
+                    yield idx, result
+            finally:
+                for future in futures:
+                    future.cancel()
+                for idx, future in enumerate(futures):
+                    if ended[idx]:
+                        continue
+                    if future.cancelled():
+                        end(idx, CancelledError())
+                    else:
+                        # Уже запущенный элемент дожидается завершения
+                        end(idx, future.result()[1])
+
+    @overload
+    def abatch_as_completed(
+        self,
+        inputs: Sequence[InputType],
+        config: Optional[Union[RunnableConfig, Sequence[RunnableConfig]]] = None,
+        *,
+        return_exceptions: Literal[False] = False,
+        **kwargs: Any,
+    ) -> AsyncIterator[Tuple[int, OutputType]]: ...
+
+    @overload
+    def abatch_as_completed(
+        self,
+        inputs: Sequence[InputType],
+        config: Optional[Union[RunnableConfig, Sequence[RunnableConfig]]] = None,
+        *,
+        return_exceptions: Literal[True],
+        **kwargs: Any,
+    ) -> AsyncIterator[Tuple[int, Union[OutputType, Exception]]]: ...
+
+    async def abatch_as_completed(
+        self,
+        inputs: Sequence[InputType],
+        config: Optional[Union[RunnableConfig, Sequence[RunnableConfig]]] = None,
+        *,
+        return_exceptions: bool = False,
+        **kwargs: Any,
+    ) -> AsyncIterator[Tuple[int, Union[OutputType, Exception]]]:
+        """
+        Асинхронная версия `batch_as_completed`.
+        """
+        if not inputs:
+            return
+        if self._has_batch_hook():
+            results = await self.abatch(
+                list(inputs),
+                list(config) if isinstance(config, Sequence) else config,
+                return_exceptions=return_exceptions,
+                **kwargs,
+            )
+            for item in enumerate(results):
+                yield item
+            return
+
+        configs = get_config_list(config, len(inputs))
+        run_managers = await self._astart_batch_runs(inputs, configs, **kwargs)
+        max_concurrency = configs[0].get("max_concurrency")
+        semaphore = asyncio.Semaphore(max_concurrency) if max_concurrency else None
+        ended = [False] * len(inputs)
+
+        async def run_one(idx: int) -> Tuple[int, Any]:
+            try:
+                if semaphore is None:
+                    return idx, await self._arun(
+                        inputs[idx], run_manager=run_managers[idx], **kwargs
+                    )
+                async with semaphore:
+                    return idx, await self._arun(
+                        inputs[idx], run_manager=run_managers[idx], **kwargs
+                    )
+            except Exception as e:
+                return idx, e
+
+        async def end(idx: int, result: Any) -> None:
+            ended[idx] = True
+            if isinstance(result, BaseException):
+                await run_managers[idx].on_chain_error(result)
+            else:
+                await run_managers[idx].on_chain_end(
+                    self._payload_policy().apply(result)
+                )
+
+        tasks = [asyncio.ensure_future(run_one(idx)) for idx in range(len(inputs))]
+        try:
+            for coro in asyncio.as_completed(tasks):
+                idx, result = await coro
+                await end(idx, result)
+                if isinstance(result, Exception) and not return_exceptions:
+                    raise result
+                yield idx, result
+        finally:
+            for task in tasks:
+                task.cancel()
+            outcomes = await asyncio.gather(*tasks, return_exceptions=True)
+            for idx, outcome in enumerate(outcomes):
+                if not ended[idx]:
+                    if isinstance(outcome, BaseException):
+                        await end(idx, outcome)
+                    else:
+                        await end(idx, outcome[1])
+
+    def _start_run(
+        self, input: Any, config: RunnableConfig, kwargs: dict
+    ) -> SpanManager:
+        """
+        Открывает span шага. Для несемплированного запроса callback manager
+        не создаётся вовсе.
+        """
+        name = config.get("run_name") or self.__class__.__name__
+        run_manager: SpanManager
+        if is_unsampled(config):
+            kwargs.pop("run_id", None)
+            run_manager = NullRunManager(name, input, config["configurable"])
+        else:
+            callback_manager = CallbackManager.configure(
+                config.get("callbacks"),
+                None,
+                verbose=kwargs.get("verbose", False),
+                inheritable_tags=config.get("tags"),
+            )
+            policy = self._payload_policy()
+            started = time.perf_counter()
+            run_manager = callback_manager.on_chain_start(
+                None,
+                self._span_input(policy, input, config),
+                name=name,
+                run_id=kwargs.pop("run_id", None),
+            )
+            self._record_callback("start", started)
+            self._attach_fingerprint(policy, run_manager, input)
+        attach_deadline(run_manager, get_deadline(config))
+        return run_manager
+
+    async def _astart_run(
+        self, input: Any, config: RunnableConfig, kwargs: dict
+    ) -> AsyncSpanManager:
+        name = config.get("run_name") or self.__class__.__name__
+        run_manager: AsyncSpanManager
+        if is_unsampled(config):
+            kwargs.pop("run_id", None)
+            run_manager = AsyncNullRunManager(name, input, config["configurable"])
+        else:
+            callback_manager = AsyncCallbackManager.configure(
+                config.get("callbacks"),
+                None,
+                verbose=kwargs.get("verbose", False),
+                inheritable_tags=config.get("tags"),
+            )
+            policy = self._payload_policy()
+            started = time.perf_counter()
+            run_manager = await callback_manager.on_chain_start(
+                None,
+                self._span_input(policy, input, config),
+                name=name,
+                run_id=kwargs.pop("run_id", None),
+            )
+            self._record_callback("start", started)
+            self._attach_fingerprint(policy, run_manager, input)
+        attach_deadline(run_manager, get_deadline(config))
+        return run_manager
+
     def invoke(
         self, input: InputType, config: Optional[RunnableConfig] = None, **kwargs: Any
     ) -> OutputType:
@@ -38,25 +699,19 @@ class BaseTraceableRunnable(RunnableSerializable[InputType, OutputType], ABC):
         Синхронный запуск с трейсингом.
         """
         config = ensure_config(config)
-        callback_manager = CallbackManager.configure(
-            config.get("callbacks"),
-            None,
-            verbose=kwargs.get("verbose", False),
-            inheritable_tags=config.get("tags"),
-        )
-        run_manager = callback_manager.on_chain_start(
-            None,
-            input,
-            name=config.get("run_name") or self.__class__.__name__,
-            run_id=kwargs.pop("run_id", None),
-        )
+        run_manager = self._start_run(input, config, kwargs)
+        started = time.perf_counter()
         try:
+            # Sync-шаг нельзя прервать на середине - дедлайн проверяется до старта
+            check_deadline(deadline_of(run_manager))
             result = self._run(input, run_manager=run_manager, **kwargs)
         except Exception as e:
-            run_manager.on_chain_error(e)
+            self._record_run("invoke", started, e)
+            self._end_span(run_manager, error=e)
             raise
         else:
-            run_manager.on_chain_end(result)
+            self._record_run("invoke", started)
+            self._end_span(run_manager, result)
             return result
 
     async def ainvoke(
@@ -66,99 +721,257 @@ class BaseTraceableRunnable(RunnableSerializable[InputType, OutputType], ABC):
         Асинхронный запуск с трейсингом.
         """
         config = ensure_config(config)
-        callback_manager = AsyncCallbackManager.configure(
-            config.get("callbacks"),
-            None,
-            verbose=kwargs.get("verbose", False),
-            inheritable_tags=config.get("tags"),
-        )
-        run_manager = await callback_manager.on_chain_start(
-            None,
-            input,
-            name=config.get("run_name") or self.__class__.__name__,
-            run_id=kwargs.pop("run_id", None),
-        )
+        run_manager = await self._astart_run(input, config, kwargs)
+        started = time.perf_counter()
         try:
-            result = await self._arun(input, run_manager=run_manager, **kwargs)
-        except Exception as e:
-            await run_manager.on_chain_error(e)
+            result = await await_until(
+                self._arun(input, run_manager=run_manager, **kwargs),
+                deadline_of(run_manager),
+            )
+        except (Exception, asyncio.CancelledError) as e:
+            # Отмена (проигравший hedged-вызов, отключение клиента, дедлайн)
+            # тоже фиксируется в span
+            self._record_run("invoke", started, e)
+            await self._aend_span(run_manager, error=e)
             raise
         else:
-            await run_manager.on_chain_end(result)
+            self._record_run("invoke", started)
+            await self._aend_span(run_manager, result)
             return result
 
+    def _record_run(
+        self, mode: str, started: float, error: Optional[BaseException] = None
+    ) -> None:
+        if not metrics.METRICS_ENABLED:
+            return
+        name = self.get_name()
+        status = "ok" if error is None else "error"
+        metrics.observe(
+            "runnable_duration_seconds",
+            (("runnable", name), ("mode", mode), ("status", status)),
+            time.perf_counter() - started,
+        )
+        if error is not None:
+            metrics.inc("runnable_errors_total", metrics.error_labels(name, error))
+
+    def _record_callback(self, event: str, started: float) -> None:
+        if not metrics.METRICS_ENABLED:
+            return
+        metrics.observe(
+            "runnable_callback_seconds",
+            (("runnable", self.get_name()), ("event", event)),
+            time.perf_counter() - started,
+        )
+
+    def _end_span(
+        self,
+        run_manager: SpanManager,
+        output: Any = None,
+        error: Optional[BaseException] = None,
+        **kwargs: Any,
+    ) -> None:
+        started = time.perf_counter()
+        if error is not None:
+            run_manager.on_chain_error(error)
+        else:
+            output, kwargs = self._payload_end(run_manager, output, kwargs)
+            run_manager.on_chain_end(output, **kwargs)
+        self._record_callback("end", started)
+
+    async def _aend_span(
+        self,
+        run_manager: AsyncSpanManager,
+        output: Any = None,
+        error: Optional[BaseException] = None,
+        **kwargs: Any,
+    ) -> None:
+        started = time.perf_counter()
+        if error is not None:
+            await run_manager.on_chain_error(error)
+        else:
+            output, kwargs = self._payload_end(run_manager, output, kwargs)
+            await run_manager.on_chain_end(output, **kwargs)
+        self._record_callback("end", started)
+
+    def _payload_policy(self) -> PayloadPolicy:
+        return self.payload_policy or policy_for(self.get_name())
+
+    def _payload_end(
+        self, run_manager: Any, output: Any, kwargs: dict
+    ) -> Tuple[Any, dict]:
+        policy = self._payload_policy()
+        if "inputs" in kwargs:
+            kwargs = {**kwargs, "inputs": policy.apply(kwargs["inputs"])}
+        metadata = getattr(run_manager, "span_metadata", None)
+        if metadata:
+            kwargs = {**kwargs, "metadata": metadata}
+        return policy.apply(output), kwargs
+
     async def _arun(
         self, input: InputType, *, run_manager: BaseRunManager, **kwargs: Any
     ) -> OutputType:
         """
-        Асинхронная версия основной логики. По умолчанию вызывает sync-метод.
+        Асинхронная версия основной логики. По умолчанию вызывает sync-метод
+        в пуле потоков, чтобы не блокировать event loop.
         """
+        if self.offload_sync:
+            return await run_sync(self._run, input, run_manager=run_manager, **kwargs)
         return self._run(input, run_manager=run_manager, **kwargs)
 
     def stream(
         self, input: InputType, config: Optional[RunnableConfig] = None, **kwargs: Any
     ) -> Iterator[OutputType]:
         config = ensure_config(config)
-        callback_manager = CallbackManager.configure(
-            config.get("callbacks"),
-            None,
-            verbose=kwargs.get("verbose", False),
-            inheritable_tags=config.get("tags"),
-        )
-        run_manager = callback_manager.on_chain_start(
-            None,
-            input,
-            name=config.get("run_name") or self.__class__.__name__,
-            run_id=kwargs.pop("run_id", None),
+        run_manager = self._start_run(input, config, kwargs)
+        yield from self._traced_chunks(
+            run_manager, lambda: self._stream(input, run_manager=run_manager, **kwargs)
         )
-        chunks = []
+
+    def _traced_chunks(
+        self,
+        run_manager: SpanManager,
+        make_chunks: Callable[[], Iterator[OutputType]],
+        inputs: Optional[_ChunkAccumulator] = None,
+    ) -> Iterator[OutputType]:
+        """
+        Отдаёт чанки шага и закрывает span. Выход (и `inputs` - вход,
+        собранный по ходу transform) накапливается без списка всех чанков.
+        """
+        collected = _ChunkAccumulator()
+        deadline = deadline_of(run_manager)
+        stats = _StreamStats(self)
         try:
-            for chunk in self._stream(input, run_manager=run_manager, **kwargs):
-                if hasattr(run_manager, "on_llm_new_token"):
-                    on_token = run_manager.on_llm_new_token
-                    if callable(on_token):
-                        on_token(str(chunk), chunk=chunk)
-                chunks.append(chunk)
+            check_deadline(deadline)
+            chunks = make_chunks()
+            if deadline is not None:
+                chunks = iter_until(chunks, deadline)
+            for chunk in chunks:
+                stats.chunk()
+                collected.add(chunk)
                 yield chunk
         except Exception as e:
-            run_manager.on_chain_error(e)
+            stats.finish(e)
+            self._end_span(run_manager, error=e)
             raise
         else:
-            # Объединяем все чанки в итоговую строку или результат
-            final_result = "".join(str(c) for c in chunks)
-            run_manager.on_chain_end(final_result)
+            stats.finish()
+            if inputs is None:
+                self._end_span(run_manager, collected.result())
+            else:
+                self._end_span(run_manager, collected.result(), inputs=inputs.result())
 
     async def astream(
         self, input: InputType, config: Optional[RunnableConfig] = None, **kwargs: Any
     ) -> AsyncIterator[OutputType]:
         config = ensure_config(config)
-        callback_manager = AsyncCallbackManager.configure(
-            config.get("callbacks"),
-            None,
-            verbose=kwargs.get("verbose", False),
-            inheritable_tags=config.get("tags"),
-        )
-        run_manager = await callback_manager.on_chain_start(
-            None,
-            input,
-            name=config.get("run_name") or self.__class__.__name__,
-            run_id=kwargs.pop("run_id", None),
-        )
-        chunks = []
+        run_manager = await self._astart_run(input, config, kwargs)
+        async for chunk in self._atraced_chunks(
+            run_manager, lambda: self._astream(input, run_manager=run_manager, **kwargs)
+        ):
+            yield chunk
+
+    async def _atraced_chunks(
+        self,
+        run_manager: AsyncSpanManager,
+        make_chunks: Callable[[], AsyncIterator[OutputType]],
+        inputs: Optional[_ChunkAccumulator] = None,
+    ) -> AsyncIterator[OutputType]:
+        collected = _ChunkAccumulator()
+        chunks = make_chunks()
+        deadline = deadline_of(run_manager)
+        if deadline is not None:
+            chunks = aiter_until(chunks, deadline)
+        stats = _StreamStats(self)
         try:
-            async for chunk in self._astream(input, run_manager=run_manager, **kwargs):
-                if hasattr(run_manager, "on_llm_new_token"):
-                    on_token = getattr(run_manager, "on_llm_new_token", None)
-                    if callable(on_token):
-                        await on_token(str(chunk), chunk=chunk)
-                chunks.append(chunk)
+            async for chunk in chunks:
+                stats.chunk()
+                collected.add(chunk)
                 yield chunk
-        except Exception as e:
-            await run_manager.on_chain_error(e)
+        except (Exception, asyncio.CancelledError) as e:
+            stats.finish(e)
+            await self._aend_span(run_manager, error=e)
             raise
         else:
-            final_result = "".join(str(c) for c in chunks)
-            await run_manager.on_chain_end(final_result)
+            stats.finish()
+            if inputs is None:
+                await self._aend_span(run_manager, collected.result())
+            else:
+                await self._aend_span(
+                    run_manager, collected.result(), inputs=inputs.result()
+                )
+
+    def transform(
+        self,
+        input: Iterator[InputType],
+        config: Optional[RunnableConfig] = None,
+        **kwargs: Any,
+    ) -> Iterator[OutputType]:
+        """
+        Стриминг внутри цепочки: шаг с `buffers_input = False` обрабатывает
+        чанки входа по мере поступления через `_transform`. Остальные шаги,
+        как принято в LangChain, сначала собирают вход целиком.
+        """
+        if self.buffers_input:
+            yield from super().transform(input, config, **kwargs)
+            return
+        config = ensure_config(config)
+        # Вход ещё неизвестен: он попадёт в span при завершении
+        run_manager = self._start_run("", config, kwargs)
+        inputs = _ChunkAccumulator()
+        yield from self._traced_chunks(
+            run_manager,
+            lambda: self._transform(
+                _collect(input, inputs), run_manager=run_manager, **kwargs
+            ),
+            inputs,
+        )
+
+    async def atransform(
+        self,
+        input: AsyncIterator[InputType],
+        config: Optional[RunnableConfig] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[OutputType]:
+        if self.buffers_input:
+            async for chunk in super().atransform(input, config, **kwargs):
+                yield chunk
+            return
+        config = ensure_config(config)
+        run_manager = await self._astart_run("", config, kwargs)
+        inputs = _ChunkAccumulator()
+        async for chunk in self._atraced_chunks(
+            run_manager,
+            lambda: self._atransform(
+                _acollect(input, inputs), run_manager=run_manager, **kwargs
+            ),
+            inputs,
+        ):
+            yield chunk
+
+    def _transform(
+        self,
+        chunks: Iterator[InputType],
+        *,
+        run_manager: BaseRunManager,
+        **kwargs: Any,
+    ) -> Iterator[OutputType]:
+        """
+        Почанковая обработка входа. Реализуется шагами с `buffers_input = False`.
+        """
+        raise NotImplementedError
+
+    async def _atransform(
+        self,
+        chunks: AsyncIterator[InputType],
+        *,
+        run_manager: BaseRunManager,
+        **kwargs: Any,
+    ) -> AsyncIterator[OutputType]:
+        """
+        Асинхронная версия `_transform`.
+        """
+        raise NotImplementedError
+        yield
 
     def _stream(
         self, input: InputType, *, run_manager: BaseRunManager, **kwargs: Any
@@ -172,11 +985,98 @@ class BaseTraceableRunnable(RunnableSerializable[InputType, OutputType], ABC):
         self, input: InputType, *, run_manager: BaseRunManager, **kwargs: Any
     ) -> AsyncIterator[OutputType]:
         """
-        Асинхронная стриминг-логика. По умолчанию вызывает sync-метод.
+        Асинхронная стриминг-логика. По умолчанию вызывает sync-метод:
+        чанки sync-генератора передаются из пула потоков через очередь.
         """
-        for chunk in self._stream(input, run_manager=run_manager, **kwargs):
+        if type(self)._stream is BaseTraceableRunnable._stream:
+            # Стриминг не реализован - достаточно одного вызова _arun
+            yield await self._arun(input, run_manager=run_manager, **kwargs)
+            return
+        if not self.offload_sync:
+            for chunk in self._stream(input, run_manager=run_manager, **kwargs):
+                yield chunk
+            return
+        async for chunk in iterate_sync(
+            lambda: self._stream(input, run_manager=run_manager, **kwargs)
+        ):
             yield chunk
 
+    def set_span_metadata(self, run_manager: Any, metadata: Dict[str, Any]) -> None:
+        """
+        Атрибуты шага, известные только по ходу выполнения (длительности
+        этапов и т.п.): передаются handler'ам в `metadata` при завершении
+        span'а (on_chain_end), без отдельного дочернего span'а.
+        """
+        run_manager.span_metadata = {
+            **getattr(run_manager, "span_metadata", {}),
+            **metadata,
+        }
+
+    def record_span_event(
+        self,
+        run_manager: Union[ParentRunManager, AsyncParentRunManager, NullRunManager],
+        name: str,
+        metadata: Dict[str, Any],
+    ) -> None:
+        """
+        Добавляет в трейс отметку: дочерний span без работы, в метаданных
+        которого записаны атрибуты шага (попадание в кэш, размер батча и т.п.).
+        Работает и с sync, и с async run_manager.
+        """
+        if isinstance(run_manager, NullRunManager):
+            return
+        callback_manager = CallbackManager.configure(run_manager.get_child())
+        if not callback_manager.handlers:
+            return
+        callback_manager.add_metadata(metadata, inherit=False)
+        event_run = callback_manager.on_chain_start(None, metadata, name=name)
+        event_run.on_chain_end(metadata)
+
+    async def arecord_span_event(
+        self,
+        run_manager: Union[ParentRunManager, AsyncParentRunManager, NullRunManager],
+        name: str,
+        metadata: Dict[str, Any],
+    ) -> None:
+        if isinstance(run_manager, NullRunManager):
+            return
+        callback_manager = AsyncCallbackManager.configure(run_manager.get_child())
+        if not callback_manager.handlers:
+            return
+        callback_manager.add_metadata(metadata, inherit=False)
+        event_run = await callback_manager.on_chain_start(None, metadata, name=name)
+        await event_run.on_chain_end(metadata)
+
+    def _nested_config(
+        self,
+        runnable: Runnable,
+        run_manager: Union[ParentRunManager, AsyncParentRunManager, NullRunManager],
+    ) -> RunnableConfig:
+        """
+        Конфиг вложенного вызова: дочерние callback'и родительского span'а.
+        Решение о семплировании (и буфер хвостовых правил), а также дедлайн
+        запроса передаются вниз.
+        """
+        config: RunnableConfig = {
+            "callbacks": run_manager.get_child(),
+            "run_name": runnable.__class__.__name__,
+        }
+        configurable: Dict[str, Any] = {}
+        if isinstance(run_manager, NullRunManager):
+            configurable[TRACE_SAMPLED_KEY] = False
+            configurable[TRACE_BUFFER_KEY] = run_manager.configurable.get(
+                TRACE_BUFFER_KEY
+            )
+        deadline = deadline_of(run_manager)
+        if deadline is not None:
+            configurable[DEADLINE_KEY] = deadline
+        parent = getattr(run_manager, "payload_fingerprint", None)
+        if parent is not None:
+            configurable[PAYLOAD_PARENT_KEY] = parent
+        if configurable:
+            config["configurable"] = configurable
+        return ensure_config(config)
+
     def invoke_nested(
         self,
         runnable: Runnable,
@@ -188,12 +1088,7 @@ class BaseTraceableRunnable(RunnableSerializable[InputType, OutputType], ABC):
         Запускает вложенный Runnable с корректной передачей run_manager.get_child()
         для вложенного трейсинга.
         """
-        config = ensure_config(
-            {
-                "callbacks": run_manager.get_child(),
-                "run_name": runnable.__class__.__name__,
-            }
-        )
+        config = self._nested_config(runnable, run_manager)
         return runnable.invoke(input, config=config, **kwargs)
 
     async def ainvoke_nested(
@@ -203,12 +1098,7 @@ class BaseTraceableRunnable(RunnableSerializable[InputType, OutputType], ABC):
         run_manager: AsyncParentRunManager,
         **kwargs: Any,
     ) -> Any:
-        config = ensure_config(
-            {
-                "callbacks": run_manager.get_child(),
-                "run_name": runnable.__class__.__name__,
-            }
-        )
+        config = self._nested_config(runnable, run_manager)
         return await runnable.ainvoke(input, config=config, **kwargs)
 
     def stream_nested(
@@ -221,12 +1111,7 @@ class BaseTraceableRunnable(RunnableSerializable[InputType, OutputType], ABC):
         """
         Синхронный стриминг вложенного Runnable с корректной передачей run_manager.get_child().
         """
-        config = ensure_config(
-            {
-                "callbacks": run_manager.get_child(),
-                "run_name": runnable.__class__.__name__,
-            }
-        )
+        config = self._nested_config(runnable, run_manager)
         yield from runnable.stream(input, config=config, **kwargs)
 
     async def astream_nested(
@@ -239,11 +1124,6 @@ class BaseTraceableRunnable(RunnableSerializable[InputType, OutputType], ABC):
         """
         Асинхронный стриминг вложенного Runnable с корректной передачей run_manager.get_child().
         """
-        config = ensure_config(
-            {
-                "callbacks": run_manager.get_child(),
-                "run_name": runnable.__class__.__name__,
-            }
-        )
+        config = self._nested_config(runnable, run_manager)
         async for chunk in runnable.astream(input, config=config, **kwargs):
             yield chunk
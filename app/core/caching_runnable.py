@@ -0,0 +1,252 @@
+from core.base_traceable_runnable import BaseTraceableRunnable, _aggregate_chunks
+from core.response_cache import (
+    CacheEntry,
+    LeaderAbandoned,
+    ResponseCache,
+    make_cache_key,
+)
+from core.sync_offload import run_sync
+from langchain_core.runnables.base import Runnable
+from langchain_core.runnables.config import RunnableConfig
+from pydantic import Field
+from concurrent.futures import Future
+import asyncio
+from typing import Any, Iterator, AsyncIterator, List, TypeVar, Optional, Tuple, Union
+
+InputType = TypeVar("InputType")
+OutputType = TypeVar("OutputType")
+
+
+class CachingRunnable(BaseTraceableRunnable[InputType, OutputType]):
+    """
+    Runnable, который кэширует ответы внутреннего runnable.
+
+    Ключ - стабильный хэш входа и ключей конфига из `config_keys`
+    (без служебных ключей `configurable` с префиксом "__").
+    Конкурентные запросы с одинаковым ключом объединяются в один вызов
+    upstream; если ведущий запрос прерван, ожидающие не падают, а один из
+    них становится новым ведущим. Закэшированный стрим воспроизводится по
+    чанкам. Попадание в кэш отмечается в трейсе дочерним span'ом `cache`.
+    """
+
+    inner_runnable: Runnable[InputType, OutputType]
+    cache: ResponseCache = Field(default_factory=ResponseCache)
+    namespace: Optional[str] = Field(default=None)
+    config_keys: Tuple[str, ...] = Field(default=("configurable",))
+
+    def cache_key(
+        self, input: InputType, config: Optional[RunnableConfig] = None
+    ) -> str:
+        config = config or {}
+        extra = {}
+        for key in self.config_keys:
+            value = config.get(key)
+            if isinstance(value, dict):
+                # Служебные ключи "__" (буфер трейса, дедлайн, профиль)
+                # уникальны для запроса и не влияют на ответ
+                value = {k: v for k, v in value.items() if not k.startswith("__")}
+            if value:
+                extra[key] = value
+        namespace = self.namespace or self.inner_runnable.get_name()
+        return make_cache_key(namespace, input, extra)
+
+    def invalidate(
+        self, input: InputType, config: Optional[RunnableConfig] = None
+    ) -> None:
+        """
+        Удаляет из кэша ответ для конкретного входа.
+        """
+        self.cache.invalidate(self.cache_key(input, config))
+
+    def clear(self) -> None:
+        self.cache.clear()
+
+    def invoke(
+        self, input: InputType, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> OutputType:
+        kwargs.setdefault("cache_key", self.cache_key(input, config))
+        return super().invoke(input, config, **kwargs)
+
+    async def ainvoke(
+        self, input: InputType, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> OutputType:
+        kwargs.setdefault("cache_key", self.cache_key(input, config))
+        return await super().ainvoke(input, config, **kwargs)
+
+    def stream(
+        self, input: InputType, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> Iterator[OutputType]:
+        kwargs.setdefault("cache_key", self.cache_key(input, config))
+        yield from super().stream(input, config, **kwargs)
+
+    async def astream(
+        self, input: InputType, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> AsyncIterator[OutputType]:
+        kwargs.setdefault("cache_key", self.cache_key(input, config))
+        async for chunk in super().astream(input, config, **kwargs):
+            yield chunk
+
+    @staticmethod
+    def _replay(entry: CacheEntry) -> List[Any]:
+        return entry.chunks if entry.chunks is not None else [entry.value]
+
+    def _lookup(self, key: str, run_manager: Any) -> Union[CacheEntry, Future]:
+        """
+        Ответ из кэша или от ведущего запроса, либо Future, если вызывающий
+        сам стал ведущим и должен обратиться к upstream (и завершить Future).
+        """
+        while True:
+            entry = self.cache.get(key)
+            if entry is not None:
+                self.record_span_event(run_manager, "cache", {"cache": "hit"})
+                return entry
+            future, leader = self.cache.begin(key)
+            if leader:
+                self.record_span_event(run_manager, "cache", {"cache": "miss"})
+                return future
+            try:
+                shared: CacheEntry = future.result()
+            except LeaderAbandoned:
+                continue
+            self.record_span_event(run_manager, "cache", {"cache": "coalesced"})
+            return shared
+
+    async def _alookup(self, key: str, run_manager: Any) -> Union[CacheEntry, Future]:
+        while True:
+            entry = self.cache.get(key, use_disk=False)
+            if entry is None and self.cache.disk_path:
+                # SQLite блокирует, поэтому дисковый уровень - вне event loop
+                entry = await run_sync(self.cache.get, key)
+            if entry is not None:
+                await self.arecord_span_event(run_manager, "cache", {"cache": "hit"})
+                return entry
+            future, leader = self.cache.begin(key)
+            if leader:
+                await self.arecord_span_event(run_manager, "cache", {"cache": "miss"})
+                return future
+            try:
+                # shield: отмена ожидающего не должна отменять общий Future
+                shared = await asyncio.shield(asyncio.wrap_future(future))
+            except LeaderAbandoned:
+                continue
+            await self.arecord_span_event(run_manager, "cache", {"cache": "coalesced"})
+            return shared
+
+    async def _afinish(self, key: str, future: Future, entry: CacheEntry) -> None:
+        if self.cache.disk_path:
+            await run_sync(self.cache.finish, key, future, entry)
+        else:
+            self.cache.finish(key, future, entry)
+
+    def _fail(self, key: str, future: Future, exc: BaseException) -> None:
+        """
+        Будит ожидающих: ошибка upstream передаётся им как есть, а прерывание
+        ведущего (отмена, закрытие стрима) - нет, они повторяют запрос сами.
+        """
+        if not isinstance(exc, Exception):
+            exc = LeaderAbandoned()
+        self.cache.finish(key, future, exc=exc)
+
+    def _run(
+        self,
+        input: InputType,
+        *,
+        run_manager: Any,
+        cache_key: Optional[str] = None,
+        **kwargs: Any,
+    ) -> OutputType:
+        key = cache_key or self.cache_key(input)
+        found = self._lookup(key, run_manager)
+        if isinstance(found, CacheEntry):
+            return found.value
+        future = found
+
+        try:
+            value = self.invoke_nested(
+                self.inner_runnable, input, run_manager, **kwargs
+            )
+        except BaseException as exc:
+            self._fail(key, future, exc)
+            raise
+        self.cache.finish(key, future, CacheEntry(value))
+        return value
+
+    async def _arun(
+        self,
+        input: InputType,
+        *,
+        run_manager: Any,
+        cache_key: Optional[str] = None,
+        **kwargs: Any,
+    ) -> OutputType:
+        key = cache_key or self.cache_key(input)
+        found = await self._alookup(key, run_manager)
+        if isinstance(found, CacheEntry):
+            return found.value
+        future = found
+
+        try:
+            value = await self.ainvoke_nested(
+                self.inner_runnable, input, run_manager, **kwargs
+            )
+        except BaseException as exc:
+            self._fail(key, future, exc)
+            raise
+        await self._afinish(key, future, CacheEntry(value))
+        return value
+
+    def _stream(
+        self,
+        input: InputType,
+        *,
+        run_manager: Any,
+        cache_key: Optional[str] = None,
+        **kwargs: Any,
+    ) -> Iterator[OutputType]:
+        key = cache_key or self.cache_key(input)
+        found = self._lookup(key, run_manager)
+        if isinstance(found, CacheEntry):
+            yield from self._replay(found)
+            return
+        future = found
+
+        chunks = []
+        try:
+            for chunk in self.stream_nested(
+                self.inner_runnable, input, run_manager, **kwargs
+            ):
+                chunks.append(chunk)
+                yield chunk
+        except BaseException as exc:
+            # Прерванный стрим не кэшируется
+            self._fail(key, future, exc)
+            raise
+        self.cache.finish(key, future, CacheEntry(_aggregate_chunks(chunks), chunks))
+
+    async def _astream(
+        self,
+        input: InputType,
+        *,
+        run_manager: Any,
+        cache_key: Optional[str] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[OutputType]:
+        key = cache_key or self.cache_key(input)
+        found = await self._alookup(key, run_manager)
+        if isinstance(found, CacheEntry):
+            for chunk in self._replay(found):
+                yield chunk
+            return
+        future = found
+
+        chunks = []
+        try:
+            async for chunk in self.astream_nested(
+                self.inner_runnable, input, run_manager, **kwargs
+            ):
+                chunks.append(chunk)
+                yield chunk
+        except BaseException as exc:
+            self._fail(key, future, exc)
+            raise
+        await self._afinish(key, future, CacheEntry(_aggregate_chunks(chunks), chunks))
@@ -0,0 +1,224 @@
+import importlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+from langchain_core.runnables import Runnable
+from langchain_core.runnables.config import RunnableConfig
+from langserve.server import EndpointName
+from pydantic import BaseModel, Field
+
+from core.sync_offload import run_sync
+
+logger = logging.getLogger(__name__)
+
+
+def import_string(path: str) -> Any:
+    """
+    Объект по строке вида "package.module:attr".
+    """
+    module, _, attr = path.partition(":")
+    return getattr(importlib.import_module(module), attr)
+
+
+DEFAULT_ENDPOINTS: List[EndpointName] = ["invoke", "batch"]
+
+
+class ChainSpec(BaseModel):
+    """
+    Описание endpoint'а: путь, фабрика цепочки ("модуль:функция", вызывается
+    с RunnableConfig) и включённые методы langserve.
+
+    Схемы входа/выхода ("модуль:класс") позволяют зарегистрировать маршрут,
+    не собирая цепочку; без них цепочка собирается при регистрации.
+    """
+
+    path: str
+    factory: str
+    endpoints: List[EndpointName] = Field(
+        default_factory=lambda: list(DEFAULT_ENDPOINTS)
+    )
+    input_schema: Optional[str] = Field(default=None)
+    output_schema: Optional[str] = Field(default=None)
+
+
+def load_chain_specs(default: List[Dict[str, Any]]) -> List[ChainSpec]:
+    """
+    CHAIN_ROUTES_FILE - JSON-список описаний вместо `default`;
+    CHAIN_ROUTES_ENABLED="/v1,/v3" - оставить только эти endpoint'ы.
+    """
+    path = os.getenv("CHAIN_ROUTES_FILE")
+    if path:
+        with open(path, encoding="utf-8") as f:
+            default = json.load(f)
+    specs = [ChainSpec(**item) for item in default]
+    enabled = os.getenv("CHAIN_ROUTES_ENABLED")
+    if enabled:
+        paths = {item.strip() for item in enabled.split(",")}
+        specs = [spec for spec in specs if spec.path in paths]
+    return specs
+
+
+class ChainRegistry:
+    """
+    Реестр цепочек endpoint'ов: цепочка собирается при первом обращении
+    (или фоновым прогревом) и дальше переиспользуется. Сборка одной цепочки
+    не блокирует обращения к уже собранным.
+    """
+
+    def __init__(
+        self, specs: List[ChainSpec], config: Optional[RunnableConfig] = None
+    ) -> None:
+        self.specs = {spec.path: spec for spec in specs}
+        self.config = config or RunnableConfig()
+        self._chains: Dict[str, Runnable] = {}
+        self._locks = {path: threading.Lock() for path in self.specs}
+        self._build_ms: Dict[str, float] = {}
+        self._errors: Dict[str, str] = {}
+
+    def is_built(self, path: str) -> bool:
+        return path in self._chains
+
+    def get(self, path: str) -> Runnable:
+        chain = self._chains.get(path)
+        if chain is not None:
+            return chain
+        with self._locks[path]:
+            chain = self._chains.get(path)
+            if chain is not None:
+                return chain
+            started = time.perf_counter()
+            try:
+                chain = import_string(self.specs[path].factory)(self.config)
+            except Exception as e:
+                self._errors[path] = repr(e)
+                raise
+            self._build_ms[path] = round((time.perf_counter() - started) * 1e3, 2)
+            self._errors.pop(path, None)
+            self._chains[path] = chain
+            return chain
+
+    async def aget(self, path: str) -> Runnable:
+        chain = self._chains.get(path)
+        if chain is not None:
+            return chain
+        # Сборка может быть долгой - не занимаем ею event loop
+        return await run_sync(self.get, path)
+
+    def runnable(self, path: str) -> "LazyRunnable":
+        return LazyRunnable(self, path)
+
+    def warm_up(self) -> None:
+        for path in self.specs:
+            try:
+                self.get(path)
+            except Exception:
+                logger.exception("Failed to build chain for %s", path)
+
+    def start_warm_up(self) -> threading.Thread:
+        thread = threading.Thread(
+            target=self.warm_up, name="chain-warm-up", daemon=True
+        )
+        thread.start()
+        return thread
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            path: {
+                "built": path in self._chains,
+                "build_ms": self._build_ms.get(path),
+                "error": self._errors.get(path),
+            }
+            for path in self.specs
+        }
+
+
+class LazyRunnable(Runnable):
+    """
+    Заместитель цепочки endpoint'а: все вызовы делегируются цепочке из
+    реестра, которая собирается при первом из них.
+    """
+
+    def __init__(self, registry: ChainRegistry, path: str) -> None:
+        self.registry = registry
+        self.path = path
+        self.spec = registry.specs[path]
+        self.name = import_string(self.spec.factory).__name__
+
+    @property
+    def InputType(self) -> Any:
+        return self.registry.get(self.path).InputType
+
+    @property
+    def OutputType(self) -> Any:
+        return self.registry.get(self.path).OutputType
+
+    def get_input_schema(self, config: Optional[RunnableConfig] = None) -> Any:
+        if self.spec.input_schema is not None:
+            return import_string(self.spec.input_schema)
+        return self.registry.get(self.path).get_input_schema(config)
+
+    def get_output_schema(self, config: Optional[RunnableConfig] = None) -> Any:
+        if self.spec.output_schema is not None:
+            return import_string(self.spec.output_schema)
+        return self.registry.get(self.path).get_output_schema(config)
+
+    @property
+    def config_specs(self) -> Any:
+        # До сборки настраиваемых полей нет: фабрики получают готовый config
+        if not self.registry.is_built(self.path):
+            return []
+        return self.registry.get(self.path).config_specs
+
+    def invoke(
+        self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> Any:
+        return self.registry.get(self.path).invoke(input, config, **kwargs)
+
+    async def ainvoke(
+        self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> Any:
+        chain = await self.registry.aget(self.path)
+        return await chain.ainvoke(input, config, **kwargs)
+
+    def batch(self, inputs: List[Any], config: Any = None, **kwargs: Any) -> List[Any]:
+        return self.registry.get(self.path).batch(inputs, config, **kwargs)
+
+    async def abatch(
+        self, inputs: List[Any], config: Any = None, **kwargs: Any
+    ) -> List[Any]:
+        chain = await self.registry.aget(self.path)
+        return await chain.abatch(inputs, config, **kwargs)
+
+    def stream(
+        self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> Iterator[Any]:
+        yield from self.registry.get(self.path).stream(input, config, **kwargs)
+
+    async def astream(
+        self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> AsyncIterator[Any]:
+        chain = await self.registry.aget(self.path)
+        async for chunk in chain.astream(input, config, **kwargs):
+            yield chunk
+
+    def transform(
+        self,
+        input: Iterator[Any],
+        config: Optional[RunnableConfig] = None,
+        **kwargs: Any,
+    ) -> Iterator[Any]:
+        yield from self.registry.get(self.path).transform(input, config, **kwargs)
+
+    async def atransform(
+        self,
+        input: AsyncIterator[Any],
+        config: Optional[RunnableConfig] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[Any]:
+        chain = await self.registry.aget(self.path)
+        async for chunk in chain.atransform(input, config, **kwargs):
+            yield chunk
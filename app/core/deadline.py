@@ -0,0 +1,226 @@
+import asyncio
+import os
+import time
+from typing import Any, AsyncIterator, Iterator, Optional, TypeVar
+
+from langchain_core.runnables.config import RunnableConfig
+
+T = TypeVar("T")
+
+# Абсолютный дедлайн запроса (time.monotonic()) в configurable
+DEADLINE_KEY = "__deadline"
+
+TIMEOUT_HEADER = "x-request-timeout"
+
+
+class DeadlineExceeded(TimeoutError):
+    """
+    Бюджет времени запроса исчерпан.
+    """
+
+
+def get_deadline(config: Optional[RunnableConfig]) -> Optional[float]:
+    if not config:
+        return None
+    configurable = config.get("configurable")
+    if not configurable:
+        return None
+    return configurable.get(DEADLINE_KEY)
+
+
+def with_timeout(config: RunnableConfig, timeout: float) -> RunnableConfig:
+    """
+    Устанавливает дедлайн через `timeout` секунд. Уже заданный более
+    ранний дедлайн не продлевается.
+    """
+    deadline = time.monotonic() + timeout
+    current = get_deadline(config)
+    if current is not None:
+        deadline = min(deadline, current)
+    configurable = {**config.get("configurable", {}), DEADLINE_KEY: deadline}
+    return {**config, "configurable": configurable}
+
+
+def remaining(deadline: Optional[float]) -> Optional[float]:
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def check_deadline(deadline: Optional[float]) -> None:
+    if deadline is not None and time.monotonic() >= deadline:
+        raise DeadlineExceeded("Request deadline exceeded")
+
+
+def attach_deadline(run_manager: Any, deadline: Optional[float]) -> None:
+    """
+    Запоминает дедлайн на run_manager шага: через него вложенные вызовы
+    (invoke_nested и т.п.) получают оставшийся бюджет.
+    """
+    if deadline is not None:
+        run_manager.deadline = deadline
+
+
+def deadline_of(run_manager: Any) -> Optional[float]:
+    return getattr(run_manager, "deadline", None)
+
+
+async def await_until(awaitable: Any, deadline: Optional[float]) -> Any:
+    """
+    Ожидает корутину не дольше дедлайна; по истечении она отменяется.
+    """
+    if deadline is None:
+        return await awaitable
+    budget = deadline - time.monotonic()
+    if budget <= 0:
+        awaitable.close()
+        raise DeadlineExceeded("Request deadline exceeded")
+    try:
+        return await asyncio.wait_for(awaitable, budget)
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded("Request deadline exceeded") from None
+
+
+async def aiter_until(
+    iterator: AsyncIterator[T], deadline: Optional[float]
+) -> AsyncIterator[T]:
+    """
+    Отдаёт чанки async-итератора, пока не истёк дедлайн; ожидание
+    очередного чанка прерывается отменой.
+
+    Один asyncio.timeout на весь цикл: пока чанк обрабатывает потребитель,
+    таймаут снят (reschedule(None)), чтобы отмена не попала в его код.
+    Сработавший таймаут перенести нельзя: если чанк успел прийти вместе с
+    отменой, дедлайн считается истёкшим.
+    """
+    if deadline is None:
+        async for chunk in iterator:
+            yield chunk
+        return
+    # Дедлайн в шкале time.monotonic(), таймаут - в шкале event loop'а
+    loop = asyncio.get_running_loop()
+    timeout = asyncio.timeout(None)
+    try:
+        async with timeout:
+            while True:
+                budget = deadline - time.monotonic()
+                if budget <= 0 or timeout.expired():
+                    raise DeadlineExceeded("Request deadline exceeded")
+                timeout.reschedule(loop.time() + budget)
+                try:
+                    chunk = await iterator.__anext__()
+                except StopAsyncIteration:
+                    return
+                if timeout.expired():
+                    raise DeadlineExceeded("Request deadline exceeded")
+                timeout.reschedule(None)
+                yield chunk
+    except TimeoutError as e:
+        if isinstance(e, DeadlineExceeded) or not timeout.expired():
+            raise
+        raise DeadlineExceeded("Request deadline exceeded") from None
+    finally:
+        aclose = getattr(iterator, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+
+def iter_until(iterator: Iterator[T], deadline: Optional[float]) -> Iterator[T]:
+    """
+    Sync-версия: блокирующий шаг прервать нельзя, поэтому дедлайн
+    проверяется между чанками.
+    """
+    try:
+        for chunk in iterator:
+            yield chunk
+            check_deadline(deadline)
+    finally:
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            close()
+
+
+def default_timeout() -> Optional[float]:
+    """
+    REQUEST_TIMEOUT - бюджет запроса по умолчанию и верхняя граница
+    для заголовка X-Request-Timeout.
+    """
+    value = os.getenv("REQUEST_TIMEOUT")
+    return float(value) if value else None
+
+
+def parse_timeout_header(value: Optional[str]) -> Optional[float]:
+    if value is None:
+        return None
+    try:
+        timeout = float(value)
+    except ValueError:
+        return None
+    return timeout if timeout > 0 else None
+
+
+class DisconnectMiddleware:
+    """
+    ASGI middleware: отменяет обработку запроса, когда клиент отключился.
+
+    Тело запроса читается заранее, после чего отдельная задача слушает
+    http.disconnect до отправки последнего чанка ответа. Отмена доходит
+    до runnable как CancelledError и фиксируется в их span'ах. Для стримов (SSE) sse_starlette сам следит
+    за отключением, middleware для них лишь передаёт событие.
+    """
+
+    def __init__(self, app: Any) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Any, receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        messages = []
+        while True:
+            message = await receive()
+            messages.append(message)
+            if message["type"] != "http.request" or not message.get("more_body"):
+                break
+        if messages[-1]["type"] == "http.disconnect":
+            return
+
+        disconnected = asyncio.Event()
+
+        async def replay() -> Any:
+            if messages:
+                return messages.pop(0)
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        responded = False
+
+        async def watch() -> None:
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    if responded:
+                        return
+                    disconnected.set()
+                    handler.cancel()
+                    return
+
+        async def send_and_track(message: Any) -> None:
+            # После последнего чанка тела сервер шлёт http.disconnect и для
+            # штатно завершённого ответа - он уже не должен отменять запрос
+            nonlocal responded
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body"):
+                responded = True
+                watcher.cancel()
+
+        handler = asyncio.ensure_future(self.app(scope, replay, send_and_track))
+        watcher = asyncio.ensure_future(watch())
+        try:
+            await handler
+        except asyncio.CancelledError:
+            if not disconnected.is_set():
+                raise
+        finally:
+            watcher.cancel()
@@ -0,0 +1,198 @@
+import json
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.load import dumpd
+from langchain_core.outputs import LLMResult
+
+from core.trace_export import TraceExporter
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _jsonable(value: Any) -> Any:
+    try:
+        json.dumps(value)
+        return value
+    except (TypeError, ValueError):
+        pass
+    try:
+        return json.loads(json.dumps(dumpd(value), default=str))
+    except Exception:
+        return repr(value)
+
+
+def serialize_event(event: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Приводит input/output события к JSON. Выполняется в потоке экспорта,
+    а не на пути запроса.
+    """
+    body = event["body"]
+    for key in ("input", "output"):
+        if key in body:
+            body[key] = _jsonable(body[key])
+    return event
+
+
+class IngestionCallbackHandler(BaseCallbackHandler):
+    """
+    Callback handler, который превращает события runnable в события
+    Langfuse Ingestion API и кладёт их в очередь TraceExporter.
+    На пути запроса выполняется только формирование словаря события.
+    """
+
+    raise_error = False
+
+    def __init__(self, exporter: TraceExporter) -> None:
+        self.exporter = exporter
+        # run_id -> trace_id для незавершённых span'ов
+        self._traces: Dict[UUID, str] = {}
+
+    def _emit(self, type: str, body: Dict[str, Any]) -> None:
+        self.exporter.submit(
+            {"id": str(uuid.uuid4()), "timestamp": _now(), "type": type, "body": body}
+        )
+
+    def _trace_id(self, run_id: UUID, parent_run_id: Optional[UUID]) -> str:
+        if parent_run_id is not None and parent_run_id in self._traces:
+            trace_id = self._traces[parent_run_id]
+        else:
+            trace_id = str(run_id)
+        self._traces[run_id] = trace_id
+        return trace_id
+
+    def _start(
+        self,
+        type: str,
+        name: str,
+        input: Any,
+        run_id: UUID,
+        parent_run_id: Optional[UUID],
+        metadata: Optional[Dict[str, Any]],
+    ) -> None:
+        trace_id = self._trace_id(run_id, parent_run_id)
+        if parent_run_id is None:
+            self._emit(
+                "trace-create",
+                {"id": trace_id, "name": name, "timestamp": _now(), "input": input},
+            )
+        self._emit(
+            type,
+            {
+                "id": str(run_id),
+                "traceId": trace_id,
+                "parentObservationId": str(parent_run_id) if parent_run_id else None,
+                "name": name,
+                "startTime": _now(),
+                "input": input,
+                "metadata": metadata or None,
+            },
+        )
+
+    def _end(
+        self,
+        type: str,
+        run_id: UUID,
+        output: Any = None,
+        error: Optional[BaseException] = None,
+        input: Any = None,
+        metadata: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        trace_id = self._traces.pop(run_id, str(run_id))
+        body: Dict[str, Any] = {
+            "id": str(run_id),
+            "traceId": trace_id,
+            "endTime": _now(),
+        }
+        if input is not None:
+            # Стрим начинается с пустого входа, итоговый приходит при завершении
+            body["input"] = input
+        if metadata:
+            # Атрибуты, известные только к концу шага (см. set_span_metadata)
+            body["metadata"] = metadata
+        if error is not None:
+            body["level"] = "ERROR"
+            body["statusMessage"] = str(error)
+        else:
+            body["output"] = output
+        self._emit(type, body)
+        if trace_id == str(run_id) and error is None:
+            self._emit("trace-create", {"id": trace_id, "output": output})
+
+    @staticmethod
+    def _name(serialized: Optional[Dict[str, Any]], kwargs: Dict[str, Any]) -> str:
+        if kwargs.get("name"):
+            return kwargs["name"]
+        if serialized:
+            return serialized.get("name") or serialized.get("id", ["Runnable"])[-1]
+        return "Runnable"
+
+    def on_chain_start(
+        self,
+        serialized: Optional[Dict[str, Any]],
+        inputs: Any,
+        *,
+        run_id: UUID,
+        parent_run_id: Optional[UUID] = None,
+        metadata: Optional[Dict[str, Any]] = None,
+        **kwargs: Any,
+    ) -> None:
+        name = self._name(serialized, kwargs)
+        self._start("span-create", name, inputs, run_id, parent_run_id, metadata)
+
+    def on_chain_end(self, outputs: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(
+            "span-update",
+            run_id,
+            output=outputs,
+            input=kwargs.get("inputs"),
+            metadata=kwargs.get("metadata"),
+        )
+
+    def on_chain_error(
+        self, error: BaseException, *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        self._end("span-update", run_id, error=error)
+
+    def on_chat_model_start(
+        self,
+        serialized: Dict[str, Any],
+        messages: List[List[Any]],
+        *,
+        run_id: UUID,
+        parent_run_id: Optional[UUID] = None,
+        metadata: Optional[Dict[str, Any]] = None,
+        **kwargs: Any,
+    ) -> None:
+        name = self._name(serialized, kwargs)
+        self._start(
+            "generation-create", name, messages, run_id, parent_run_id, metadata
+        )
+
+    def on_llm_start(
+        self,
+        serialized: Dict[str, Any],
+        prompts: List[str],
+        *,
+        run_id: UUID,
+        parent_run_id: Optional[UUID] = None,
+        metadata: Optional[Dict[str, Any]] = None,
+        **kwargs: Any,
+    ) -> None:
+        name = self._name(serialized, kwargs)
+        self._start("generation-create", name, prompts, run_id, parent_run_id, metadata)
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        texts = [g.text for gens in response.generations for g in gens]
+        output = texts[0] if len(texts) == 1 else texts
+        self._end("generation-update", run_id, output=output)
+
+    def on_llm_error(
+        self, error: BaseException, *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        self._end("generation-update", run_id, error=error)
@@ -1,21 +1,172 @@
+import asyncio
 import os
-from langfuse import Langfuse
+import threading
+import time
+from typing import Any, Dict, Optional
+from uuid import UUID
+from langfuse import Langfuse, get_client
 from langfuse.langchain import CallbackHandler
+from langchain_core.callbacks import BaseCallbackHandler
 
+from core.trace_export import LangfuseIngestionTransport, TraceExporter
+from core.trace_sink import LocalFileTransport
+from core.ingestion_handler import IngestionCallbackHandler, serialize_event
+from core.sync_offload import run_sync
 
-def init_langfuse() -> CallbackHandler:
+# Экспортёр буферизованного режима (LANGFUSE_EXPORT_MODE=buffered)
+# или локальной записи (TRACE_SINK=local)
+trace_exporter: Optional[TraceExporter] = None
+
+LANGFUSE_SINK = "langfuse"
+LOCAL_SINK = "local"
+
+
+def trace_sink() -> str:
+    return os.getenv("TRACE_SINK", LANGFUSE_SINK)
+
+
+class LangfuseHealth:
+    """
+    Результат последней проверки подключения к Langfuse (auth_check).
+    status: unknown - проверки ещё не было, ok, error.
+    """
+
+    def __init__(self) -> None:
+        self.status = "unknown"
+        self.error: Optional[str] = None
+        self.checked_at: Optional[float] = None
+        self.latency_ms: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def check(self) -> bool:
+        started = time.perf_counter()
+        try:
+            ok = get_client().auth_check()
+            error = None if ok else "auth_check failed"
+        except Exception as e:
+            ok, error = False, repr(e)
+        with self._lock:
+            self.status = "ok" if ok else "error"
+            self.error = error
+            self.checked_at = time.time()
+            self.latency_ms = round((time.perf_counter() - started) * 1e3, 2)
+        return ok
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "status": self.status,
+                "error": self.error,
+                "checked_at": self.checked_at,
+                "latency_ms": self.latency_ms,
+            }
+
+
+langfuse_health = LangfuseHealth()
+
+
+async def monitor_langfuse(interval: float) -> None:
+    """
+    Периодически проверяет подключение к Langfuse в пуле потоков;
+    при interval <= 0 проверка выполняется один раз.
+    """
+    while True:
+        await run_sync(langfuse_health.check)
+        if interval <= 0:
+            return
+        await asyncio.sleep(interval)
+
+
+class LangfuseCallbackHandler(CallbackHandler):
+    """
+    CallbackHandler Langfuse, который дописывает в span метаданные,
+    переданные при завершении шага (см. BaseTraceableRunnable.set_span_metadata).
+    """
+
+    def on_chain_end(
+        self,
+        outputs: Any,
+        *,
+        run_id: UUID,
+        parent_run_id: Optional[UUID] = None,
+        **kwargs: Any,
+    ) -> Any:
+        metadata = kwargs.get("metadata")
+        span = self.runs.get(run_id)
+        if metadata and span is not None:
+            span.update(metadata=metadata)
+        return super().on_chain_end(
+            outputs, run_id=run_id, parent_run_id=parent_run_id, **kwargs
+        )
+
+
+def init_langfuse() -> BaseCallbackHandler:
     """
     Инициализация Langfuse для локального использования.
     """
     # Устанавливаем переменные окружения для CallbackHandler
     os.environ["LANGFUSE_HOST"] = os.getenv("LANGFUSE_URL", "")
-    os.environ["LANGFUSE_PUBLIC_KEY"] = os.getenv("LANGFUSE_INIT_PROJECT_PUBLIC_KEY", "")
-    os.environ["LANGFUSE_SECRET_KEY"] = os.getenv("LANGFUSE_INIT_PROJECT_SECRET_KEY", "")
-    
-    # Создаем клиент для проверки подключения
-    langfuse_client = Langfuse()
-    langfuse_client.auth_check()
-    
+    os.environ["LANGFUSE_PUBLIC_KEY"] = os.getenv(
+        "LANGFUSE_INIT_PROJECT_PUBLIC_KEY", ""
+    )
+    os.environ["LANGFUSE_SECRET_KEY"] = os.getenv(
+        "LANGFUSE_INIT_PROJECT_SECRET_KEY", ""
+    )
+
+    # Подключение проверяется в фоне (monitor_langfuse), а не при старте:
+    # недоступность Langfuse не должна останавливать сервис
+    Langfuse()
+
+    if os.getenv("LANGFUSE_EXPORT_MODE") == "buffered":
+        return init_buffered_handler()
+
     # CallbackHandler автоматически использует переменные окружения
-    handler = CallbackHandler()
+    handler = LangfuseCallbackHandler()
     return handler
+
+
+def init_trace_handler() -> BaseCallbackHandler:
+    """
+    Handler трейсинга по TRACE_SINK: langfuse (по умолчанию) или local -
+    запись в локальные файлы вместо Langfuse.
+    """
+    if trace_sink() == LOCAL_SINK:
+        return init_local_handler()
+    return init_langfuse()
+
+
+def init_local_handler() -> IngestionCallbackHandler:
+    """
+    События в формате Ingestion API пишутся фоновым потоком TraceExporter'а
+    в ротируемые сжатые файлы (см. LocalFileTransport).
+    """
+    global trace_exporter
+    trace_exporter = TraceExporter.from_env(
+        LocalFileTransport.from_env(), serializer=serialize_event
+    )
+    return IngestionCallbackHandler(trace_exporter)
+
+
+def init_buffered_handler() -> IngestionCallbackHandler:
+    """
+    Handler с собственным экспортом: ограниченная очередь, отправка пачками
+    в фоне и политика переполнения (см. TraceExporter).
+    """
+    global trace_exporter
+    transport = LangfuseIngestionTransport(
+        os.environ["LANGFUSE_HOST"],
+        os.environ["LANGFUSE_PUBLIC_KEY"],
+        os.environ["LANGFUSE_SECRET_KEY"],
+    )
+    trace_exporter = TraceExporter.from_env(transport, serializer=serialize_event)
+    return IngestionCallbackHandler(trace_exporter)
+
+
+def shutdown_langfuse(timeout: float = 5.0) -> None:
+    """
+    Отправляет накопленные события перед остановкой приложения.
+    """
+    if trace_exporter is not None:
+        trace_exporter.shutdown(timeout)
+    else:
+        get_client().flush()
@@ -0,0 +1,202 @@
+import bisect
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+
+# Границы бакетов гистограмм длительностей, секунды
+DURATION_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+# Описание метрик: имя -> (тип, help)
+METRICS = {
+    "runnable_duration_seconds": (
+        "histogram",
+        "Длительность вызова runnable (invoke/stream)",
+    ),
+    "runnable_errors_total": ("counter", "Ошибки runnable по типу исключения"),
+    "runnable_stream_chunks_total": ("counter", "Чанки, отданные стримом runnable"),
+    "runnable_first_chunk_seconds": (
+        "histogram",
+        "Время от старта стрима runnable до первого чанка",
+    ),
+    "runnable_chunk_gap_seconds": (
+        "histogram",
+        "Паузы между соседними чанками стрима runnable",
+    ),
+    "runnable_callback_seconds": (
+        "histogram",
+        "Время внутри callback'ов трейсинга (start/end/token)",
+    ),
+    "retry_attempts_total": ("counter", "Попытки RetryRunnable (first/retry)"),
+    "retry_outcomes_total": ("counter", "Итоги вызовов RetryRunnable"),
+    "stream_shaping_chunks_total": (
+        "counter",
+        "Чанки стрима цепочки до объединения в кадры",
+    ),
+    "stream_shaping_frames_total": (
+        "counter",
+        "Кадры, отданные стримом цепочки после объединения",
+    ),
+    "endpoint_duration_seconds": (
+        "histogram",
+        "Длительность обработки запроса endpoint'ом",
+    ),
+}
+
+
+class _Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self, size: int) -> None:
+        self.counts = [0] * size
+        self.sum = 0.0
+        self.count = 0
+
+
+class MetricsRegistry:
+    """
+    In-process метрики без блокировок на записи.
+
+    Каждый поток пишет в собственный шард (threading.local), поэтому запись -
+    это поиск бакета и инкремент без общих структур. Экспорт суммирует шарды;
+    шарды завершившихся потоков сохраняются, чтобы счётчики не убывали.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = DURATION_BUCKETS) -> None:
+        self.buckets = buckets
+        self._local = threading.local()
+        self._shards: List[Tuple[dict, dict]] = []
+        self._shards_lock = threading.Lock()
+
+    def _shard(self) -> Tuple[dict, dict]:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = ({}, {})
+            self._local.shard = shard
+            # Блокировка только при первой записи потока
+            with self._shards_lock:
+                self._shards.append(shard)
+        return shard
+
+    def inc(self, name: str, labels: Labels, value: float = 1) -> None:
+        counters = self._shard()[0]
+        key = (name, labels)
+        counters[key] = counters.get(key, 0) + value
+
+    def observe(self, name: str, labels: Labels, value: float) -> None:
+        histograms = self._shard()[1]
+        key = (name, labels)
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = _Histogram(len(self.buckets) + 1)
+        histogram.counts[bisect.bisect_left(self.buckets, value)] += 1
+        histogram.sum += value
+        histogram.count += 1
+
+    def _merge(self) -> Tuple[Dict, Dict]:
+        counters: Dict = {}
+        histograms: Dict = {}
+        with self._shards_lock:
+            shards = list(self._shards)
+        for shard_counters, shard_histograms in shards:
+            # Копия: владелец шарда может добавлять ключи во время экспорта
+            for key, value in list(shard_counters.items()):
+                counters[key] = counters.get(key, 0) + value
+            for key, histogram in list(shard_histograms.items()):
+                merged = histograms.get(key)
+                if merged is None:
+                    merged = histograms[key] = _Histogram(len(self.buckets) + 1)
+                merged.counts = [a + b for a, b in zip(merged.counts, histogram.counts)]
+                merged.sum += histogram.sum
+                merged.count += histogram.count
+        return counters, histograms
+
+    def render(self) -> str:
+        """
+        Метрики в текстовом формате Prometheus (version 0.0.4).
+        """
+        counters, histograms = self._merge()
+        by_name: Dict[str, List[str]] = {}
+        for (name, labels), value in sorted(counters.items()):
+            by_name.setdefault(name, []).append(
+                f"{name}{_format_labels(labels)} {_format_value(value)}"
+            )
+        for (name, labels), histogram in sorted(histograms.items()):
+            lines = by_name.setdefault(name, [])
+            cumulative = 0
+            for bound, count in zip(self.buckets, histogram.counts):
+                cumulative += count
+                le = labels + (("le", _format_value(bound)),)
+                lines.append(f"{name}_bucket{_format_labels(le)} {cumulative}")
+            le = labels + (("le", "+Inf"),)
+            lines.append(f"{name}_bucket{_format_labels(le)} {histogram.count}")
+            lines.append(
+                f"{name}_sum{_format_labels(labels)} {_format_value(histogram.sum)}"
+            )
+            lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+
+        output = []
+        for name, lines in by_name.items():
+            kind, description = METRICS.get(name, ("untyped", ""))
+            output.append(f"# HELP {name} {description}")
+            output.append(f"# TYPE {name} {kind}")
+            output.extend(lines)
+        return "\n".join(output) + "\n"
+
+    def reset(self) -> None:
+        with self._shards_lock:
+            for counters, histograms in self._shards:
+                counters.clear()
+                histograms.clear()
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+metrics = MetricsRegistry()
+
+
+def observe(name: str, labels: Labels, value: float) -> None:
+    if METRICS_ENABLED:
+        metrics.observe(name, labels, value)
+
+
+def inc(name: str, labels: Labels, value: float = 1) -> None:
+    if METRICS_ENABLED:
+        metrics.inc(name, labels, value)
+
+
+def error_labels(runnable: str, error: Optional[BaseException]) -> Labels:
+    return (("runnable", runnable), ("error", type(error).__name__))
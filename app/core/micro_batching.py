@@ -0,0 +1,274 @@
+import asyncio
+import time
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import Field, PrivateAttr
+
+from core.resilience import LatencyTracker
+
+_END = object()
+
+
+class _Pending:
+    __slots__ = ("item", "future", "queue", "enqueued")
+
+    def __init__(self, item: Any, loop: asyncio.AbstractEventLoop, stream: bool):
+        self.item = item
+        self.future: Optional[asyncio.Future] = None if stream else loop.create_future()
+        self.queue: Optional[asyncio.Queue] = asyncio.Queue() if stream else None
+        self.enqueued = time.monotonic()
+
+    @property
+    def abandoned(self) -> bool:
+        return self.future is not None and self.future.done()
+
+
+class MicroBatcher:
+    """
+    Объединяет конкурентные независимые запросы в пачки.
+
+    Запрос ждёт не дольше `window` секунд, пока наберётся `max_batch_size`
+    запросов, после чего пачка уходит одним вызовом `run_batch` (для
+    стримов - `stream_batch`, который отдаёт пары (номер в пачке, чанк)).
+    Результаты раздаются ожидающим запросам; исключение на месте результата
+    поднимается только у своего запроса. Работает в одном event loop.
+    """
+
+    def __init__(
+        self,
+        run_batch: Callable[[List[Any]], Awaitable[List[Any]]],
+        stream_batch: Optional[
+            Callable[[List[Any]], AsyncIterator[Tuple[int, Any]]]
+        ] = None,
+        max_batch_size: int = 8,
+        window: float = 0.01,
+    ) -> None:
+        self.run_batch = run_batch
+        self.stream_batch = stream_batch
+        self.max_batch_size = max_batch_size
+        self.window = window
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # Отдельные очереди для обычных запросов и стримов
+        self._pending: Dict[bool, List[_Pending]] = {False: [], True: []}
+        self._timers: Dict[bool, Optional[asyncio.TimerHandle]] = {}
+        self._tasks: set = set()
+        self._batch_sizes = LatencyTracker(window=1000)
+        self._counters = {"batches": 0, "items": 0}
+
+    def _enqueue(self, item: Any, stream: bool) -> _Pending:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Новый event loop (например, повторный asyncio.run) - старые
+            # ожидания к нему не относятся
+            self._loop = loop
+            self._pending = {False: [], True: []}
+            self._timers = {}
+        entry = _Pending(item, loop, stream)
+        pending = self._pending[stream]
+        pending.append(entry)
+        if len(pending) >= self.max_batch_size:
+            self._flush(stream)
+        elif self._timers.get(stream) is None:
+            self._timers[stream] = loop.call_later(self.window, self._flush, stream)
+        return entry
+
+    def _flush(self, stream: bool) -> None:
+        timer = self._timers.pop(stream, None)
+        if timer is not None:
+            timer.cancel()
+        pending = [e for e in self._pending[stream] if not e.abandoned]
+        batch = pending[: self.max_batch_size]
+        self._pending[stream] = pending[self.max_batch_size :]
+        if self._pending[stream]:
+            self._timers[stream] = asyncio.get_running_loop().call_later(
+                self.window, self._flush, stream
+            )
+        if not batch:
+            return
+        self._counters["batches"] += 1
+        self._counters["items"] += len(batch)
+        self._batch_sizes.record(len(batch))
+        run = self._run_stream if stream else self._run
+        task = asyncio.ensure_future(run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _info(self, batch: List[_Pending], entry: _Pending, started: float) -> dict:
+        return {
+            "batch_size": len(batch),
+            "queue_wait_ms": round((started - entry.enqueued) * 1e3, 2),
+        }
+
+    async def _run(self, batch: List[_Pending]) -> None:
+        started = time.monotonic()
+        try:
+            results = await self.run_batch([entry.item for entry in batch])
+        except Exception as e:
+            results = [e] * len(batch)
+        for entry, result in zip(batch, results):
+            future = entry.future
+            assert future is not None
+            if future.done():
+                continue
+            info = self._info(batch, entry, started)
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result((result, info))
+
+    async def _run_stream(self, batch: List[_Pending]) -> None:
+        assert self.stream_batch is not None
+        started = time.monotonic()
+        queues: List[asyncio.Queue] = []
+        for entry in batch:
+            assert entry.queue is not None
+            queues.append(entry.queue)
+            entry.queue.put_nowait(self._info(batch, entry, started))
+        try:
+            async for idx, chunk in self.stream_batch([e.item for e in batch]):
+                queues[idx].put_nowait(chunk)
+        except Exception as e:
+            for queue in queues:
+                queue.put_nowait(e)
+        finally:
+            for queue in queues:
+                queue.put_nowait(_END)
+
+    async def submit(self, item: Any) -> Tuple[Any, dict]:
+        """
+        Результат запроса и сведения о пачке: batch_size, queue_wait_ms.
+        """
+        future = self._enqueue(item, stream=False).future
+        assert future is not None
+        return await future
+
+    async def submit_stream(self, item: Any) -> AsyncIterator[Tuple[Any, dict]]:
+        """
+        Чанки запроса вместе со сведениями о его пачке.
+        """
+        if self.stream_batch is None:
+            raise NotImplementedError("stream_batch is not configured")
+        queue = self._enqueue(item, stream=True).queue
+        assert queue is not None
+        info = await queue.get()
+        while True:
+            chunk = await queue.get()
+            if chunk is _END:
+                return
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk, info
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._counters,
+            "pending": sum(len(p) for p in self._pending.values()),
+            "batch_size_p50": self._batch_sizes.percentile(0.5),
+            "batch_size_max": self._batch_sizes.percentile(1.0),
+        }
+
+
+class MicroBatchingChatModel(BaseChatModel):
+    """
+    Модель-обёртка: async-вызовы конкурентных запросов объединяются
+    MicroBatcher'ом в пачки для `llm`, который реализует
+    `agenerate_batch`/`astream_batch` (см. SimpleLLM).
+
+    У каждого запроса остаётся свой LLM span; размер пачки и время
+    ожидания в очереди попадают в generation_info и llm_output. Sync-вызовы
+    идут в `llm` напрямую, без пачек.
+    """
+
+    llm: BaseChatModel
+    max_batch_size: int = Field(default=8)
+    window: float = Field(default=0.01)
+
+    _batcher: Optional[MicroBatcher] = PrivateAttr(default=None)
+
+    @property
+    def batcher(self) -> MicroBatcher:
+        if self._batcher is None:
+            # Пакетные методы не входят в интерфейс BaseChatModel
+            llm: Any = self.llm
+            self._batcher = MicroBatcher(
+                llm.agenerate_batch,
+                llm.astream_batch,
+                max_batch_size=self.max_batch_size,
+                window=self.window,
+            )
+        return self._batcher
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[Any] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        return self.llm._generate(messages, stop, run_manager, **kwargs)
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[Any] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        text, info = await self.batcher.submit(messages)
+        generation = ChatGeneration(
+            message=AIMessage(content=text, response_metadata=info),
+            generation_info=info,
+        )
+        return ChatResult(generations=[generation], llm_output=info)
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[Any] = None,
+        **kwargs: Any,
+    ) -> Any:
+        return self.llm._stream(messages, stop, run_manager, **kwargs)
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[Any] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        first = True
+        async for text, info in self.batcher.submit_stream(messages):
+            # Сведения о пачке - в первом чанке, они известны до генерации
+            chunk = ChatGenerationChunk(
+                message=AIMessageChunk(content=text),
+                generation_info=info if first else None,
+            )
+            first = False
+            if run_manager is not None:
+                await run_manager.on_llm_new_token(text, chunk=chunk)
+            yield chunk
+
+    @property
+    def _llm_type(self) -> str:
+        return "micro-batching"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {
+            "llm": self.llm._llm_type,
+            "max_batch_size": self.max_batch_size,
+            "window": self.window,
+        }
@@ -0,0 +1,339 @@
+import asyncio
+import contextlib
+import queue
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from typing import (
+    Any,
+    AsyncIterator,
+    Deque,
+    Dict,
+    Iterator,
+    List,
+    Literal,
+    Optional,
+    Tuple,
+)
+
+from langchain_core.runnables.base import Runnable
+from langchain_core.runnables.config import RunnableConfig
+from pydantic import Field, PrivateAttr
+
+from core.base_traceable_runnable import BaseTraceableRunnable
+from core.sync_offload import get_offload_executor
+
+FAIL_FAST = "fail_fast"
+COLLECT_ALL = "collect_all"
+
+_END = object()
+
+# Чанков на ветку в очереди стрима, пока потребитель не успевает их забрать
+_QUEUE_PER_BRANCH = 4
+# Как часто заблокированный producer проверяет, не закрыт ли стрим
+_PUT_POLL_INTERVAL = 0.1
+
+
+class _BranchLimiter:
+    """
+    Общий лимит веток для sync- и async-пути: счётчик свободных мест под
+    threading.Lock и очередь ожидающих. Освободившееся место передаётся
+    первому ожидающему: потоку - через threading.Event, корутине - через
+    Future её event loop'а (call_soon_threadsafe), так что loop не
+    блокируется и не опрашивает счётчик.
+    """
+
+    def __init__(self, limit: int) -> None:
+        self._free = limit
+        self._lock = threading.Lock()
+        self._waiters: Deque[Any] = deque()
+
+    def __enter__(self) -> None:
+        with self._lock:
+            if self._free and not self._waiters:
+                self._free -= 1
+                return
+            event = threading.Event()
+            self._waiters.append(event)
+        event.wait()
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.release()
+
+    async def __aenter__(self) -> None:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._free and not self._waiters:
+                self._free -= 1
+                return
+            waiter = (loop, loop.create_future())
+            self._waiters.append(waiter)
+        try:
+            await waiter[1]
+        except asyncio.CancelledError:
+            with self._lock:
+                queued = waiter in self._waiters
+                if queued:
+                    self._waiters.remove(waiter)
+            if not queued and waiter[1].done() and not waiter[1].cancelled():
+                # Место уже передано, но корутина отменена: отдаём его дальше
+                self.release()
+            raise
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        self.release()
+
+    def release(self) -> None:
+        with self._lock:
+            if not self._waiters:
+                self._free += 1
+                return
+            waiter = self._waiters.popleft()
+        if isinstance(waiter, threading.Event):
+            waiter.set()
+        else:
+            loop, future = waiter
+            try:
+                loop.call_soon_threadsafe(self._grant, future)
+            except RuntimeError:
+                # Loop ожидающего уже закрыт: место достаётся следующему
+                self.release()
+
+    def _grant(self, future: "asyncio.Future[None]") -> None:
+        # Выполняется в loop'е ожидающего: он мог быть отменён до передачи
+        if future.cancelled():
+            self.release()
+        else:
+            future.set_result(None)
+
+
+class ParallelTraceableRunnable(BaseTraceableRunnable[Any, Dict[str, Any]]):
+    """
+    Запускает несколько runnable на одном входе одновременно и возвращает
+    словарь {имя ветки: результат}. Каждая ветка - дочерний span шага.
+
+    - async-путь: asyncio-задачи, sync-путь: общий пул потоков. Ветку,
+      которую пул ещё не взял в работу, выполняет сам вызывающий поток:
+      вызов из потока пула не ждёт свободного места в нём же;
+    - `max_concurrency` ограничивает число одновременно работающих веток
+      во всех вызовах экземпляра, sync и async вместе;
+    - error_policy=fail_fast: первая ошибка отменяет остальные ветки и
+      пробрасывается; collect_all: дожидаемся всех веток, исключение
+      кладётся в результат вместо значения ветки;
+    - стриминг отдаёт чанки веток по мере поступления в виде {ветка: чанк};
+      ветки, опередившие потребителя, ждут на ограниченной очереди.
+    """
+
+    branches: Dict[str, Runnable]
+    max_concurrency: Optional[int] = Field(default=None)
+    error_policy: Literal["fail_fast", "collect_all"] = Field(default="fail_fast")
+
+    # Ветки сами распределяются по пулу/event loop'у
+    offload_sync = False
+
+    _slots: Optional[_BranchLimiter] = PrivateAttr(default=None)
+
+    def model_post_init(self, __context: Any) -> None:
+        super().model_post_init(__context)
+        if self.max_concurrency:
+            self._slots = _BranchLimiter(self.max_concurrency)
+
+    def _limit(self) -> Any:
+        return self._slots if self._slots is not None else contextlib.nullcontext()
+
+    def _branch_config(
+        self, name: str, branch: Runnable, run_manager: Any
+    ) -> RunnableConfig:
+        config = self._nested_config(branch, run_manager)
+        config["run_name"] = name
+        return config
+
+    def _run(self, input: Any, *, run_manager: Any, **kwargs: Any) -> Dict[str, Any]:
+        items = list(self.branches.items())
+
+        def call(name: str, branch: Runnable) -> Any:
+            config = self._branch_config(name, branch, run_manager)
+            with self._limit():
+                return branch.invoke(input, config, **kwargs)
+
+        executor = get_offload_executor()
+        results: Dict[str, Any] = {}
+        pending: Dict[Future, str] = {
+            executor.submit(call, name, branch): name for name, branch in items
+        }
+        try:
+            # Вызывающий поток не простаивает: ещё не начатые ветки он
+            # выполняет сам
+            for future, name in list(pending.items()):
+                if future.cancel():
+                    del pending[future]
+                    try:
+                        results[name] = call(name, self.branches[name])
+                    except Exception as e:
+                        if self.error_policy == FAIL_FAST:
+                            raise
+                        results[name] = e
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = pending.pop(future)
+                    error = future.exception()
+                    if error is None:
+                        results[name] = future.result()
+                    elif self.error_policy == FAIL_FAST:
+                        raise error
+                    else:
+                        results[name] = error
+        finally:
+            # Уже запущенные потоки не прерываются, но и не ждутся
+            for future in pending:
+                future.cancel()
+        return {name: results[name] for name, _ in items}
+
+    async def _arun(
+        self, input: Any, *, run_manager: Any, **kwargs: Any
+    ) -> Dict[str, Any]:
+        async def call(name: str, branch: Runnable) -> Any:
+            config = self._branch_config(name, branch, run_manager)
+            async with self._limit():
+                return await branch.ainvoke(input, config, **kwargs)
+
+        tasks = {
+            name: asyncio.ensure_future(call(name, branch))
+            for name, branch in self.branches.items()
+        }
+        if self.error_policy == COLLECT_ALL:
+            values = await asyncio.gather(*tasks.values(), return_exceptions=True)
+            return dict(zip(tasks, values))
+        try:
+            # gather без return_exceptions пробрасывает первую ошибку
+            values = await asyncio.gather(*tasks.values())
+        finally:
+            for task in tasks.values():
+                task.cancel()
+        return dict(zip(tasks, values))
+
+    def _stream(
+        self, input: Any, *, run_manager: Any, **kwargs: Any
+    ) -> Iterator[Dict[str, Any]]:
+        items = list(self.branches.items())
+        chunks: queue.Queue = queue.Queue(maxsize=_QUEUE_PER_BRANCH * len(items))
+        stopped = threading.Event()
+        running = len(items)
+
+        def put(item: Tuple[str, Any, Optional[BaseException]]) -> bool:
+            # Потребитель мог закрыть стрим, пока очередь заполнена
+            while not stopped.is_set():
+                try:
+                    chunks.put(item, timeout=_PUT_POLL_INTERVAL)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def branch_chunks(name: str, branch: Runnable) -> Iterator[Any]:
+            config = self._branch_config(name, branch, run_manager)
+            with self._limit():
+                yield from branch.stream(input, config, **kwargs)
+
+        def produce(name: str, branch: Runnable) -> None:
+            try:
+                for chunk in branch_chunks(name, branch):
+                    if not put((name, chunk, None)):
+                        return
+            except Exception as e:
+                put((name, _END, e))
+                return
+            put((name, _END, None))
+
+        def handle(
+            name: str, chunk: Any, error: Optional[BaseException]
+        ) -> Optional[Dict[str, Any]]:
+            if chunk is not _END:
+                return {name: chunk}
+            if error is None:
+                return None
+            if self.error_policy == FAIL_FAST:
+                raise error
+            return {name: error}
+
+        def drain() -> Iterator[Dict[str, Any]]:
+            # Чанки параллельных веток, накопившиеся за время чанка своей
+            nonlocal running
+            while True:
+                try:
+                    name, chunk, error = chunks.get_nowait()
+                except queue.Empty:
+                    return
+                if chunk is _END:
+                    running -= 1
+                out = handle(name, chunk, error)
+                if out is not None:
+                    yield out
+
+        executor = get_offload_executor()
+        futures: List[Tuple[Future, str, Runnable]] = [
+            (executor.submit(produce, name, branch), name, branch)
+            for name, branch in items
+        ]
+        try:
+            # Ещё не начатые ветки стримятся прямо в вызывающем потоке
+            for future, name, branch in futures:
+                if not future.cancel():
+                    continue
+                try:
+                    for chunk in branch_chunks(name, branch):
+                        yield {name: chunk}
+                        yield from drain()
+                except Exception as e:
+                    if self.error_policy == FAIL_FAST:
+                        raise
+                    yield {name: e}
+                running -= 1
+            while running:
+                name, chunk, error = chunks.get()
+                if chunk is _END:
+                    running -= 1
+                out = handle(name, chunk, error)
+                if out is not None:
+                    yield out
+        finally:
+            stopped.set()
+
+    async def _astream(
+        self, input: Any, *, run_manager: Any, **kwargs: Any
+    ) -> AsyncIterator[Dict[str, Any]]:
+        chunks: asyncio.Queue = asyncio.Queue(
+            maxsize=_QUEUE_PER_BRANCH * len(self.branches)
+        )
+
+        async def produce(name: str, branch: Runnable) -> None:
+            config = self._branch_config(name, branch, run_manager)
+            async with self._limit():
+                try:
+                    async for chunk in branch.astream(input, config, **kwargs):
+                        await chunks.put((name, chunk, None))
+                except Exception as e:
+                    await chunks.put((name, _END, e))
+                    return
+            await chunks.put((name, _END, None))
+
+        tasks = [
+            asyncio.ensure_future(produce(name, branch))
+            for name, branch in self.branches.items()
+        ]
+        running = len(tasks)
+        try:
+            while running:
+                name, chunk, error = await chunks.get()
+                if chunk is not _END:
+                    yield {name: chunk}
+                    continue
+                running -= 1
+                if error is not None:
+                    if self.error_policy == FAIL_FAST:
+                        raise error
+                    yield {name: error}
+        finally:
+            for task in tasks:
+                task.cancel()
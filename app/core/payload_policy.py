@@ -0,0 +1,140 @@
+import hashlib
+import json
+import os
+from typing import Any, Dict, Optional
+
+from langchain_core.messages import BaseMessage
+from pydantic import BaseModel, Field
+
+# Отпечаток входа родительского span'а в configurable вложенного вызова
+PAYLOAD_PARENT_KEY = "__payload_parent"
+
+SAME_AS_PARENT = "[same as parent input]"
+
+
+def fingerprint(value: Any) -> Any:
+    """
+    Дешёвый отпечаток значения для сравнения с родительским span'ом:
+    хеш строки в CPython кэшируется, поэтому повторный вызов для того же
+    объекта не проходит по содержимому.
+    """
+    if isinstance(value, str):
+        return ("s", len(value), hash(value))
+    if isinstance(value, dict):
+        return ("d", tuple((k, fingerprint(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return ("l", tuple(fingerprint(v) for v in value))
+    if isinstance(value, BaseMessage):
+        return ("m", value.type, fingerprint(value.content))
+    return ("o", id(value))
+
+
+class PayloadPolicy(BaseModel):
+    """
+    Что из входа/выхода шага попадает в span.
+
+    Строки длиннее `hash_over` заменяются на sha256 и длину, длиннее
+    `max_chars` (или лимита поля из `field_limits`) - обрезаются с пометкой;
+    списки обрезаются до `max_items`. При `dedupe_parent` вход, совпадающий
+    со входом родительского span'а (вложенный вызов, ретрай), не дублируется.
+    """
+
+    max_chars: Optional[int] = Field(default=None)
+    field_limits: Dict[str, int] = Field(default_factory=dict)
+    hash_over: Optional[int] = Field(default=None)
+    max_items: Optional[int] = Field(default=None)
+    dedupe_parent: bool = Field(default=False)
+
+    @property
+    def transforms(self) -> bool:
+        return (
+            self.max_chars is not None
+            or bool(self.field_limits)
+            or self.hash_over is not None
+            or self.max_items is not None
+        )
+
+    def apply(self, value: Any, field: Optional[str] = None) -> Any:
+        if not self.transforms:
+            return value
+        return self._apply(value, field)
+
+    def apply_input(self, value: Any, parent: Any = None) -> Any:
+        if self.dedupe_parent and parent is not None and fingerprint(value) == parent:
+            return SAME_AS_PARENT
+        return self.apply(value)
+
+    def _apply(self, value: Any, field: Optional[str]) -> Any:
+        if isinstance(value, str):
+            return self._apply_str(value, field)
+        if isinstance(value, dict):
+            return {k: self._apply(v, k) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            items = [self._apply(v, field) for v in value[: self.max_items]]
+            if self.max_items is not None and len(value) > self.max_items:
+                items.append(f"[{len(value) - self.max_items} more items]")
+            return items
+        if isinstance(value, BaseMessage) and isinstance(value.content, str):
+            content = self._apply_str(value.content, field)
+            if content is value.content:
+                return value
+            return value.model_copy(update={"content": content})
+        return value
+
+    def _apply_str(self, value: str, field: Optional[str]) -> Any:
+        length = len(value)
+        if self.hash_over is not None and length > self.hash_over:
+            digest = hashlib.sha256(value.encode("utf-8", "replace")).hexdigest()
+            return {"sha256": digest, "length": length}
+        limit = (
+            self.field_limits.get(field, self.max_chars) if field else self.max_chars
+        )
+        if limit is not None and length > limit:
+            return f"{value[:limit]}... [truncated, {length} chars]"
+        return value
+
+    @classmethod
+    def from_env(cls) -> "PayloadPolicy":
+        """
+        PAYLOAD_MAX_CHARS=2000, PAYLOAD_FIELD_LIMITS="input=4000,output=1000",
+        PAYLOAD_HASH_OVER=20000, PAYLOAD_MAX_ITEMS=50, PAYLOAD_DEDUPE_PARENT=1.
+        """
+        field_limits = {}
+        for item in os.getenv("PAYLOAD_FIELD_LIMITS", "").split(","):
+            if "=" in item:
+                name, limit = item.split("=", 1)
+                field_limits[name.strip()] = int(limit)
+
+        def optional_int(name: str) -> Optional[int]:
+            value = os.getenv(name)
+            return int(value) if value else None
+
+        return cls(
+            max_chars=optional_int("PAYLOAD_MAX_CHARS"),
+            field_limits=field_limits,
+            hash_over=optional_int("PAYLOAD_HASH_OVER"),
+            max_items=optional_int("PAYLOAD_MAX_ITEMS"),
+            dedupe_parent=os.getenv("PAYLOAD_DEDUPE_PARENT") == "1",
+        )
+
+
+_default_policy: Optional[PayloadPolicy] = None
+_overrides: Dict[str, PayloadPolicy] = {}
+
+
+def policy_for(runnable: str) -> PayloadPolicy:
+    """
+    Политика шага по имени: PAYLOAD_POLICY_OVERRIDES - JSON вида
+    {"RetryRunnable": {"max_chars": 200}}, поля которого дополняют общую
+    политику из переменных PAYLOAD_*.
+    """
+    global _default_policy, _overrides
+    if _default_policy is None:
+        _default_policy = PayloadPolicy.from_env()
+        _overrides = {
+            name: _default_policy.model_copy(update=fields)
+            for name, fields in json.loads(
+                os.getenv("PAYLOAD_POLICY_OVERRIDES") or "{}"
+            ).items()
+        }
+    return _overrides.get(runnable, _default_policy)
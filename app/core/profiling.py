@@ -0,0 +1,359 @@
+import asyncio
+import cProfile
+import glob
+import logging
+import os
+import pstats
+import random
+import re
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+logger = logging.getLogger(__name__)
+
+# Решение профилировать запрос (заголовок X-Profile) в configurable
+PROFILE_KEY = "__profile"
+
+PROFILE_HEADER = "x-profile"
+
+# Каталог приложения: по нему код приложения отличается от библиотек
+APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Категории времени по файлу функции (проверяются по порядку)
+_CATEGORIES = (
+    (
+        "callbacks",
+        (
+            "langchain_core/callbacks/",
+            "langchain_core/tracers/",
+            "/langfuse/",
+            "/opentelemetry/",
+            "core/ingestion_handler.py",
+            "core/trace_export.py",
+        ),
+    ),
+    ("event_loop", ("/asyncio/", "/selectors.py", "/threading.py", "/concurrent/")),
+    (
+        "framework",
+        (
+            "/langchain_core/",
+            "/langchain/",
+            "/langserve/",
+            "/pydantic",
+            "/starlette/",
+            "/fastapi/",
+            "/sse_starlette/",
+        ),
+    ),
+)
+
+_active: ContextVar[Optional["ProfileSession"]] = ContextVar(
+    "profile_session", default=None
+)
+# cProfile нельзя вложить: одновременно профилируется один запрос процесса
+_busy = threading.Lock()
+
+
+def _category(filename: str) -> str:
+    if filename == "~":
+        return "builtins"
+    for name, markers in _CATEGORIES:
+        if any(marker in filename for marker in markers):
+            return name
+    if filename.startswith(APP_ROOT):
+        return "app"
+    return "other"
+
+
+def _label(key: Tuple[str, int, str]) -> str:
+    filename, line, name = key
+    if filename == "~":
+        return name
+    if filename.startswith(APP_ROOT):
+        filename = os.path.relpath(filename, APP_ROOT)
+    elif "site-packages/" in filename:
+        filename = filename.split("site-packages/", 1)[1]
+    return f"{filename}:{line}({name})"
+
+
+def _stages() -> Dict[Tuple[str, int, str], str]:
+    """
+    Ключи pstats методов BaseTraceableRunnable и наследников ->
+    "Класс.метод": по ним время раскладывается по шагам цепочки и по
+    служебной части (старт/закрытие span'ов, вложенные вызовы).
+    """
+    from core.base_traceable_runnable import BaseTraceableRunnable
+
+    index = {}
+    classes = [BaseTraceableRunnable]
+    while classes:
+        cls = classes.pop()
+        classes.extend(cls.__subclasses__())
+        for name, attr in vars(cls).items():
+            code = getattr(attr, "__code__", None)
+            if code is not None:
+                key = (code.co_filename, code.co_firstlineno, code.co_name)
+                index[key] = f"{cls.__name__}.{name}"
+    return index
+
+
+def summarize(stats: pstats.Stats, wall: float, top: int) -> Dict[str, Any]:
+    """
+    Сводка профиля для трейса: время по категориям (callback'и трейсинга,
+    код приложения, фреймворк, event loop), по методам runnable и самые
+    затратные функции.
+    """
+    # Сырые данные pstats: {(файл, строка, функция): (cc, nc, tt, ct, callers)}
+    entries: Dict[Tuple[str, int, str], Tuple[Any, ...]] = getattr(stats, "stats")
+    categories: Dict[str, float] = {}
+    stages: Dict[str, Dict[str, Any]] = {}
+    index = _stages()
+    for key, (_, calls, tottime, cumtime, _) in entries.items():
+        category = _category(key[0])
+        categories[category] = categories.get(category, 0.0) + tottime
+        stage = index.get(key)
+        if stage is not None:
+            stages[stage] = {"calls": calls, "cumtime_ms": round(cumtime * 1e3, 3)}
+    total = sum(categories.values())
+    ranked = sorted(entries.items(), key=lambda item: item[1][2], reverse=True)
+    ranked_stages = sorted(stages.items(), key=lambda kv: -kv[1]["cumtime_ms"])
+    return {
+        "wall_ms": round(wall * 1e3, 3),
+        "profiled_ms": round(total * 1e3, 3),
+        "time_by_category_ms": {
+            name: round(value * 1e3, 3)
+            for name, value in sorted(categories.items(), key=lambda kv: -kv[1])
+        },
+        "callbacks_share": (
+            round(categories.get("callbacks", 0.0) / total, 4) if total else 0.0
+        ),
+        "stages": dict(ranked_stages),
+        "top": [
+            {
+                "function": _label(key),
+                "calls": calls,
+                "tottime_ms": round(tottime * 1e3, 3),
+                "cumtime_ms": round(cumtime * 1e3, 3),
+            }
+            for key, (_, calls, tottime, cumtime, _) in ranked[:top]
+        ],
+    }
+
+
+class ProfileSession:
+    """
+    Профиль одного запроса: cProfile потока, в котором выполняется запрос,
+    и профили вызовов, вынесенных в пул потоков (run_sync/iterate_sync).
+    """
+
+    def __init__(self, profiler: "RequestProfiler", name: str) -> None:
+        self.profiler = profiler
+        self.name = name
+        self.run_id = uuid.uuid4()
+        self.profile = cProfile.Profile()
+        self.threads: List[cProfile.Profile] = []
+        self.root: Any = None
+        self.started = 0.0
+        self.wall = 0.0
+        self.expired = False
+        self._token: Any = None
+        self._lock = threading.Lock()
+        self._thread = threading.get_ident()
+        self._timer: Any = None
+        self._stopped = False
+        self._enabled = False
+
+    def wrap(self, func: Callable[..., T]) -> Callable[..., T]:
+        def call(*args: Any, **kwargs: Any) -> T:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Python 3.12+: профилировщик запроса уже видит все потоки
+                return func(*args, **kwargs)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profile.disable()
+                with self._lock:
+                    self.threads.append(profile)
+
+        return call
+
+    def _start(self, max_duration: Optional[float]) -> bool:
+        try:
+            self.profile.enable()
+        except ValueError:
+            # Активен другой профилировщик (например, внешний)
+            return False
+        self._enabled = True
+        self.started = time.perf_counter()
+        self._token = _active.set(self)
+        if max_duration:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                self._timer = threading.Timer(max_duration, self._expire)
+                self._timer.daemon = True
+                self._timer.start()
+            else:
+                self._timer = loop.call_later(max_duration, self._expire)
+        return True
+
+    def _disable(self) -> bool:
+        """
+        Выключает cProfile и освобождает профилировщик процесса; True -
+        при первом вызове.
+        """
+        with self._lock:
+            if self._stopped:
+                return False
+            self._stopped = True
+        # cProfile выключается только в потоке, где был включён: из потока
+        # таймера (sync-запрос) освобождается лишь место для других запросов
+        self._disable_profile()
+        self.wall = time.perf_counter() - self.started
+        _busy.release()
+        return True
+
+    def _disable_profile(self) -> None:
+        # Повторный disable сбросил бы профилировщик, включённый в потоке
+        # следующим запросом
+        if self._enabled and threading.get_ident() == self._thread:
+            self.profile.disable()
+            self._enabled = False
+
+    def _expire(self) -> None:
+        # Долгий или зависший стрим не держит профилировщик процесса
+        if self._disable():
+            self.expired = True
+
+    def stop(self) -> None:
+        """
+        Останавливает профилирование. Вызывается в потоке, где оно начато.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+        if not self._disable():
+            # Остановлен по max_duration из потока таймера
+            self._disable_profile()
+        try:
+            _active.reset(self._token)
+        except ValueError:
+            # Стрим закрывается в другом контексте
+            _active.set(None)
+
+    def write(self) -> Dict[str, Any]:
+        """
+        Сохраняет профиль в формате pstats (snakeviz, `python -m pstats`)
+        и возвращает сводку со ссылкой на файл.
+        """
+        stats = pstats.Stats(self.profile)
+        with self._lock:
+            for profile in self.threads:
+                stats.add(profile)
+        summary = summarize(stats, self.wall, self.profiler.top)
+        if self.expired:
+            summary["truncated"] = True
+        directory = self.profiler.directory
+        os.makedirs(directory, exist_ok=True)
+        name = re.sub(r"[^\w.-]+", "_", self.name).strip("_") or "request"
+        path = os.path.join(
+            directory,
+            f"{time.strftime('%Y%m%d-%H%M%S')}-{name}-{self.run_id.hex[:8]}.prof",
+        )
+        stats.dump_stats(path)
+        self.profiler.cleanup()
+        summary["file"] = os.path.abspath(path)
+        return summary
+
+
+class RequestProfiler:
+    """
+    Профилирование отдельных запросов по заголовку X-Profile или с долей
+    `sample_rate`. Пока запрос профилируется, cProfile записывает всё, что
+    выполняется в его потоке, в том числе конкурентные запросы того же
+    event loop; запросы, пришедшие во время профилирования, не профилируются.
+
+    Профилирование запроса длится не дольше `max_duration` секунд (дальше
+    профиль обрезается), в каталоге хранится не больше `max_files` профилей.
+    """
+
+    def __init__(
+        self,
+        sample_rate: float = 0.0,
+        allow_header: bool = False,
+        directory: str = "profiles",
+        top: int = 15,
+        max_files: int = 100,
+        max_duration: Optional[float] = 30.0,
+    ) -> None:
+        self.sample_rate = sample_rate
+        self.allow_header = allow_header
+        self.directory = directory
+        self.top = top
+        self.max_files = max_files
+        self.max_duration = max_duration
+
+    @classmethod
+    def from_env(cls) -> "RequestProfiler":
+        """
+        PROFILE_SAMPLE_RATE=0.001, PROFILE_ALLOW_HEADER=0 (заголовок
+        X-Profile не учитывается), PROFILE_DIR=profiles, PROFILE_TOP=15,
+        PROFILE_MAX_FILES=100 (0 - без удаления), PROFILE_MAX_SECONDS=30
+        (0 - без ограничения).
+        """
+        max_duration = float(os.getenv("PROFILE_MAX_SECONDS", "30"))
+        return cls(
+            sample_rate=float(os.getenv("PROFILE_SAMPLE_RATE", "0")),
+            allow_header=os.getenv("PROFILE_ALLOW_HEADER", "0") == "1",
+            directory=os.getenv("PROFILE_DIR", "profiles"),
+            top=int(os.getenv("PROFILE_TOP", "15")),
+            max_files=int(os.getenv("PROFILE_MAX_FILES", "100")),
+            max_duration=max_duration if max_duration > 0 else None,
+        )
+
+    def cleanup(self) -> None:
+        """
+        Удаляет самые старые файлы профилей сверх `max_files`.
+        """
+        if self.max_files <= 0:
+            return
+        files = sorted(
+            glob.glob(os.path.join(self.directory, "*.prof")), key=os.path.getmtime
+        )
+        for path in files[: max(0, len(files) - self.max_files)]:
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.warning("Failed to remove profile %s: %s", path, e)
+
+    def decide(self, forced: Optional[bool] = None) -> bool:
+        if forced is not None and self.allow_header:
+            return forced
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def start(self, name: str) -> Optional[ProfileSession]:
+        if not _busy.acquire(blocking=False):
+            return None
+        session = ProfileSession(self, name)
+        if not session._start(self.max_duration):
+            _busy.release()
+            return None
+        return session
+
+
+def profiled(func: Callable[..., T]) -> Callable[..., T]:
+    """
+    Функция для запуска в пуле потоков: внутри профилируемого запроса
+    она профилируется в своём потоке, иначе возвращается как есть.
+    """
+    session = _active.get()
+    if session is None:
+        return func
+    return session.wrap(func)
@@ -0,0 +1,162 @@
+import random
+import threading
+import time
+from collections import deque
+from typing import Deque, Optional
+
+
+class CircuitOpenError(RuntimeError):
+    """
+    Circuit breaker разомкнут: вызов внутреннего runnable не выполняется.
+    """
+
+
+def backoff_delay(
+    attempt: int,
+    base: float,
+    multiplier: float = 2.0,
+    max_delay: float = 10.0,
+    jitter: bool = True,
+) -> float:
+    """
+    Экспоненциальная задержка перед попыткой `attempt + 1` (attempt >= 1).
+    С jitter используется "full jitter": случайное значение в [0, delay].
+    """
+    delay = min(max_delay, base * multiplier ** (attempt - 1))
+    if jitter:
+        return random.uniform(0, delay)
+    return delay
+
+
+class RetryBudget:
+    """
+    Общий бюджет ретраев (token bucket): каждый запрос пополняет бюджет
+    на `ratio` токена, каждый ретрай тратит один токен. Таким образом
+    доля ретраев ограничена `ratio` от общего трафика.
+    """
+
+    def __init__(self, ratio: float = 0.2, max_tokens: float = 10.0) -> None:
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._lock = threading.Lock()
+
+    def record_request(self) -> None:
+        with self._lock:
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+    @property
+    def tokens(self) -> float:
+        return self._tokens
+
+
+class CircuitBreaker:
+    """
+    Размыкается после `failure_threshold` ошибок подряд и отклоняет вызовы
+    в течение `reset_timeout` секунд. Затем пропускает одну пробную попытку
+    (half-open): успех замыкает цепь, ошибка снова размыкает. Проба без
+    результата (дедлайн, отмена) возвращается через `release_probe`; если
+    проба так и не отчиталась, через `reset_timeout` пропускается новая.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe = 0
+        self._probe_started = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        return self._state
+
+    @property
+    def probe(self) -> Optional[int]:
+        """
+        Номер текущей пробной попытки (None вне half-open).
+        """
+        return self._probe if self._state == self.HALF_OPEN else None
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            now = time.monotonic()
+            if self._state == self.OPEN:
+                if now - self._opened_at >= self.reset_timeout:
+                    self._start_probe(now)
+                    return True
+                return False
+            # HALF_OPEN: пробная попытка уже выполняется
+            if now - self._probe_started >= self.reset_timeout:
+                self._start_probe(now)
+                return True
+            return False
+
+    def _start_probe(self, now: float) -> None:
+        self._state = self.HALF_OPEN
+        self._probe += 1
+        self._probe_started = now
+
+    def release_probe(self, probe: int) -> None:
+        """
+        Проба завершилась, не сообщив о здоровье вызываемого: цепь снова
+        разомкнута, и следующий вызов сразу становится новой пробой.
+        """
+        with self._lock:
+            if self._state == self.HALF_OPEN and self._probe == probe:
+                self._state = self.OPEN
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if (
+                self._state == self.HALF_OPEN
+                or self._failures >= self.failure_threshold
+            ):
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+class LatencyTracker:
+    """
+    Скользящее окно длительностей успешных вызовов для расчёта перцентилей.
+    """
+
+    def __init__(self, window: int = 200) -> None:
+        self._samples: Deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, q: float) -> Optional[float]:
+        with self._lock:
+            if not self._samples:
+                return None
+            ordered = sorted(self._samples)
+        idx = min(len(ordered) - 1, int(q * len(ordered)))
+        return ordered[idx]
@@ -0,0 +1,208 @@
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+from langchain_core.load import dumpd
+
+
+class LeaderAbandoned(Exception):
+    """
+    Ведущий запрос прерван (отмена, закрытие стрима) до ответа upstream.
+    Ожидающие не получают эту ошибку, а повторяют поиск в кэше: один из них
+    становится новым ведущим.
+    """
+
+
+@dataclass
+class CacheEntry:
+    """
+    Закэшированный ответ: итоговое значение и (для стримов) список чанков.
+    """
+
+    value: Any
+    chunks: Optional[List[Any]] = None
+
+
+def make_cache_key(namespace: str, input: Any, extra: Any = None) -> str:
+    """
+    Стабильный хэш входа и значимой части конфига.
+    """
+    try:
+        serialized = dumpd(input)
+    except Exception:
+        serialized = repr(input)
+    payload = json.dumps(
+        [namespace, serialized, extra], sort_keys=True, default=str, ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Двухуровневый кэш ответов: LRU в памяти с TTL и опциональный
+    SQLite-файл на диске, который переживает перезапуск.
+
+    SQLite-соединение нельзя переносить через fork, поэтому оно открывается
+    при первом обращении к диску в том процессе, который с ним работает
+    (кэш создаётся и до fork, при preload в server.py).
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 1024,
+        ttl: Optional[float] = 300.0,
+        disk_path: Optional[str] = None,
+    ) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.disk_path = disk_path
+        self._memory: "OrderedDict[str, Tuple[float, CacheEntry]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Single-flight: ключ -> Future первого (ведущего) запроса
+        self._inflight: Dict[str, Future] = {}
+        self._inflight_lock = threading.Lock()
+        self._disk: Optional[sqlite3.Connection] = None
+        self._disk_pid: Optional[int] = None
+        # Соединения, унаследованные через fork: закрывать их в дочернем
+        # процессе тоже нельзя, поэтому ссылки просто хранятся
+        self._inherited: List[sqlite3.Connection] = []
+
+    def _connection(self) -> Optional[sqlite3.Connection]:
+        """
+        SQLite-соединение текущего процесса. Вызывается под `_lock`.
+        """
+        if not self.disk_path:
+            return None
+        pid = os.getpid()
+        if self._disk is not None and self._disk_pid == pid:
+            return self._disk
+        if self._disk is not None:
+            self._inherited.append(self._disk)
+        self._disk = sqlite3.connect(self.disk_path, check_same_thread=False)
+        self._disk_pid = pid
+        self._disk.execute(
+            "CREATE TABLE IF NOT EXISTS cache "
+            "(key TEXT PRIMARY KEY, value BLOB, expires REAL)"
+        )
+        self._disk.commit()
+        return self._disk
+
+    def _expires_at(self) -> float:
+        return time.time() + self.ttl if self.ttl is not None else float("inf")
+
+    def get(self, key: str, use_disk: bool = True) -> Optional[CacheEntry]:
+        """
+        Ищет ответ в памяти, затем (если `use_disk`) на диске. Обращение
+        к диску блокирующее: из async-кода его выполняют через run_sync.
+        """
+        now = time.time()
+        with self._lock:
+            item = self._memory.get(key)
+            if item is not None:
+                expires, entry = item
+                if expires > now:
+                    self._memory.move_to_end(key)
+                    return entry
+                del self._memory[key]
+
+            if not use_disk:
+                return None
+            disk = self._connection()
+            if disk is None:
+                return None
+            row = disk.execute(
+                "SELECT value, expires FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] <= now:
+                disk.execute("DELETE FROM cache WHERE key = ?", (key,))
+                disk.commit()
+                return None
+            entry = pickle.loads(row[0])
+            # Поднимаем запись с диска в память
+            self._put_memory(key, row[1], entry)
+            return entry
+
+    def set(self, key: str, entry: CacheEntry) -> None:
+        expires = self._expires_at()
+        with self._lock:
+            self._put_memory(key, expires, entry)
+            disk = self._connection()
+            if disk is not None:
+                try:
+                    blob = pickle.dumps(entry)
+                except Exception:
+                    # Непиклящиеся значения остаются только в памяти
+                    return
+                disk.execute(
+                    "INSERT OR REPLACE INTO cache (key, value, expires) "
+                    "VALUES (?, ?, ?)",
+                    (key, blob, expires),
+                )
+                disk.commit()
+
+    def _put_memory(self, key: str, expires: float, entry: CacheEntry) -> None:
+        self._memory[key] = (expires, entry)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.maxsize:
+            self._memory.popitem(last=False)
+
+    def begin(self, key: str) -> Tuple[Future, bool]:
+        """
+        Регистрирует запрос к upstream. Возвращает Future и признак того,
+        что вызывающий - ведущий и должен сам выполнить запрос. Остальные
+        конкурентные запросы с тем же ключом ждут результат ведущего.
+        """
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                return future, False
+            future = Future()
+            self._inflight[key] = future
+            return future, True
+
+    def finish(
+        self,
+        key: str,
+        future: Future,
+        entry: Optional[CacheEntry] = None,
+        exc: Optional[BaseException] = None,
+    ) -> None:
+        """
+        Завершает запрос ведущего: сохраняет ответ и будит ожидающих.
+        """
+        if exc is None and entry is not None:
+            self.set(key, entry)
+        with self._inflight_lock:
+            self._inflight.pop(key, None)
+        if exc is None:
+            future.set_result(entry)
+        else:
+            future.set_exception(exc)
+
+    def invalidate(self, key: str) -> None:
+        with self._lock:
+            self._memory.pop(key, None)
+            disk = self._connection()
+            if disk is not None:
+                disk.execute("DELETE FROM cache WHERE key = ?", (key,))
+                disk.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            disk = self._connection()
+            if disk is not None:
+                disk.execute("DELETE FROM cache")
+                disk.commit()
+
+    def __len__(self) -> int:
+        return len(self._memory)
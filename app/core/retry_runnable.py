@@ -1,23 +1,89 @@
+from core import metrics
 from core.base_traceable_runnable import BaseTraceableRunnable
+from core.deadline import DeadlineExceeded, deadline_of, remaining
+from core.resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    LatencyTracker,
+    RetryBudget,
+    backoff_delay,
+)
 from langchain_core.runnables.base import Runnable
 from pydantic import Field
 import time
 import asyncio
-from typing import Any, Iterator, AsyncIterator, TypeVar, Optional
+from typing import Any, Iterator, AsyncIterator, TypeVar, Optional, Tuple, Type
 
 InputType = TypeVar("InputType")
 OutputType = TypeVar("OutputType")
 
+_SKIP = object()
+
+
+class StreamProgress:
+    """
+    Учёт уже отданной клиенту части стрима между попытками.
+    Для строковых чанков считаются символы, для остальных - чанки.
+    """
+
+    def __init__(self) -> None:
+        self.delivered = 0
+        self._skip = 0
+
+    def start_attempt(self, resumed: bool) -> None:
+        # Если внутренний runnable продолжил с offset, пропускать нечего
+        self._skip = 0 if resumed else self.delivered
+
+    def accept(self, chunk: Any) -> Any:
+        """
+        Возвращает часть чанка, которую нужно отдать клиенту, или _SKIP.
+        """
+        is_str = isinstance(chunk, str)
+        size = len(chunk) if is_str else 1
+        if self._skip:
+            if size <= self._skip:
+                self._skip -= size
+                return _SKIP
+            if is_str:
+                chunk = chunk[self._skip :]
+                size -= self._skip
+            self._skip = 0
+        self.delivered += size
+        return chunk
+
 
 class RetryRunnable(BaseTraceableRunnable[InputType, OutputType]):
     """
     Runnable, который повторяет попытку вызова внутреннего runnable при ошибке.
+
+    Задержка между попытками растёт экспоненциально (с jitter). Ретраи
+    выполняются только для исключений из `retry_on` и ограничены общим
+    `retry_budget`; `circuit_breaker` отклоняет вызовы, пока внутренний
+    runnable неисправен. В async-режиме при заданном `hedge_percentile`
+    долгая попытка дублируется спекулятивной, побеждает первая успешная.
+
+    При `resume_stream` повторная попытка стрима не отдаёт клиенту уже
+    отправленный префикс: если внутренний runnable поддерживает
+    `resume_offset`, он продолжает с нужного места, иначе дубликат
+    префикса отбрасывается из нового стрима.
     """
 
     inner_runnable: Runnable[InputType, OutputType]
     max_retries: int = Field(default=1)
-    delay: float = Field(default=0)  # в секундах
+    delay: float = Field(default=0)  # базовая задержка в секундах
+    backoff_multiplier: float = Field(default=2.0)
+    max_delay: float = Field(default=10.0)
+    jitter: bool = Field(default=True)
+    retry_on: Tuple[Type[BaseException], ...] = Field(default=(Exception,))
     default_value: Optional[OutputType] = Field(default=None)
+    # Общие для нескольких экземпляров объекты передаются явно
+    retry_budget: Optional[RetryBudget] = Field(default=None)
+    circuit_breaker: Optional[CircuitBreaker] = Field(default=None)
+    # Hedged requests: перцентиль латентности, после которого стартует дубль
+    hedge_percentile: Optional[float] = Field(default=None)
+    hedge_min_samples: int = Field(default=20)
+    latency_tracker: LatencyTracker = Field(default_factory=LatencyTracker)
+    resume_stream: bool = Field(default=True)
 
     def _handle_final_result(self, last_exc: Any) -> OutputType:
         if self.default_value is not None:
@@ -27,48 +93,277 @@ class RetryRunnable(BaseTraceableRunnable[InputType, OutputType]):
         else:
             raise RuntimeError("Unknown error in RetryRunnable")
 
+    def _before_attempt(self, attempt: int) -> Optional[int]:
+        """
+        Проверяет circuit breaker перед попыткой. Возвращает номер пробы,
+        если попытка - проба half-open: её нужно вернуть через
+        `_release_probe`, когда попытка завершится.
+        """
+        if attempt == 1 and self.retry_budget is not None:
+            self.retry_budget.record_request()
+        probe = None
+        if self.circuit_breaker is not None:
+            if not self.circuit_breaker.allow_request():
+                self._record_outcome("circuit_open")
+                raise CircuitOpenError("Circuit breaker is open")
+            # В half-open допускается только проба
+            probe = self.circuit_breaker.probe
+        metrics.inc(
+            "retry_attempts_total",
+            (
+                ("runnable", self.get_name()),
+                ("attempt", "first" if attempt == 1 else "retry"),
+            ),
+        )
+        return probe
+
+    def _release_probe(self, probe: Optional[int]) -> None:
+        # Проба, не записавшая успех или ошибку (дедлайн, отмена, закрытый
+        # стрим), иначе оставила бы цепь в half-open навсегда
+        if probe is not None and self.circuit_breaker is not None:
+            self.circuit_breaker.release_probe(probe)
+
+    def _record_success(self, started: float) -> None:
+        self.latency_tracker.record(time.monotonic() - started)
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.record_success()
+
+    def _record_outcome(self, outcome: str, attempt: int = 1) -> None:
+        """
+        Итог вызова для метрик: success/recovered (успех с первой или
+        повторной попытки) либо причина, по которой ретраи прекращены.
+        """
+        if outcome == "success" and attempt > 1:
+            outcome = "recovered"
+        metrics.inc(
+            "retry_outcomes_total",
+            (("runnable", self.get_name()), ("outcome", outcome)),
+        )
+
+    def _should_retry(self, exc: BaseException, attempt: int) -> bool:
+        """
+        Фиксирует ошибку в circuit breaker и решает, нужен ли ещё один ретрай.
+        """
+        if isinstance(exc, DeadlineExceeded):
+            # Бюджет запроса исчерпан - повторять бессмысленно
+            self._record_outcome("deadline")
+            return False
+        retryable = isinstance(exc, self.retry_on)
+        if self.circuit_breaker is not None:
+            if retryable:
+                self.circuit_breaker.record_failure()
+            else:
+                # Внутренний runnable ответил - ошибка не связана с его здоровьем
+                self.circuit_breaker.record_success()
+        if not retryable:
+            self._record_outcome("not_retryable")
+            return False
+        if attempt >= self.max_retries:
+            self._record_outcome("exhausted")
+            return False
+        if self.retry_budget is not None and not self.retry_budget.try_acquire():
+            self._record_outcome("budget_exhausted")
+            return False
+        return True
+
+    def _fits_deadline(self, run_manager: Any, delay: float) -> bool:
+        """
+        Хватит ли оставшегося бюджета запроса на паузу и ещё одну попытку
+        (её длительность оценивается медианой успешных вызовов).
+        """
+        budget = remaining(deadline_of(run_manager))
+        if budget is None:
+            return True
+        expected = self.latency_tracker.percentile(0.5) or 0.0
+        if budget > delay + expected:
+            return True
+        self._record_outcome("deadline")
+        return False
+
+    def _next_delay(self, attempt: int) -> float:
+        return backoff_delay(
+            attempt,
+            self.delay,
+            multiplier=self.backoff_multiplier,
+            max_delay=self.max_delay,
+            jitter=self.jitter,
+        )
+
     def _run(self, input: InputType, *, run_manager: Any, **kwargs: Any) -> OutputType:
-        last_exc = None
+        last_exc: Optional[BaseException] = None
         for attempt in range(1, self.max_retries + 1):
             try:
-                return self.invoke_nested(
+                probe = self._before_attempt(attempt)
+            except CircuitOpenError as exc:
+                last_exc = exc
+                break
+            started = time.monotonic()
+            try:
+                result = self.invoke_nested(
                     self.inner_runnable, input, run_manager, **kwargs
                 )
             except Exception as exc:
                 last_exc = exc
-                if attempt < self.max_retries:
-                    time.sleep(self.delay)
+                if not self._should_retry(exc, attempt):
+                    break
+                delay = self._next_delay(attempt)
+                if not self._fits_deadline(run_manager, delay):
+                    break
+                time.sleep(delay)
+            else:
+                self._record_success(started)
+                self._record_outcome("success", attempt)
+                return result
+            finally:
+                self._release_probe(probe)
         return self._handle_final_result(last_exc)
 
+    def _hedge_delay(self) -> Optional[float]:
+        if self.hedge_percentile is None:
+            return None
+        if len(self.latency_tracker) < self.hedge_min_samples:
+            return None
+        return self.latency_tracker.percentile(self.hedge_percentile)
+
+    async def _ainvoke_attempt(
+        self, input: InputType, run_manager: Any, **kwargs: Any
+    ) -> OutputType:
+        started = time.monotonic()
+        result = await self.ainvoke_nested(
+            self.inner_runnable, input, run_manager, **kwargs
+        )
+        self._record_success(started)
+        return result
+
+    async def _ainvoke_hedged(
+        self, input: InputType, run_manager: Any, **kwargs: Any
+    ) -> OutputType:
+        """
+        Одна попытка с хеджированием: если основной вызов не уложился
+        в перцентиль латентности, параллельно стартует второй.
+        Оба вызова - дочерние span'ы; проигравший отменяется.
+        """
+        hedge_delay = self._hedge_delay()
+        if hedge_delay is None:
+            return await self._ainvoke_attempt(input, run_manager, **kwargs)
+
+        primary = asyncio.ensure_future(
+            self._ainvoke_attempt(input, run_manager, **kwargs)
+        )
+        attempts = [primary]
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=hedge_delay)
+            if done or (
+                self.retry_budget is not None and not self.retry_budget.try_acquire()
+            ):
+                return await primary
+
+            attempts.append(
+                asyncio.ensure_future(
+                    self._ainvoke_attempt(input, run_manager, **kwargs)
+                )
+            )
+            pending = set(attempts)
+            last_exc: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    last_exc = task.exception()
+            assert last_exc is not None
+            raise last_exc
+        finally:
+            # Проигравшая попытка и попытки вызова, который отменили
+            # (отключение клиента, дедлайн), не продолжают работу
+            unfinished = [task for task in attempts if not task.done()]
+            for task in unfinished:
+                task.cancel()
+            if unfinished:
+                await asyncio.gather(*unfinished, return_exceptions=True)
+
     async def _arun(
         self, input: InputType, *, run_manager: Any, **kwargs: Any
     ) -> OutputType:
-        last_exc = None
+        last_exc: Optional[BaseException] = None
         for attempt in range(1, self.max_retries + 1):
             try:
-                return await self.ainvoke_nested(
-                    self.inner_runnable, input, run_manager, **kwargs
-                )
+                probe = self._before_attempt(attempt)
+            except CircuitOpenError as exc:
+                last_exc = exc
+                break
+            try:
+                result = await self._ainvoke_hedged(input, run_manager, **kwargs)
             except Exception as exc:
                 last_exc = exc
-                if attempt < self.max_retries:
-                    await asyncio.sleep(self.delay)
+                if not self._should_retry(exc, attempt):
+                    break
+                delay = self._next_delay(attempt)
+                if not self._fits_deadline(run_manager, delay):
+                    break
+                await asyncio.sleep(delay)
+            else:
+                self._record_outcome("success", attempt)
+                return result
+            finally:
+                self._release_probe(probe)
         return self._handle_final_result(last_exc)
 
+    def _attempt_kwargs(self, progress: StreamProgress, kwargs: dict) -> dict:
+        """
+        Готовит kwargs попытки стрима и отмечает, продолжает ли она с offset.
+        """
+        resumed = progress.delivered > 0 and getattr(
+            self.inner_runnable, "supports_resume_offset", False
+        )
+        progress.start_attempt(resumed)
+        if resumed:
+            return {**kwargs, "resume_offset": progress.delivered}
+        return kwargs
+
     def _stream(
         self, input: InputType, *, run_manager: Any, **kwargs: Any
     ) -> Iterator[OutputType]:
-        last_exc = None
+        last_exc: Optional[BaseException] = None
+        progress = StreamProgress()
         for attempt in range(1, self.max_retries + 1):
             try:
-                yield from self.stream_nested(
-                    self.inner_runnable, input, run_manager, **kwargs
-                )
-                return
+                probe = self._before_attempt(attempt)
+            except CircuitOpenError as exc:
+                last_exc = exc
+                break
+            started = time.monotonic()
+            try:
+                if not self.resume_stream:
+                    yield from self.stream_nested(
+                        self.inner_runnable, input, run_manager, **kwargs
+                    )
+                else:
+                    for chunk in self.stream_nested(
+                        self.inner_runnable,
+                        input,
+                        run_manager,
+                        **self._attempt_kwargs(progress, kwargs),
+                    ):
+                        chunk = progress.accept(chunk)
+                        if chunk is not _SKIP:
+                            yield chunk
             except Exception as exc:
                 last_exc = exc
-                if attempt < self.max_retries:
-                    time.sleep(self.delay)
+                if not self._should_retry(exc, attempt):
+                    break
+                delay = self._next_delay(attempt)
+                if not self._fits_deadline(run_manager, delay):
+                    break
+                time.sleep(delay)
+            else:
+                self._record_success(started)
+                self._record_outcome("success", attempt)
+                return
+            finally:
+                self._release_probe(probe)
 
         result = self._handle_final_result(last_exc)
         if result is not None:
@@ -77,18 +372,41 @@ class RetryRunnable(BaseTraceableRunnable[InputType, OutputType]):
     async def _astream(
         self, input: InputType, *, run_manager: Any, **kwargs: Any
     ) -> AsyncIterator[OutputType]:
-        last_exc = None
+        last_exc: Optional[BaseException] = None
+        progress = StreamProgress()
         for attempt in range(1, self.max_retries + 1):
+            try:
+                probe = self._before_attempt(attempt)
+            except CircuitOpenError as exc:
+                last_exc = exc
+                break
+            started = time.monotonic()
+            attempt_kwargs = (
+                self._attempt_kwargs(progress, kwargs) if self.resume_stream else kwargs
+            )
             try:
                 async for chunk in self.astream_nested(
-                    self.inner_runnable, input, run_manager, **kwargs
+                    self.inner_runnable, input, run_manager, **attempt_kwargs
                 ):
+                    if self.resume_stream:
+                        chunk = progress.accept(chunk)
+                        if chunk is _SKIP:
+                            continue
                     yield chunk
-                return
             except Exception as exc:
                 last_exc = exc
-                if attempt < self.max_retries:
-                    await asyncio.sleep(self.delay)
+                if not self._should_retry(exc, attempt):
+                    break
+                delay = self._next_delay(attempt)
+                if not self._fits_deadline(run_manager, delay):
+                    break
+                await asyncio.sleep(delay)
+            else:
+                self._record_success(started)
+                self._record_outcome("success", attempt)
+                return
+            finally:
+                self._release_probe(probe)
 
         result = self._handle_final_result(last_exc)
         if result is not None:
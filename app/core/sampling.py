@@ -0,0 +1,168 @@
+import os
+import random
+import time
+from typing import Any, Dict, List, Optional
+from langchain_core.callbacks.manager import BaseRunManager
+from langchain_core.runnables.config import RunnableConfig
+
+# Решение о семплировании передаётся вниз по цепочке через configurable
+# (ключи с "__" не попадают в метаданные трейса)
+TRACE_SAMPLED_KEY = "__trace_sampled"
+TRACE_BUFFER_KEY = "__trace_buffer"
+FORCE_SAMPLE_KEY = "__force_trace_sample"
+
+FORCE_SAMPLE_HEADER = "x-trace-sample"
+
+
+def is_unsampled(config: RunnableConfig) -> bool:
+    """
+    Запрос не попал в выборку: span'ы и callback manager не создаются.
+    """
+    configurable = config.get("configurable") or {}
+    return configurable.get(TRACE_SAMPLED_KEY) is False
+
+
+class TraceBuffer:
+    """
+    Дешёвый буфер завершённых шагов несемплированного запроса.
+    Хранит только ссылки на входы/выходы - без сериализации. Если после
+    завершения запроса сработает правило ошибок или медленных запросов,
+    буфер выгружается в трейс.
+    """
+
+    __slots__ = ("records",)
+
+    def __init__(self) -> None:
+        self.records: List[Dict[str, Any]] = []
+
+    def append(self, record: Dict[str, Any]) -> None:
+        self.records.append(record)
+
+
+class NullRunManager(BaseRunManager):
+    """
+    Заглушка run_manager для несемплированных запросов: не обращается
+    к callback'ам, а лишь (при наличии буфера) запоминает итог шага.
+    Наследует BaseRunManager только ради типа: состояние callback'ов
+    (handlers, run_id) не создаётся.
+    """
+
+    def __init__(self, name: str, input: Any, configurable: Dict[str, Any]) -> None:
+        self.name = name
+        self.input = input
+        self.configurable = configurable
+        self.buffer: Optional[TraceBuffer] = configurable.get(TRACE_BUFFER_KEY)
+        self.started = time.monotonic() if self.buffer is not None else 0.0
+
+    def get_child(self, tag: Optional[str] = None) -> None:
+        return None
+
+    def _record(self, **fields: Any) -> None:
+        if self.buffer is not None:
+            self.buffer.append(
+                {
+                    "name": self.name,
+                    "input": self.input,
+                    "duration": time.monotonic() - self.started,
+                    **fields,
+                }
+            )
+
+    def on_chain_end(self, outputs: Any, **kwargs: Any) -> None:
+        # transform узнаёт вход шага только к концу стрима
+        if "inputs" in kwargs:
+            self.input = kwargs["inputs"]
+        if "metadata" in kwargs:
+            self._record(output=outputs, metadata=kwargs["metadata"])
+        else:
+            self._record(output=outputs)
+
+    def on_chain_error(self, error: BaseException, **kwargs: Any) -> None:
+        self._record(error=error)
+
+
+class AsyncNullRunManager(NullRunManager):
+    """
+    Async-версия NullRunManager.
+    """
+
+    # Как и в LangChain, async-вариант переопределяет методы корутинами
+    async def on_chain_end(  # type: ignore[override]
+        self, outputs: Any, **kwargs: Any
+    ) -> None:
+        NullRunManager.on_chain_end(self, outputs, **kwargs)
+
+    async def on_chain_error(  # type: ignore[override]
+        self, error: BaseException, **kwargs: Any
+    ) -> None:
+        self._record(error=error)
+
+
+class TraceSampler:
+    """
+    Head-based семплирование: доля трейсов на endpoint, принудительное
+    включение/выключение заголовком и правила хвостового сохранения
+    (ошибки и медленные запросы) для несемплированных запросов.
+    """
+
+    def __init__(
+        self,
+        default_ratio: float = 1.0,
+        endpoint_ratios: Optional[Dict[str, float]] = None,
+        keep_errors: bool = True,
+        slow_threshold: Optional[float] = None,
+    ) -> None:
+        self.default_ratio = default_ratio
+        self.endpoint_ratios = endpoint_ratios or {}
+        self.keep_errors = keep_errors
+        self.slow_threshold = slow_threshold
+
+    @classmethod
+    def from_env(cls) -> "TraceSampler":
+        """
+        TRACE_SAMPLE_RATIO=0.1, TRACE_SAMPLE_RATIOS="/v1=0.05,/v2=1",
+        TRACE_KEEP_ERRORS=1, TRACE_SLOW_THRESHOLD=2.5 (секунды).
+        """
+        endpoint_ratios = {}
+        for item in os.getenv("TRACE_SAMPLE_RATIOS", "").split(","):
+            if "=" in item:
+                endpoint, ratio = item.split("=", 1)
+                endpoint_ratios[endpoint.strip()] = float(ratio)
+        slow_threshold = os.getenv("TRACE_SLOW_THRESHOLD")
+        return cls(
+            default_ratio=float(os.getenv("TRACE_SAMPLE_RATIO", "1.0")),
+            endpoint_ratios=endpoint_ratios,
+            keep_errors=os.getenv("TRACE_KEEP_ERRORS", "1") == "1",
+            slow_threshold=float(slow_threshold) if slow_threshold else None,
+        )
+
+    @property
+    def needs_buffer(self) -> bool:
+        return self.keep_errors or self.slow_threshold is not None
+
+    def decide(self, endpoint: Optional[str], forced: Optional[bool] = None) -> bool:
+        if forced is not None:
+            return forced
+        ratio = self.endpoint_ratios.get(endpoint or "", self.default_ratio)
+        if ratio >= 1:
+            return True
+        return random.random() < ratio
+
+    def should_keep(self, duration: float, error: Optional[BaseException]) -> bool:
+        """
+        Хвостовые правила для несемплированного запроса.
+        """
+        if error is not None and self.keep_errors:
+            return True
+        return self.slow_threshold is not None and duration >= self.slow_threshold
+
+
+def parse_force_header(value: Optional[str]) -> Optional[bool]:
+    if value is None:
+        return None
+    value = value.strip().lower()
+    if value in ("1", "true", "yes"):
+        return True
+    if value in ("0", "false", "no"):
+        return False
+    return None
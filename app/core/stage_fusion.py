@@ -0,0 +1,358 @@
+import os
+import time
+from typing import (
+    Any,
+    AsyncIterator,
+    Dict,
+    Iterator,
+    List,
+    Literal,
+    Optional,
+    TypeGuard,
+    TypeVar,
+    cast,
+)
+
+from langchain_core.callbacks.manager import AsyncCallbackManager, CallbackManager
+from langchain_core.runnables.base import Runnable, RunnableBinding, RunnableSequence
+from langchain_core.runnables.config import RunnableConfig
+from pydantic import Field
+
+from core.base_traceable_runnable import (
+    AsyncSpanManager,
+    BaseTraceableRunnable,
+    SpanManager,
+    _ChunkAccumulator,
+    _acollect,
+    _collect,
+)
+from core.deadline import attach_deadline, deadline_of
+from core.sampling import AsyncNullRunManager, NullRunManager
+
+InputType = TypeVar("InputType")
+OutputType = TypeVar("OutputType")
+
+SINGLE_SPAN = "single"
+CHILD_SPANS = "children"
+SPAN_MODES = (SINGLE_SPAN, CHILD_SPANS)
+SpanMode = Literal["single", "children"]
+
+_PUBLIC_METHODS = ("invoke", "ainvoke", "stream", "astream")
+
+
+def is_fusible(step: Runnable) -> TypeGuard[BaseTraceableRunnable]:
+    """
+    Шаг можно вызывать через `_run`/`_stream` напрямую, только если он не
+    переопределяет публичные методы: иначе (кэш, корень семплирования)
+    прямой вызов обошёл бы его логику.
+    """
+    if not isinstance(step, BaseTraceableRunnable):
+        return False
+    cls = type(step)
+    return all(
+        getattr(cls, method) is getattr(BaseTraceableRunnable, method)
+        for method in _PUBLIC_METHODS
+    )
+
+
+class FusedRunnable(BaseTraceableRunnable[InputType, OutputType]):
+    """
+    Несколько подряд идущих шагов BaseTraceableRunnable, выполняемых одним
+    runnable: без перехода RunnableSequence, настройки callback manager'а
+    и span'а на каждый шаг.
+
+    span_mode:
+    - single: один span, длительности шагов записываются в его метаданные
+      `stage_timings_ms` при завершении;
+    - children: по лёгкому дочернему span'у на шаг, как без слияния.
+
+    Как и в RunnableSequence, стрим проходит через шаги конвейером: шаги
+    с `buffers_input = False` обрабатывают чанки по мере поступления,
+    остальные сначала собирают вход целиком. При стриминге длительность
+    шага - окно от его старта до последнего чанка, окна шагов пересекаются.
+    """
+
+    stages: List[BaseTraceableRunnable]
+    span_mode: SpanMode = Field(default="single")
+
+    # Пул потоков задействуют сами шаги через свои _arun/_astream
+    offload_sync = False
+    # Вход передаётся шагам по чанкам (см. _transform)
+    buffers_input = False
+
+    def _start_run(
+        self, input: Any, config: RunnableConfig, kwargs: dict
+    ) -> SpanManager:
+        config = {**config, "run_name": config.get("run_name") or self.get_name()}
+        return super()._start_run(input, config, kwargs)
+
+    async def _astart_run(
+        self, input: Any, config: RunnableConfig, kwargs: dict
+    ) -> AsyncSpanManager:
+        config = {**config, "run_name": config.get("run_name") or self.get_name()}
+        return await super()._astart_run(input, config, kwargs)
+
+    def _start_stage(
+        self, stage: BaseTraceableRunnable, input: Any, run_manager: SpanManager
+    ) -> SpanManager:
+        if self.span_mode == SINGLE_SPAN:
+            return run_manager
+        name = stage.__class__.__name__
+        stage_manager: SpanManager
+        if isinstance(run_manager, NullRunManager):
+            stage_manager = NullRunManager(name, input, run_manager.configurable)
+        else:
+            callback_manager = CallbackManager.configure(run_manager.get_child())
+            stage_manager = callback_manager.on_chain_start(None, input, name=name)
+        attach_deadline(stage_manager, deadline_of(run_manager))
+        return stage_manager
+
+    async def _astart_stage(
+        self, stage: BaseTraceableRunnable, input: Any, run_manager: AsyncSpanManager
+    ) -> AsyncSpanManager:
+        if self.span_mode == SINGLE_SPAN:
+            return run_manager
+        name = stage.__class__.__name__
+        stage_manager: AsyncSpanManager
+        if isinstance(run_manager, NullRunManager):
+            stage_manager = AsyncNullRunManager(name, input, run_manager.configurable)
+        else:
+            callback_manager = AsyncCallbackManager.configure(run_manager.get_child())
+            stage_manager = await callback_manager.on_chain_start(
+                None, input, name=name
+            )
+        attach_deadline(stage_manager, deadline_of(run_manager))
+        return stage_manager
+
+    def _record_timings(self, run_manager: Any, timings: Dict[str, float]) -> None:
+        if self.span_mode == SINGLE_SPAN:
+            self.set_span_metadata(
+                run_manager,
+                {
+                    "stage_timings_ms": {
+                        name: round(duration * 1e3, 3)
+                        for name, duration in timings.items()
+                    }
+                },
+            )
+
+    def _run(self, input: InputType, *, run_manager: Any, **kwargs: Any) -> OutputType:
+        timings: Dict[str, float] = {}
+        value: Any = input
+        for idx, stage in enumerate(self.stages):
+            stage_manager = self._start_stage(stage, value, run_manager)
+            started = time.perf_counter()
+            try:
+                result = stage._run(value, run_manager=stage_manager, **kwargs)
+                # Как в RunnableSequence, kwargs получает только первый шаг
+                kwargs = {}
+            except Exception as e:
+                if stage_manager is not run_manager:
+                    stage_manager.on_chain_error(e)
+                raise
+            timings[_stage_key(idx, stage)] = time.perf_counter() - started
+            if stage_manager is not run_manager:
+                stage_manager.on_chain_end(result)
+            value = result
+        self._record_timings(run_manager, timings)
+        return value
+
+    async def _arun(
+        self, input: InputType, *, run_manager: Any, **kwargs: Any
+    ) -> OutputType:
+        timings: Dict[str, float] = {}
+        value: Any = input
+        for idx, stage in enumerate(self.stages):
+            stage_manager = await self._astart_stage(stage, value, run_manager)
+            started = time.perf_counter()
+            try:
+                result = await stage._arun(value, run_manager=stage_manager, **kwargs)
+                kwargs = {}
+            except Exception as e:
+                if stage_manager is not run_manager:
+                    await stage_manager.on_chain_error(e)
+                raise
+            timings[_stage_key(idx, stage)] = time.perf_counter() - started
+            if stage_manager is not run_manager:
+                await stage_manager.on_chain_end(result)
+            value = result
+        self._record_timings(run_manager, timings)
+        return value
+
+    def _stage_chunks(
+        self,
+        idx: int,
+        stage: BaseTraceableRunnable,
+        chunks: Iterator[Any],
+        run_manager: SpanManager,
+        timings: Dict[str, float],
+        kwargs: Dict[str, Any],
+    ) -> Iterator[Any]:
+        # Вход шага известен только к концу стрима, как в transform
+        stage_manager = self._start_stage(stage, "", run_manager)
+        inputs = _ChunkAccumulator()
+        outputs = _ChunkAccumulator()
+        started = time.perf_counter()
+        try:
+            if stage.buffers_input:
+                for chunk in chunks:
+                    inputs.add(chunk)
+                produced = stage._stream(
+                    inputs.result(), run_manager=stage_manager, **kwargs
+                )
+            else:
+                produced = stage._transform(
+                    _collect(chunks, inputs), run_manager=stage_manager, **kwargs
+                )
+            for chunk in produced:
+                outputs.add(chunk)
+                yield chunk
+        except BaseException as e:
+            # В том числе GeneratorExit: потребитель закрыл стрим раньше
+            # времени, а span шага всё равно должен закрыться
+            if stage_manager is not run_manager:
+                stage_manager.on_chain_error(e)
+            raise
+        timings[_stage_key(idx, stage)] = time.perf_counter() - started
+        if stage_manager is not run_manager:
+            stage_manager.on_chain_end(outputs.result(), inputs=inputs.result())
+
+    async def _astage_chunks(
+        self,
+        idx: int,
+        stage: BaseTraceableRunnable,
+        chunks: AsyncIterator[Any],
+        run_manager: AsyncSpanManager,
+        timings: Dict[str, float],
+        kwargs: Dict[str, Any],
+    ) -> AsyncIterator[Any]:
+        stage_manager = await self._astart_stage(stage, "", run_manager)
+        inputs = _ChunkAccumulator()
+        outputs = _ChunkAccumulator()
+        started = time.perf_counter()
+        try:
+            if stage.buffers_input:
+                async for chunk in chunks:
+                    inputs.add(chunk)
+                produced = stage._astream(
+                    inputs.result(), run_manager=stage_manager, **kwargs
+                )
+            else:
+                produced = stage._atransform(
+                    _acollect(chunks, inputs), run_manager=stage_manager, **kwargs
+                )
+            async for chunk in produced:
+                outputs.add(chunk)
+                yield chunk
+        except BaseException as e:
+            if stage_manager is not run_manager:
+                await stage_manager.on_chain_error(e)
+            raise
+        timings[_stage_key(idx, stage)] = time.perf_counter() - started
+        if stage_manager is not run_manager:
+            await stage_manager.on_chain_end(outputs.result(), inputs=inputs.result())
+
+    def _transform(
+        self, chunks: Iterator[InputType], *, run_manager: Any, **kwargs: Any
+    ) -> Iterator[OutputType]:
+        timings: Dict[str, float] = {}
+        stream: Iterator[Any] = chunks
+        for idx, stage in enumerate(self.stages):
+            stream = self._stage_chunks(
+                idx, stage, stream, run_manager, timings, kwargs
+            )
+            kwargs = {}
+        yield from stream
+        self._record_timings(run_manager, timings)
+
+    async def _atransform(
+        self, chunks: AsyncIterator[InputType], *, run_manager: Any, **kwargs: Any
+    ) -> AsyncIterator[OutputType]:
+        timings: Dict[str, float] = {}
+        stream: AsyncIterator[Any] = chunks
+        for idx, stage in enumerate(self.stages):
+            stream = self._astage_chunks(
+                idx, stage, stream, run_manager, timings, kwargs
+            )
+            kwargs = {}
+        async for chunk in stream:
+            yield chunk
+        self._record_timings(run_manager, timings)
+
+    def _stream(
+        self, input: InputType, *, run_manager: Any, **kwargs: Any
+    ) -> Iterator[OutputType]:
+        yield from self._transform(iter([input]), run_manager=run_manager, **kwargs)
+
+    async def _astream(
+        self, input: InputType, *, run_manager: Any, **kwargs: Any
+    ) -> AsyncIterator[OutputType]:
+        async for chunk in self._atransform(
+            _completed_iter(input), run_manager=run_manager, **kwargs
+        ):
+            yield chunk
+
+
+def _stage_key(idx: int, stage: BaseTraceableRunnable) -> str:
+    # Один класс может стоять в группе несколько раз: ключ включает позицию
+    return f"{idx}:{stage.__class__.__name__}"
+
+
+async def _completed_iter(value: Any) -> AsyncIterator[Any]:
+    yield value
+
+
+def fuse_stages(runnable: Runnable, span_mode: str = SINGLE_SPAN) -> Runnable:
+    """
+    Заменяет в RunnableSequence каждую группу из двух и более подряд идущих
+    сливаемых шагов (см. `is_fusible`) на FusedRunnable. Обёртки
+    with_config/bind сохраняются.
+    """
+    if span_mode not in SPAN_MODES:
+        raise ValueError(f"Unknown span mode: {span_mode}")
+    if isinstance(runnable, RunnableBinding):
+        bound = fuse_stages(runnable.bound, span_mode)
+        if bound is runnable.bound:
+            return runnable
+        return runnable.model_copy(update={"bound": bound})
+    if not isinstance(runnable, RunnableSequence):
+        return runnable
+
+    steps: List[Runnable] = []
+    group: List[BaseTraceableRunnable] = []
+
+    def flush_group() -> None:
+        if len(group) > 1:
+            name = "Fused[" + "|".join(s.__class__.__name__ for s in group) + "]"
+            steps.append(
+                FusedRunnable(
+                    stages=list(group), span_mode=cast(SpanMode, span_mode), name=name
+                )
+            )
+        else:
+            steps.extend(group)
+        group.clear()
+
+    for step in runnable.steps:
+        if is_fusible(step):
+            group.append(step)
+            continue
+        flush_group()
+        steps.append(step)
+    flush_group()
+
+    if len(steps) == len(runnable.steps):
+        return runnable
+    if len(steps) == 1:
+        return steps[0]
+    return RunnableSequence(*steps, name=runnable.name)
+
+
+def maybe_fuse_stages(runnable: Runnable) -> Runnable:
+    """
+    Слияние шагов включается переменной STAGE_FUSION=single|children.
+    """
+    span_mode: Optional[str] = os.getenv("STAGE_FUSION") or None
+    if span_mode is None:
+        return runnable
+    return fuse_stages(runnable, span_mode)
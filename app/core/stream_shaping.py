@@ -0,0 +1,353 @@
+import asyncio
+import os
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+from langchain_core.runnables.base import Runnable
+from langchain_core.runnables.config import RunnableConfig
+from pydantic import BaseModel, Field
+
+from core import metrics
+
+# Настройки объединения для запроса в configurable: StreamShapingConfig,
+# False - без объединения, None (нет ключа) - настройки цепочки
+STREAM_SHAPING_KEY = "__stream_shaping"
+
+STREAM_SHAPING_HEADER = "x-stream-coalesce"
+
+_OFF = ("0", "off", "false", "no")
+_ON = ("1", "on", "true", "yes")
+
+# Сколько готовых кадров async-стрим читает вперёд потребителя
+_READ_AHEAD_FRAMES = 8
+
+_END = object()
+
+
+class StreamShapingConfig(BaseModel):
+    """
+    Пороги объединения чанков стрима в один кадр: кадр отправляется, когда
+    набралось `max_bytes` байт или с первого чанка кадра прошло
+    `max_delay` секунд.
+    """
+
+    max_bytes: int = Field(default=512)
+    max_delay: float = Field(default=0.02)  # в секундах
+
+    @classmethod
+    def parse(cls, value: str) -> Optional["StreamShapingConfig"]:
+        """
+        "512:20" - байты и миллисекунды, "512" - только байты с задержкой по
+        умолчанию, "off"/"0" - без объединения, "on"/"1" - значения по умолчанию.
+        """
+        value = value.strip().lower()
+        if value in _OFF:
+            return None
+        if value in _ON:
+            return cls()
+        max_bytes, _, delay_ms = value.partition(":")
+        config = cls(max_bytes=int(max_bytes))
+        if delay_ms:
+            config.max_delay = float(delay_ms) / 1000
+        return config
+
+
+_default_config: Optional[StreamShapingConfig] = None
+_chain_configs: Optional[Dict[str, Optional[StreamShapingConfig]]] = None
+
+
+def shaping_for(chain: str) -> Optional[StreamShapingConfig]:
+    """
+    Настройки цепочки: STREAM_COALESCE - для всех цепочек ("512:20", пусто -
+    без объединения), STREAM_COALESCE_CHAINS - переопределения по цепочкам:
+    "streaming_chain=1024:50,retry_chain=off".
+    """
+    global _default_config, _chain_configs
+    if _chain_configs is None:
+        value = os.getenv("STREAM_COALESCE")
+        _default_config = StreamShapingConfig.parse(value) if value else None
+        _chain_configs = {}
+        for item in os.getenv("STREAM_COALESCE_CHAINS", "").split(","):
+            if "=" in item:
+                name, value = item.split("=", 1)
+                _chain_configs[name.strip()] = StreamShapingConfig.parse(value)
+    return _chain_configs.get(chain, _default_config)
+
+
+def parse_shaping_header(value: Optional[str]) -> Any:
+    """
+    Значение заголовка X-Stream-Coalesce для configurable (см.
+    StreamShapingConfig.parse); без заголовка или с некорректным
+    значением - None, то есть настройки цепочки.
+    """
+    if not value:
+        return None
+    try:
+        config = StreamShapingConfig.parse(value)
+    except ValueError:
+        return None
+    return False if config is None else config
+
+
+def with_shaping(config: RunnableConfig, shaping: Any) -> RunnableConfig:
+    configurable = {**config.get("configurable", {}), STREAM_SHAPING_KEY: shaping}
+    return {**config, "configurable": configurable}
+
+
+class _Frame:
+    """
+    Накопление кадров: текущая серия строковых чанков (`parts`) и кадры,
+    готовые к отправке (`ready`).
+    """
+
+    __slots__ = ("parts", "size", "started", "ready")
+
+    def __init__(self) -> None:
+        self.parts: List[str] = []
+        self.size = 0
+        self.started = 0.0
+        self.ready: List[Any] = []
+
+    def add(self, chunk: str) -> None:
+        if not self.parts:
+            self.started = time.monotonic()
+        self.parts.append(chunk)
+        self.size += len(chunk) if chunk.isascii() else len(chunk.encode("utf-8"))
+
+    def close(self) -> None:
+        if not self.parts:
+            return
+        parts = self.parts
+        self.ready.append("".join(parts) if len(parts) > 1 else parts[0])
+        self.parts = []
+        self.size = 0
+
+    def push(self, item: Any) -> None:
+        """
+        Элемент, который отправляется отдельным кадром сразу.
+        """
+        self.close()
+        self.ready.append(item)
+
+    def take(self) -> List[Any]:
+        ready = self.ready
+        self.ready = []
+        return ready
+
+
+class StreamShapingRunnable(Runnable):
+    """
+    Объединяет мелкие строковые чанки стрима цепочки в кадры: каждый чанк,
+    отданный наружу, langserve отправляет отдельным SSE-событием со своей
+    сериализацией и записью в сокет.
+
+    Первый чанк отдаётся сразу (время до первого байта не растёт), дальше
+    кадр отправляется по порогам `max_bytes`/`max_delay`. В async-пути кадр
+    отправляется по истечении `max_delay`, даже если следующий чанк ещё не
+    пришёл; в sync-пути пороги проверяются при получении чанка. Чанки других
+    типов отдаются как есть. invoke/batch вызывают цепочку напрямую.
+
+    Настройки берутся из configurable запроса (STREAM_SHAPING_KEY: False -
+    без объединения), иначе из `shaping`.
+    """
+
+    def __init__(
+        self,
+        runnable: Runnable,
+        shaping: Optional[StreamShapingConfig] = None,
+        name: Optional[str] = None,
+    ) -> None:
+        self.runnable = runnable
+        self.shaping = shaping
+        self.name = name or runnable.get_name()
+        self._labels = (("chain", self.name),)
+
+    @property
+    def InputType(self) -> Any:
+        return self.runnable.InputType
+
+    @property
+    def OutputType(self) -> Any:
+        return self.runnable.OutputType
+
+    def get_input_schema(self, config: Optional[RunnableConfig] = None) -> Any:
+        return self.runnable.get_input_schema(config)
+
+    def get_output_schema(self, config: Optional[RunnableConfig] = None) -> Any:
+        return self.runnable.get_output_schema(config)
+
+    @property
+    def config_specs(self) -> Any:
+        return self.runnable.config_specs
+
+    def _shaping(
+        self, config: Optional[RunnableConfig]
+    ) -> Optional[StreamShapingConfig]:
+        shaping = ((config or {}).get("configurable") or {}).get(STREAM_SHAPING_KEY)
+        if shaping is None:
+            return self.shaping
+        return shaping or None
+
+    def _record(self, chunks: int, frames: int) -> None:
+        metrics.inc("stream_shaping_chunks_total", self._labels, chunks)
+        metrics.inc("stream_shaping_frames_total", self._labels, frames)
+
+    def invoke(
+        self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> Any:
+        return self.runnable.invoke(input, config, **kwargs)
+
+    async def ainvoke(
+        self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> Any:
+        return await self.runnable.ainvoke(input, config, **kwargs)
+
+    def batch(self, inputs: List[Any], config: Any = None, **kwargs: Any) -> List[Any]:
+        return self.runnable.batch(inputs, config, **kwargs)
+
+    async def abatch(
+        self, inputs: List[Any], config: Any = None, **kwargs: Any
+    ) -> List[Any]:
+        return await self.runnable.abatch(inputs, config, **kwargs)
+
+    def stream(
+        self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> Iterator[Any]:
+        shaping = self._shaping(config)
+        chunks = self.runnable.stream(input, config, **kwargs)
+        if shaping is None:
+            return chunks
+        return self._shape(chunks, shaping)
+
+    def astream(
+        self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> AsyncIterator[Any]:
+        shaping = self._shaping(config)
+        chunks = self.runnable.astream(input, config, **kwargs)
+        if shaping is None:
+            return chunks
+        return self._ashape(chunks, shaping)
+
+    def _shape(
+        self, chunks: Iterator[Any], shaping: StreamShapingConfig
+    ) -> Iterator[Any]:
+        frame = _Frame()
+        count = frames = 0
+        iterator = iter(chunks)
+        try:
+            while True:
+                try:
+                    chunk = next(iterator)
+                except StopIteration:
+                    break
+                except Exception:
+                    # Уже полученные чанки отдаются до ошибки, как без объединения
+                    frame.close()
+                    for item in frame.take():
+                        frames += 1
+                        yield item
+                    raise
+                count += 1
+                if count == 1 or not isinstance(chunk, str):
+                    frame.push(chunk)
+                else:
+                    frame.add(chunk)
+                    if (
+                        frame.size >= shaping.max_bytes
+                        or time.monotonic() - frame.started >= shaping.max_delay
+                    ):
+                        frame.close()
+                for item in frame.take():
+                    frames += 1
+                    yield item
+            frame.close()
+            for item in frame.take():
+                frames += 1
+                yield item
+        finally:
+            self._record(count, frames)
+
+    async def _ashape(
+        self, chunks: AsyncIterator[Any], shaping: StreamShapingConfig
+    ) -> AsyncIterator[Any]:
+        # Upstream читается отдельной задачей: кадр уходит по таймеру
+        # max_delay, не дожидаясь следующего чанка. Готовые кадры ждут
+        # потребителя в ограниченной очереди - медленный клиент
+        # останавливает чтение upstream, а не копит кадры в памяти.
+        loop = asyncio.get_running_loop()
+        frame = _Frame()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=_READ_AHEAD_FRAMES)
+        timer: Optional[asyncio.TimerHandle] = None
+        error: Optional[BaseException] = None
+        count = frames = 0
+
+        def cancel_timer() -> None:
+            nonlocal timer
+            if timer is not None:
+                timer.cancel()
+                timer = None
+
+        def flush() -> None:
+            nonlocal timer
+            if queue.full():
+                # Потребитель отстаёт: кадр продолжает набираться
+                timer = loop.call_later(shaping.max_delay, flush)
+                return
+            timer = None
+            frame.close()
+            for item in frame.take():
+                queue.put_nowait(item)
+
+        async def put_ready() -> None:
+            cancel_timer()
+            for item in frame.take():
+                await queue.put(item)
+
+        async def pump() -> None:
+            nonlocal count, error, timer
+            try:
+                async for chunk in chunks:
+                    count += 1
+                    if count == 1 or not isinstance(chunk, str):
+                        frame.push(chunk)
+                        await put_ready()
+                        continue
+                    frame.add(chunk)
+                    if frame.size >= shaping.max_bytes:
+                        frame.close()
+                        await put_ready()
+                    elif timer is None:
+                        timer = loop.call_later(shaping.max_delay, flush)
+            except Exception as e:
+                error = e
+            # Уже полученные чанки отдаются и перед ошибкой
+            frame.close()
+            await put_ready()
+            await queue.put(_END)
+
+        task = asyncio.ensure_future(pump())
+        try:
+            while True:
+                item = await queue.get()
+                if item is _END:
+                    break
+                frames += 1
+                yield item
+            if error is not None:
+                raise error
+        finally:
+            task.cancel()
+            # wait не пробрасывает отмену задачи, но не глушит отмену
+            # текущей
+            await asyncio.wait([task])
+            cancel_timer()
+            self._record(count, frames)
+
+
+def shape_stream(runnable: Runnable, chain: str) -> Runnable:
+    """
+    Оборачивает цепочку для объединения чанков стрима. Обёртка ставится
+    всегда: объединение можно включить для отдельного запроса заголовком
+    X-Stream-Coalesce, даже если для цепочки оно выключено.
+    """
+    return StreamShapingRunnable(runnable, shaping_for(chain), name=chain)
@@ -0,0 +1,107 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from functools import partial
+from typing import Any, AsyncIterator, Callable, Iterator, Optional, TypeVar
+
+from core.profiling import profiled
+
+T = TypeVar("T")
+
+# Размер пула потоков для sync-логики, вызываемой из async-пути
+SYNC_OFFLOAD_MAX_WORKERS = int(os.getenv("SYNC_OFFLOAD_MAX_WORKERS", "32"))
+# Сколько чанков sync-генератор может опережать async-потребителя
+SYNC_OFFLOAD_STREAM_BUFFER = int(os.getenv("SYNC_OFFLOAD_STREAM_BUFFER", "16"))
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+_END = object()
+
+
+def get_offload_executor() -> ThreadPoolExecutor:
+    """
+    Общий ограниченный пул потоков (создаётся при первом обращении).
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=SYNC_OFFLOAD_MAX_WORKERS,
+                    thread_name_prefix="sync-offload",
+                )
+    return _executor
+
+
+async def run_sync(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    Выполняет блокирующую функцию в пуле, не занимая event loop.
+    Контекст (contextvars) копируется в поток.
+    """
+    loop = asyncio.get_running_loop()
+    call = partial(copy_context().run, profiled(func), *args, **kwargs)
+    return await loop.run_in_executor(get_offload_executor(), call)
+
+
+async def iterate_sync(
+    make_iterator: Callable[[], Iterator[T]],
+    max_buffer: int = SYNC_OFFLOAD_STREAM_BUFFER,
+) -> AsyncIterator[T]:
+    """
+    Прокидывает чанки sync-генератора из потока пула в async-стрим
+    через ограниченную очередь. Поток ждёт, пока потребитель освободит место
+    (backpressure), а при отмене/закрытии стрима генератор закрывается.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=max_buffer)
+    stopped = threading.Event()
+
+    def put(item: Any) -> None:
+        future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+        while not stopped.is_set():
+            try:
+                future.result(timeout=0.1)
+                return
+            except TimeoutError:
+                continue
+        future.cancel()
+
+    def produce() -> None:
+        iterator = make_iterator()
+        try:
+            for item in iterator:
+                if stopped.is_set():
+                    break
+                put((item, None))
+        except BaseException as exc:
+            put((_END, exc))
+        else:
+            put((_END, None))
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+
+    producer = loop.run_in_executor(
+        get_offload_executor(), copy_context().run, profiled(produce)
+    )
+    try:
+        while True:
+            item, exc = await queue.get()
+            if item is _END:
+                if exc is not None:
+                    raise exc
+                break
+            yield item
+    finally:
+        stopped.set()
+        # Освобождаем место в очереди, чтобы поток не завис на put
+        while not queue.empty():
+            queue.get_nowait()
+        if not producer.done():
+            producer.add_done_callback(lambda f: f.exception())
+        else:
+            await producer
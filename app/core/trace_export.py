@@ -0,0 +1,217 @@
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+SAMPLE = "sample"
+OVERFLOW_POLICIES = (DROP_OLDEST, DROP_NEWEST, SAMPLE)
+
+
+class LangfuseIngestionTransport:
+    """
+    Отправка пачки событий в Langfuse Ingestion API (/api/public/ingestion).
+    """
+
+    def __init__(
+        self,
+        host: str,
+        public_key: str,
+        secret_key: str,
+        timeout: float = 10.0,
+    ) -> None:
+        self.url = host.rstrip("/") + "/api/public/ingestion"
+        self._client = httpx.Client(auth=(public_key, secret_key), timeout=timeout)
+
+    def __call__(self, batch: List[Dict[str, Any]]) -> None:
+        response = self._client.post(self.url, json={"batch": batch})
+        # 207 - частичный успех: ошибки отдельных событий не повторяем
+        if response.status_code >= 400:
+            raise RuntimeError(
+                f"Langfuse ingestion failed: {response.status_code} {response.text[:200]}"
+            )
+
+    def close(self) -> None:
+        self._client.close()
+
+
+class TraceExporter:
+    """
+    Асинхронный экспорт событий трейсинга с ограниченной очередью.
+
+    События копятся в очереди в памяти и отправляются фоновым потоком
+    пачками: по достижении `batch_size` или раз в `flush_interval` секунд.
+    При переполнении очереди применяется `overflow`:
+    - drop_oldest: вытесняется самое старое событие;
+    - drop_newest: новое событие отбрасывается;
+    - sample: после заполнения очереди наполовину новые события
+      принимаются с вероятностью, падающей до нуля у полной очереди.
+    """
+
+    def __init__(
+        self,
+        transport: Callable[[List[Dict[str, Any]]], None],
+        max_queue_size: int = 10000,
+        batch_size: int = 100,
+        flush_interval: float = 1.0,
+        overflow: str = DROP_OLDEST,
+        serializer: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None,
+    ) -> None:
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+        self.transport = transport
+        self.max_queue_size = max_queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.serializer = serializer
+        self._queue: Deque[Dict[str, Any]] = deque()
+        self._cond = threading.Condition()
+        self._sending = 0
+        self._flush_requested = False
+        self._stopped = False
+        self._counters = {"submitted": 0, "sent": 0, "dropped": 0, "failed": 0}
+        self._batches = 0
+        self._worker = threading.Thread(
+            target=self._run, name="trace-exporter", daemon=True
+        )
+        self._worker.start()
+
+    @classmethod
+    def from_env(
+        cls, transport: Callable[[List[Dict[str, Any]]], None], **kwargs: Any
+    ) -> "TraceExporter":
+        return cls(
+            transport,
+            max_queue_size=int(os.getenv("TRACE_EXPORT_QUEUE_SIZE", "10000")),
+            batch_size=int(os.getenv("TRACE_EXPORT_BATCH_SIZE", "100")),
+            flush_interval=float(os.getenv("TRACE_EXPORT_FLUSH_INTERVAL", "1.0")),
+            overflow=os.getenv("TRACE_EXPORT_OVERFLOW", DROP_OLDEST),
+            **kwargs,
+        )
+
+    def submit(self, event: Dict[str, Any]) -> bool:
+        """
+        Кладёт событие в очередь. Не блокирует; возвращает False,
+        если событие отброшено политикой переполнения.
+        """
+        with self._cond:
+            if self._stopped:
+                self._counters["dropped"] += 1
+                return False
+            self._counters["submitted"] += 1
+            size = len(self._queue)
+            if size >= self.max_queue_size:
+                if self.overflow != DROP_OLDEST:
+                    self._counters["dropped"] += 1
+                    return False
+                self._queue.popleft()
+                self._counters["dropped"] += 1
+            elif self.overflow == SAMPLE:
+                watermark = self.max_queue_size // 2
+                if size > watermark:
+                    keep = (self.max_queue_size - size) / (
+                        self.max_queue_size - watermark
+                    )
+                    if random.random() >= keep:
+                        self._counters["dropped"] += 1
+                        return False
+            self._queue.append(event)
+            if len(self._queue) >= self.batch_size:
+                self._cond.notify()
+            return True
+
+    def _take_batch(self) -> List[Dict[str, Any]]:
+        batch: List[Dict[str, Any]] = []
+        while self._queue and len(batch) < self.batch_size:
+            batch.append(self._queue.popleft())
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                deadline = time.monotonic() + self.flush_interval
+                while (
+                    len(self._queue) < self.batch_size
+                    and not self._flush_requested
+                    and not self._stopped
+                ):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._take_batch()
+                if not self._queue:
+                    self._flush_requested = False
+                if not batch:
+                    if self._stopped:
+                        return
+                    self._cond.notify_all()
+                    continue
+                self._sending += 1
+            self._send(batch)
+            with self._cond:
+                self._sending -= 1
+                self._cond.notify_all()
+
+    def _send(self, batch: List[Dict[str, Any]]) -> None:
+        try:
+            if self.serializer is not None:
+                batch = [self.serializer(event) for event in batch]
+            self.transport(batch)
+        except Exception as e:
+            # Пачка не повторяется, чтобы не копить память при недоступном Langfuse
+            logger.warning("Trace export failed: %s", e)
+            with self._cond:
+                self._counters["failed"] += len(batch)
+        else:
+            with self._cond:
+                self._counters["sent"] += len(batch)
+                self._batches += 1
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Ждёт отправки всех накопленных событий. Возвращает False по таймауту.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._flush_requested = True
+            self._cond.notify_all()
+            while self._queue or self._sending:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining if remaining is not None else 0.1)
+                self._flush_requested = True
+                self._cond.notify_all()
+        return True
+
+    def shutdown(self, timeout: float = 5.0) -> None:
+        """
+        Отправляет остаток очереди и останавливает фоновый поток.
+        """
+        self.flush(timeout)
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._worker.join(timeout)
+        close = getattr(self.transport, "close", None)
+        if close is not None and not self._worker.is_alive():
+            close()
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            return {
+                **self._counters,
+                "queued": len(self._queue),
+                "in_flight": self._sending,
+                "batches": self._batches,
+            }
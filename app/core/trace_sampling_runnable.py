@@ -0,0 +1,431 @@
+from core import metrics
+from core.base_traceable_runnable import BaseTraceableRunnable, _aggregate_chunks
+from core.profiling import PROFILE_KEY, ProfileSession, RequestProfiler
+from core.sync_offload import run_sync
+from core.sampling import (
+    TraceBuffer,
+    TraceSampler,
+    FORCE_SAMPLE_KEY,
+    TRACE_BUFFER_KEY,
+    TRACE_SAMPLED_KEY,
+)
+from langchain_core.callbacks.manager import CallbackManager
+from langchain_core.runnables.base import Runnable
+from langchain_core.runnables.config import (
+    RunnableConfig,
+    ensure_config,
+    get_config_list,
+    patch_config,
+)
+from pydantic import Field
+import time
+from typing import (
+    Any,
+    AsyncIterator,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+    Union,
+)
+
+InputType = TypeVar("InputType")
+OutputType = TypeVar("OutputType")
+
+
+class TraceSamplingRunnable(BaseTraceableRunnable[InputType, OutputType]):
+    """
+    Корневой runnable endpoint'а, который один раз решает, трейсится ли запрос.
+
+    Семплированный запрос выполняется с callback'ами трейсинга. Для
+    несемплированного решение передаётся вниз через configurable, и шаги
+    не создают callback manager. Если включены хвостовые правила, шаги
+    пишут итоги в дешёвый буфер, который выгружается в трейс только при
+    ошибке или медленном запросе.
+
+    Профилируемый запрос (см. RequestProfiler) всегда трейсится: его
+    корневой span создаётся здесь, а сводка профиля добавляется к нему
+    дочерним span'ом `profile`.
+    """
+
+    inner_runnable: Runnable[InputType, OutputType]
+    sampler: TraceSampler = Field(default_factory=TraceSampler.from_env)
+    endpoint: Optional[str] = Field(default=None)
+    callbacks: List[Any] = Field(default_factory=list)
+    profiler: RequestProfiler = Field(default_factory=RequestProfiler.from_env)
+
+    def get_input_schema(self, config: Optional[RunnableConfig] = None) -> Any:
+        return self.inner_runnable.get_input_schema(config)
+
+    def get_output_schema(self, config: Optional[RunnableConfig] = None) -> Any:
+        return self.inner_runnable.get_output_schema(config)
+
+    @property
+    def config_specs(self) -> Any:
+        return self.inner_runnable.config_specs
+
+    def _run(self, input: InputType, *, run_manager: Any, **kwargs: Any) -> OutputType:
+        return self.invoke_nested(self.inner_runnable, input, run_manager, **kwargs)
+
+    def _prepare(
+        self, input: Any, config: Optional[RunnableConfig]
+    ) -> Tuple[RunnableConfig, Optional[TraceBuffer], Optional[ProfileSession]]:
+        config = ensure_config(config)
+        configurable = {**config.get("configurable", {})}
+        forced = configurable.pop(FORCE_SAMPLE_KEY, None)
+        if self.profiler.decide(configurable.get(PROFILE_KEY)):
+            session = self.profiler.start(self._name())
+            if session is not None:
+                callbacks = self._with_tracing(config)
+                return self._profile_root(input, config, callbacks, session)
+        if self.sampler.decide(self.endpoint, forced):
+            callbacks = self._with_tracing(config)
+            # Корневой span называется по endpoint'у: по нему записи трейсов
+            # сопоставляются с цепочкой (см. benchmarks.replay)
+            config = patch_config(config, callbacks=callbacks, run_name=self._name())
+            return config, None, None
+
+        # Служебные callback'и сервера (например, langserve) сохраняются,
+        # callback'и трейсинга не подключаются
+        buffer = TraceBuffer() if self.sampler.needs_buffer else None
+        configurable[TRACE_SAMPLED_KEY] = False
+        configurable[TRACE_BUFFER_KEY] = buffer
+        return patch_config(config, configurable=configurable), buffer, None
+
+    def _name(self) -> str:
+        return self.endpoint or self.inner_runnable.get_name()
+
+    def _profile_root(
+        self,
+        input: Any,
+        config: RunnableConfig,
+        callbacks: Any,
+        session: ProfileSession,
+    ) -> Tuple[RunnableConfig, None, ProfileSession]:
+        callback_manager = CallbackManager.configure(callbacks)
+        callback_manager.add_metadata({"profiled": True}, inherit=False)
+        session.root = callback_manager.on_chain_start(
+            None,
+            self._payload_policy().apply(input),
+            name=self._name(),
+            run_id=session.run_id,
+        )
+        return patch_config(config, callbacks=session.root.get_child()), None, session
+
+    def _end_profile(
+        self,
+        session: ProfileSession,
+        summary: Any,
+        output: Any = None,
+        error: Optional[BaseException] = None,
+    ) -> None:
+        """
+        Сводка профиля - дочерний span `profile` (в metadata и в output),
+        затем закрывается корневой span запроса.
+        """
+        child_manager = session.root.get_child()
+        child_manager.metadata = {"profile": summary}
+        span = child_manager.on_chain_start(
+            None, {"file": summary.get("file")}, name="profile"
+        )
+        span.on_chain_end(summary)
+        if error is not None:
+            session.root.on_chain_error(error)
+        else:
+            session.root.on_chain_end(self._payload_policy().apply(output))
+
+    def _profile_summary(self, session: ProfileSession) -> Any:
+        try:
+            return session.write()
+        except Exception as e:
+            return {"error": repr(e)}
+
+    def _finish_profile(
+        self,
+        session: Optional[ProfileSession],
+        output: Any = None,
+        error: Optional[BaseException] = None,
+    ) -> None:
+        if session is None:
+            return
+        session.stop()
+        self._end_profile(session, self._profile_summary(session), output, error)
+
+    async def _afinish_profile(
+        self,
+        session: Optional[ProfileSession],
+        output: Any = None,
+        error: Optional[BaseException] = None,
+    ) -> None:
+        if session is None:
+            return
+        session.stop()
+        # Разбор и запись профиля - в пуле потоков, не в event loop
+        summary = await run_sync(self._profile_summary, session)
+        self._end_profile(session, summary, output, error)
+
+    def _with_tracing(self, config: RunnableConfig) -> Any:
+        callbacks = config.get("callbacks")
+        if not self.callbacks:
+            return callbacks
+        if callbacks is None:
+            return list(self.callbacks)
+        if isinstance(callbacks, list):
+            return callbacks + self.callbacks
+        callbacks = callbacks.copy()
+        for handler in self.callbacks:
+            callbacks.add_handler(handler, inherit=True)
+        return callbacks
+
+    def _finish(
+        self,
+        input: Any,
+        buffer: Optional[TraceBuffer],
+        started: float,
+        output: Any = None,
+        error: Optional[BaseException] = None,
+        mode: str = "invoke",
+    ) -> None:
+        duration = time.monotonic() - started
+        metrics.observe(
+            "endpoint_duration_seconds",
+            (
+                ("endpoint", self.endpoint or self.inner_runnable.get_name()),
+                ("mode", mode),
+                ("status", "ok" if error is None else "error"),
+            ),
+            duration,
+        )
+        if buffer is None:
+            return
+        if self.sampler.should_keep(duration, error):
+            self._export(input, buffer, duration, output, error)
+
+    def _export(
+        self,
+        input: Any,
+        buffer: TraceBuffer,
+        duration: float,
+        output: Any,
+        error: Optional[BaseException],
+    ) -> None:
+        """
+        Выгружает буфер несемплированного запроса в трейс: корневой span
+        и по дочернему span'у на каждый записанный шаг.
+        """
+        policy = self._payload_policy()
+        callback_manager = CallbackManager.configure(self.callbacks)
+        callback_manager.add_metadata(
+            {"tail_sampled": True, "duration": duration}, inherit=False
+        )
+        root = callback_manager.on_chain_start(
+            None,
+            policy.apply(input),
+            name=self.endpoint or self.inner_runnable.get_name(),
+        )
+        child_manager = root.get_child()
+        for record in buffer.records:
+            child_manager.metadata = {
+                "duration": record["duration"],
+                **record.get("metadata", {}),
+            }
+            step = child_manager.on_chain_start(
+                None, policy.apply(record["input"]), name=record["name"]
+            )
+            if "error" in record:
+                step.on_chain_error(record["error"])
+            else:
+                step.on_chain_end(policy.apply(record.get("output")))
+        if error is not None:
+            root.on_chain_error(error)
+        else:
+            root.on_chain_end(policy.apply(output))
+
+    def invoke(
+        self, input: InputType, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> OutputType:
+        config, buffer, session = self._prepare(input, config)
+        started = time.monotonic()
+        try:
+            result = self.inner_runnable.invoke(input, config, **kwargs)
+        except Exception as e:
+            self._finish_profile(session, error=e)
+            self._finish(input, buffer, started, error=e)
+            raise
+        self._finish_profile(session, output=result)
+        self._finish(input, buffer, started, output=result)
+        return result
+
+    async def ainvoke(
+        self, input: InputType, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> OutputType:
+        config, buffer, session = self._prepare(input, config)
+        started = time.monotonic()
+        try:
+            result = await self.inner_runnable.ainvoke(input, config, **kwargs)
+        except BaseException as e:
+            await self._afinish_profile(session, error=e)
+            if isinstance(e, Exception):
+                self._finish(input, buffer, started, error=e)
+            raise
+        await self._afinish_profile(session, output=result)
+        self._finish(input, buffer, started, output=result)
+        return result
+
+    def stream(
+        self, input: InputType, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> Iterator[OutputType]:
+        config, buffer, session = self._prepare(input, config)
+        started = time.monotonic()
+        chunks: Optional[List[Any]] = [] if session is not None else None
+        try:
+            for chunk in self.inner_runnable.stream(input, config, **kwargs):
+                if chunks is not None:
+                    chunks.append(chunk)
+                yield chunk
+        except BaseException as e:
+            self._finish_profile(session, error=e)
+            if isinstance(e, Exception):
+                self._finish(input, buffer, started, error=e, mode="stream")
+            raise
+        self._finish_profile(session, output=_aggregate_chunks(chunks or []))
+        self._finish(input, buffer, started, mode="stream")
+
+    async def astream(
+        self, input: InputType, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> AsyncIterator[OutputType]:
+        config, buffer, session = self._prepare(input, config)
+        started = time.monotonic()
+        chunks: Optional[List[Any]] = [] if session is not None else None
+        try:
+            async for chunk in self.inner_runnable.astream(input, config, **kwargs):
+                if chunks is not None:
+                    chunks.append(chunk)
+                yield chunk
+        except BaseException as e:
+            await self._afinish_profile(session, error=e)
+            if isinstance(e, Exception):
+                self._finish(input, buffer, started, error=e, mode="stream")
+            raise
+        await self._afinish_profile(session, output=_aggregate_chunks(chunks or []))
+        self._finish(input, buffer, started, mode="stream")
+
+    def _prepare_batch(
+        self,
+        inputs: Sequence[InputType],
+        config: Optional[Union[RunnableConfig, Sequence[RunnableConfig]]],
+    ) -> List[Tuple[RunnableConfig, Optional[TraceBuffer], Optional[ProfileSession]]]:
+        # Решение принимается для каждого элемента отдельно
+        configs = get_config_list(config, len(inputs))
+        return [self._prepare(input, c) for input, c in zip(inputs, configs)]
+
+    @staticmethod
+    def _batch_outcomes(
+        results: Optional[List[Any]], count: int, error: Optional[BaseException]
+    ) -> List[Tuple[Any, Optional[BaseException]]]:
+        """
+        Пары (выход, ошибка) элементов пачки. Если прерван весь вызов
+        (отмена, ошибка вне элементов), ошибка относится к каждому элементу.
+        """
+        if results is None:
+            return [(None, error)] * count
+        return [
+            (None, result) if isinstance(result, Exception) else (result, None)
+            for result in results
+        ]
+
+    @staticmethod
+    def _batch_results(results: List[Any], return_exceptions: bool) -> List[Any]:
+        if not return_exceptions:
+            for result in results:
+                if isinstance(result, Exception):
+                    raise result
+        return results
+
+    def _finish_items(
+        self,
+        inputs: Sequence[InputType],
+        prepared: List[Tuple[Any, Optional[TraceBuffer], Optional[ProfileSession]]],
+        started: float,
+        results: Optional[List[Any]] = None,
+        error: Optional[BaseException] = None,
+    ) -> None:
+        outcomes = self._batch_outcomes(results, len(inputs), error)
+        for input, (_, buffer, session), (output, exc) in zip(
+            inputs, prepared, outcomes
+        ):
+            self._finish_profile(session, output, exc)
+            if exc is None or isinstance(exc, Exception):
+                self._finish(input, buffer, started, output, exc, mode="batch")
+
+    async def _afinish_items(
+        self,
+        inputs: Sequence[InputType],
+        prepared: List[Tuple[Any, Optional[TraceBuffer], Optional[ProfileSession]]],
+        started: float,
+        results: Optional[List[Any]] = None,
+        error: Optional[BaseException] = None,
+    ) -> None:
+        outcomes = self._batch_outcomes(results, len(inputs), error)
+        for input, (_, buffer, session), (output, exc) in zip(
+            inputs, prepared, outcomes
+        ):
+            await self._afinish_profile(session, output, exc)
+            if exc is None or isinstance(exc, Exception):
+                self._finish(input, buffer, started, output, exc, mode="batch")
+
+    def batch(
+        self,
+        inputs: List[InputType],
+        config: Optional[Union[RunnableConfig, List[RunnableConfig]]] = None,
+        *,
+        return_exceptions: bool = False,
+        **kwargs: Any,
+    ) -> List[OutputType]:
+        if not inputs:
+            return []
+        # Пачка целиком уходит во внутренний runnable: его собственный
+        # batch (RunnableSequence, _run_batch шагов) не теряется. Ошибки
+        # возвращаются поэлементно, чтобы каждый элемент завершился со своим
+        # исходом, а не как ошибка из-за соседа
+        prepared = self._prepare_batch(inputs, config)
+        started = time.monotonic()
+        try:
+            results = self.inner_runnable.batch(
+                inputs,
+                [item[0] for item in prepared],
+                return_exceptions=True,
+                **kwargs,
+            )
+        except BaseException as e:
+            self._finish_items(inputs, prepared, started, error=e)
+            raise
+        self._finish_items(inputs, prepared, started, results)
+        return self._batch_results(results, return_exceptions)
+
+    async def abatch(
+        self,
+        inputs: List[InputType],
+        config: Optional[Union[RunnableConfig, List[RunnableConfig]]] = None,
+        *,
+        return_exceptions: bool = False,
+        **kwargs: Any,
+    ) -> List[OutputType]:
+        if not inputs:
+            return []
+        prepared = self._prepare_batch(inputs, config)
+        started = time.monotonic()
+        try:
+            results = await self.inner_runnable.abatch(
+                inputs,
+                [item[0] for item in prepared],
+                return_exceptions=True,
+                **kwargs,
+            )
+        except BaseException as e:
+            await self._afinish_items(inputs, prepared, started, error=e)
+            raise
+        await self._afinish_items(inputs, prepared, started, results)
+        return self._batch_results(results, return_exceptions)
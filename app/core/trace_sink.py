@@ -0,0 +1,141 @@
+import glob
+import gzip
+import json
+import logging
+import os
+import time
+import zlib
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+FILE_PATTERN = "traces-*.jsonl.gz"
+
+
+class LocalFileTransport:
+    """
+    Транспорт TraceExporter'а, который дописывает пачки событий в локальные
+    файлы JSON Lines со сжатием gzip (по событию Ingestion API на строку).
+
+    Вызывается только из потока экспорта, поэтому запись не задерживает
+    запросы. Каждая пачка завершается sync flush'ем: уже записанное можно
+    читать, не дожидаясь закрытия файла. Файл сменяется по размеру
+    (`max_bytes` сжатых данных) или возрасту (`max_age` секунд); при
+    `max_files` старые файлы каталога удаляются. В имени файла есть pid,
+    поэтому worker'ы server.py пишут в разные файлы.
+    """
+
+    def __init__(
+        self,
+        directory: str = "traces",
+        max_bytes: int = 64 * 1024 * 1024,
+        max_age: Optional[float] = 3600.0,
+        max_files: int = 0,
+        compresslevel: int = 1,
+    ) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.max_files = max_files
+        self.compresslevel = compresslevel
+        self.path: Optional[str] = None
+        self._raw: Any = None
+        self._file: Optional[gzip.GzipFile] = None
+        self._opened = 0.0
+        self._seq = 0
+        os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def from_env(cls) -> "LocalFileTransport":
+        """
+        TRACE_SINK_DIR=traces, TRACE_SINK_MAX_MB=64, TRACE_SINK_MAX_AGE=3600,
+        TRACE_SINK_MAX_FILES=0 (без удаления), TRACE_SINK_COMPRESSLEVEL=1.
+        """
+        max_age = float(os.getenv("TRACE_SINK_MAX_AGE", "3600"))
+        return cls(
+            directory=os.getenv("TRACE_SINK_DIR", "traces"),
+            max_bytes=int(float(os.getenv("TRACE_SINK_MAX_MB", "64")) * 1024 * 1024),
+            max_age=max_age if max_age > 0 else None,
+            max_files=int(os.getenv("TRACE_SINK_MAX_FILES", "0")),
+            compresslevel=int(os.getenv("TRACE_SINK_COMPRESSLEVEL", "1")),
+        )
+
+    def _should_rotate(self) -> bool:
+        if self._file is None:
+            return True
+        if self._raw.tell() >= self.max_bytes:
+            return True
+        return (
+            self.max_age is not None and time.monotonic() - self._opened >= self.max_age
+        )
+
+    def _rotate(self) -> None:
+        self.close()
+        self._seq += 1
+        name = f"traces-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{self._seq:04d}"
+        self.path = os.path.join(self.directory, f"{name}.jsonl.gz")
+        self._raw = open(self.path, "ab")
+        self._file = gzip.GzipFile(
+            fileobj=self._raw, mode="ab", compresslevel=self.compresslevel
+        )
+        self._opened = time.monotonic()
+        self._cleanup()
+
+    def _cleanup(self) -> None:
+        if self.max_files <= 0:
+            return
+        files = sorted(
+            glob.glob(os.path.join(self.directory, FILE_PATTERN)),
+            key=os.path.getmtime,
+        )
+        for path in files[: max(0, len(files) - self.max_files)]:
+            if path != self.path:
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    logger.warning("Failed to remove trace file %s: %s", path, e)
+
+    def __call__(self, batch: List[Dict[str, Any]]) -> None:
+        if self._should_rotate():
+            self._rotate()
+        assert self._file is not None
+        data = "".join(
+            json.dumps(event, ensure_ascii=False, default=str) + "\n" for event in batch
+        )
+        self._file.write(data.encode("utf-8"))
+        self._file.flush()
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._raw.close()
+            self._file = None
+            self._raw = None
+
+
+def trace_files(paths: Sequence[str]) -> List[str]:
+    """
+    Файлы записи по путям: каталоги раскрываются в их файлы трейсов.
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, FILE_PATTERN))))
+        else:
+            files.append(path)
+    return files
+
+
+def read_events(paths: Sequence[str]) -> Iterator[Dict[str, Any]]:
+    """
+    События из файлов LocalFileTransport. Незавершённый хвост файла,
+    в который ещё идёт запись, пропускается.
+    """
+    for path in trace_files(paths):
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    if line.endswith("\n"):
+                        yield json.loads(line)
+        except (EOFError, zlib.error, gzip.BadGzipFile):
+            continue
@@ -0,0 +1,62 @@
+import os
+import time
+from typing import Any, Dict
+
+# Номер worker'а и лимит запросов до перезапуска задаёт server.py
+WORKER_ID_ENV = "WORKER_ID"
+WORKER_MAX_REQUESTS_ENV = "WORKER_MAX_REQUESTS"
+
+
+class WorkerStats:
+    """
+    Состояние процесса-worker'а для /health: pid, время работы, число
+    обработанных и выполняющихся HTTP-запросов.
+
+    При запуске через server.py объект создаётся до fork, поэтому
+    `reset()` вызывается на старте каждого worker'а.
+    """
+
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self) -> None:
+        self.pid = os.getpid()
+        self.started = time.time()
+        self.requests = 0
+        self.in_flight = 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        max_requests = os.getenv(WORKER_MAX_REQUESTS_ENV)
+        return {
+            "worker_id": os.getenv(WORKER_ID_ENV),
+            "pid": self.pid,
+            "uptime_s": round(time.time() - self.started, 1),
+            "requests": self.requests,
+            "in_flight": self.in_flight,
+            "max_requests": int(max_requests) if max_requests else None,
+        }
+
+
+worker_stats = WorkerStats()
+
+
+class WorkerStatsMiddleware:
+    """
+    ASGI middleware: считает HTTP-запросы worker'а. Запрос (в том числе
+    стрим) считается выполняющимся до отправки ответа целиком.
+    """
+
+    def __init__(self, app: Any, stats: WorkerStats = worker_stats) -> None:
+        self.app = app
+        self.stats = stats
+
+    async def __call__(self, scope: Any, receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        self.stats.requests += 1
+        self.stats.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.stats.in_flight -= 1
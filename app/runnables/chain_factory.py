@@ -1,7 +1,12 @@
+import os
+from typing import Dict, List, Optional
 from langchain.schema import StrOutputParser
+from langchain_core.language_models import BaseChatModel
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.runnables.config import RunnableConfig
+from pydantic import BaseModel, RootModel
 from runnables.llm_stub import SimpleLLM
+from runnables.simulation import LLM, RAISE_EXCEPTION, STREAMING_ECHO, get_simulation
 from runnables.custom_runnable import (
     EchoRunnable,
     UppercaseRunnable,
@@ -11,6 +16,83 @@ from runnables.custom_runnable import (
     NestedStreamingRunnable,
 )
 from core.retry_runnable import RetryRunnable
+from core.caching_runnable import CachingRunnable
+from core.micro_batching import MicroBatchingChatModel
+from core.parallel_runnable import ParallelTraceableRunnable
+from core.response_cache import ResponseCache
+from core.stage_fusion import maybe_fuse_stages
+from core.stream_shaping import shape_stream
+
+
+class ChainInput(BaseModel):
+    input: str
+
+
+class ChainOutput(RootModel[str]):
+    pass
+
+
+class ParallelChainOutput(RootModel[Dict[str, str]]):
+    pass
+
+
+def _route(
+    path: str, factory: str, endpoints: List[str], output_schema: str = "ChainOutput"
+) -> dict:
+    return {
+        "path": path,
+        "factory": f"runnables.chain_factory:{factory}",
+        "endpoints": endpoints,
+        "input_schema": "runnables.chain_factory:ChainInput",
+        "output_schema": f"runnables.chain_factory:{output_schema}",
+    }
+
+
+# Endpoint'ы приложения по умолчанию (см. core.chain_registry.load_chain_specs)
+ROUTES = [
+    _route("/v1", "create_chain", ["invoke", "batch"]),
+    _route("/v2", "create_chain_with_error", ["invoke", "batch"]),
+    _route("/v3", "create_streaming_chain", ["invoke", "batch", "stream"]),
+    _route("/v4", "create_nested_chain", ["invoke", "batch"]),
+    _route("/v5", "create_nested_streaming_chain", ["invoke", "batch", "stream"]),
+    _route("/v6", "create_retry_chain", ["invoke", "batch", "stream"]),
+    _route(
+        "/v7",
+        "create_parallel_chain",
+        ["invoke", "batch", "stream"],
+        output_schema="ParallelChainOutput",
+    ),
+]
+
+# Общий кэш ответов LLM-этапа (включается через RESPONSE_CACHE_ENABLED)
+_response_cache: Optional[ResponseCache] = None
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    global _response_cache
+    if _response_cache is None and os.getenv("RESPONSE_CACHE_ENABLED") == "1":
+        ttl = os.getenv("RESPONSE_CACHE_TTL", "300")
+        _response_cache = ResponseCache(
+            maxsize=int(os.getenv("RESPONSE_CACHE_MAXSIZE", "1024")),
+            ttl=float(ttl) if ttl else None,
+            disk_path=os.getenv("RESPONSE_CACHE_PATH") or None,
+        )
+    return _response_cache
+
+
+def get_llm(simulation: Optional[dict] = None):
+    llm: BaseChatModel = SimpleLLM.from_env(simulation=(simulation or {}).get(LLM))
+    if os.getenv("LLM_BATCHING") == "1":
+        # Конкурентные запросы к LLM-этапу цепочки уходят пачками
+        llm = MicroBatchingChatModel(
+            llm=llm,
+            max_batch_size=int(os.getenv("LLM_BATCH_MAX_SIZE", "8")),
+            window=float(os.getenv("LLM_BATCH_WINDOW_MS", "10")) / 1000,
+        )
+    cache = get_response_cache()
+    if cache is None:
+        return llm
+    return CachingRunnable(inner_runnable=llm, cache=cache)
 
 
 def get_prompt():
@@ -20,58 +102,100 @@ def get_prompt():
 
 
 def create_chain(config: RunnableConfig):
+    simulation = get_simulation("chain")
     prompt = get_prompt()
-    llm = SimpleLLM()
-    return (
+    llm = get_llm(simulation)
+    chain = (
         prompt | llm | StrOutputParser() | EchoRunnable() | UppercaseRunnable()
     ).with_config(config)
+    return maybe_fuse_stages(chain)
 
 
 def create_chain_with_error(config: RunnableConfig):
+    simulation = get_simulation("chain_with_error")
     prompt = get_prompt()
-    llm = SimpleLLM()
-    return (
+    llm = get_llm(simulation)
+    chain = (
         prompt
         | llm
         | StrOutputParser()
         | EchoRunnable()
         | UppercaseRunnable()
-        | RaiseExceptionRunnable()
+        | RaiseExceptionRunnable(simulation=simulation.get(RAISE_EXCEPTION))
     ).with_config(config)
+    return maybe_fuse_stages(chain)
 
 
 def create_streaming_chain(config: RunnableConfig):
+    simulation = get_simulation("streaming_chain")
     prompt = get_prompt()
-    llm = SimpleLLM()
-    return (
-        prompt | llm | StrOutputParser() | EchoRunnable() | StreamingEchoRunnable()
+    llm = get_llm(simulation)
+    chain = (
+        prompt
+        | llm
+        | StrOutputParser()
+        | EchoRunnable()
+        | StreamingEchoRunnable(simulation=simulation.get(STREAMING_ECHO))
     ).with_config(config)
+    return shape_stream(maybe_fuse_stages(chain), "streaming_chain")
 
 
 def create_nested_chain(config: RunnableConfig):
+    simulation = get_simulation("nested_chain")
     prompt = get_prompt()
-    llm = SimpleLLM()
-    return (
+    llm = get_llm(simulation)
+    chain = (
         prompt | llm | StrOutputParser() | EchoRunnable() | NestedRunnable()
     ).with_config(config)
+    return maybe_fuse_stages(chain)
 
 
 def create_nested_streaming_chain(config: RunnableConfig):
+    simulation = get_simulation("nested_streaming_chain")
     prompt = get_prompt()
-    llm = SimpleLLM()
-    return (
-        prompt | llm | StrOutputParser() | EchoRunnable() | NestedStreamingRunnable()
+    llm = get_llm(simulation)
+    chain = (
+        prompt
+        | llm
+        | StrOutputParser()
+        | EchoRunnable()
+        | NestedStreamingRunnable(
+            inner_runnable=StreamingEchoRunnable(
+                simulation=simulation.get(STREAMING_ECHO)
+            )
+        )
     ).with_config(config)
+    return shape_stream(maybe_fuse_stages(chain), "nested_streaming_chain")
 
 
 def create_retry_chain(config: RunnableConfig):
+    simulation = get_simulation("retry_chain")
     prompt = get_prompt()
-    llm = SimpleLLM()
+    llm = get_llm(simulation)
     retry_runnable: RetryRunnable = RetryRunnable(
-        inner_runnable=RaiseExceptionRunnable(),
+        inner_runnable=RaiseExceptionRunnable(
+            simulation=simulation.get(RAISE_EXCEPTION)
+        ),
         max_retries=3,
         delay=0.1,
     )
-    return (
+    chain = (
         prompt | llm | StrOutputParser() | EchoRunnable() | retry_runnable
     ).with_config(config)
+    return shape_stream(maybe_fuse_stages(chain), "retry_chain")
+
+
+def create_parallel_chain(config: RunnableConfig):
+    simulation = get_simulation("parallel_chain")
+    prompt = get_prompt()
+    llm = get_llm(simulation)
+    # Ответ модели обрабатывается двумя независимыми ветками одновременно
+    parallel = ParallelTraceableRunnable(
+        branches={
+            "echo": StreamingEchoRunnable(simulation=simulation.get(STREAMING_ECHO)),
+            "upper": UppercaseRunnable(),
+        },
+        max_concurrency=int(os.getenv("PARALLEL_MAX_CONCURRENCY", "0")) or None,
+    )
+    chain = (prompt | llm | StrOutputParser() | parallel).with_config(config)
+    return maybe_fuse_stages(chain)
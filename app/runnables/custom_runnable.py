@@ -2,6 +2,8 @@ from core.base_traceable_runnable import BaseTraceableRunnable
 import time
 import asyncio
 from pydantic import Field
+from typing import ClassVar, Optional
+from runnables.simulation import SimulatedFailure, StageSimulation
 
 
 class UppercaseRunnable(BaseTraceableRunnable):
@@ -9,15 +11,33 @@ class UppercaseRunnable(BaseTraceableRunnable):
     Runnable, который переводит входную строку в верхний регистр.
     """
 
+    # Шаг тривиально дешёвый - переход в пул потоков стоит дороже самой работы
+    offload_sync = False
+    # Регистр меняется посимвольно - вход не нужно собирать целиком
+    buffers_input = False
+
     def _run(self, input: str, *, run_manager, **kwargs) -> str:
         return input.upper()
 
+    def _transform(self, chunks, *, run_manager, **kwargs):
+        for chunk in chunks:
+            yield chunk.upper()
+
+    async def _atransform(self, chunks, *, run_manager, **kwargs):
+        async for chunk in chunks:
+            yield chunk.upper()
+
+    def _run_batch(self, inputs, *, run_managers, **kwargs):
+        return [input.upper() for input in inputs]
+
 
 class EchoRunnable(BaseTraceableRunnable):
     """
     Runnable, который возвращает входную строку без изменений (и поддерживает стриминг).
     """
 
+    buffers_input = False
+
     def _run(self, input: str, *, run_manager, **kwargs) -> str:
         return input
 
@@ -30,34 +50,117 @@ class EchoRunnable(BaseTraceableRunnable):
     async def _astream(self, input: str, *, run_manager, **kwargs):
         yield input
 
+    def _transform(self, chunks, *, run_manager, **kwargs):
+        yield from chunks
+
+    async def _atransform(self, chunks, *, run_manager, **kwargs):
+        async for chunk in chunks:
+            yield chunk
+
 
 class RaiseExceptionRunnable(BaseTraceableRunnable):
     """
     Runnable, который всегда выбрасывает ValueError для тестирования ошибок.
+    С профилем `simulation` падает по его модели сбоев (SimulatedFailure),
+    а в остальных случаях возвращает вход.
     """
 
+    simulation: Optional[StageSimulation] = Field(default=None)
+
     def _run(self, input: str, *, run_manager, **kwargs) -> str:
-        raise ValueError("Ошибка при запуске цепочки")
+        if self.simulation is None:
+            raise ValueError("Ошибка при запуске цепочки")
+        self.simulation.start()
+        if self.simulation.fail_at(1) is not None:
+            raise SimulatedFailure("Simulated stage failure")
+        return input
+
+    async def _arun(self, input: str, *, run_manager, **kwargs) -> str:
+        if self.simulation is None:
+            raise ValueError("Ошибка при запуске цепочки")
+        await self.simulation.astart()
+        if self.simulation.fail_at(1) is not None:
+            raise SimulatedFailure("Simulated stage failure")
+        return input
 
 
 class StreamingEchoRunnable(BaseTraceableRunnable):
     """
     Runnable, который стримит входную строку по одному символу.
+    Поддерживает продолжение стрима с позиции `resume_offset`.
+    Профиль `simulation` задаёт задержку старта, скорость и сбои.
     """
 
+    supports_resume_offset: ClassVar[bool] = True
+    buffers_input = False
+
+    simulation: Optional[StageSimulation] = Field(default=None)
+
+    def _interval(self) -> float:
+        if self.simulation is None:
+            return 0.05
+        return self.simulation.token_interval(0.05)
+
+    def _fail_at(self, chunks: int) -> Optional[int]:
+        if self.simulation is None:
+            return None
+        return self.simulation.fail_at(chunks)
+
+    def _start(self) -> None:
+        if self.simulation is not None:
+            self.simulation.start()
+
+    async def _astart(self) -> None:
+        if self.simulation is not None:
+            await self.simulation.astart()
+
     def _run(self, input: str, *, run_manager, **kwargs) -> str:
         # Просто возвращаем строку целиком для совместимости с абстрактным методом
         return input
 
-    def _stream(self, input: str, *, run_manager, **kwargs):
-        for char in input:
+    def _stream(self, input: str, *, run_manager, resume_offset: int = 0, **kwargs):
+        interval = self._interval()
+        fail_at = self._fail_at(len(input) - resume_offset)
+        self._start()
+        for idx, char in enumerate(input[resume_offset:]):
+            if idx == fail_at:
+                raise SimulatedFailure("Simulated stream failure")
             yield char
-            time.sleep(0.05)  # имитация задержки
-
-    async def _astream(self, input: str, *, run_manager, **kwargs):
-        for char in input:
+            time.sleep(interval)  # имитация задержки
+
+    async def _astream(
+        self, input: str, *, run_manager, resume_offset: int = 0, **kwargs
+    ):
+        interval = self._interval()
+        fail_at = self._fail_at(len(input) - resume_offset)
+        await self._astart()
+        for idx, char in enumerate(input[resume_offset:]):
+            if idx == fail_at:
+                raise SimulatedFailure("Simulated stream failure")
             yield char
-            await asyncio.sleep(0.05)
+            await asyncio.sleep(interval)
+
+    def _transform(self, chunks, *, run_manager, **kwargs):
+        # Символы каждого входного чанка отдаются, не дожидаясь следующих.
+        # Длина входа заранее неизвестна, поэтому сбой - только до первого чанка
+        interval = self._interval()
+        if self._fail_at(1) is not None:
+            raise SimulatedFailure("Simulated stream failure")
+        self._start()
+        for chunk in chunks:
+            for char in chunk:
+                yield char
+                time.sleep(interval)
+
+    async def _atransform(self, chunks, *, run_manager, **kwargs):
+        interval = self._interval()
+        if self._fail_at(1) is not None:
+            raise SimulatedFailure("Simulated stream failure")
+        await self._astart()
+        async for chunk in chunks:
+            for char in chunk:
+                yield char
+                await asyncio.sleep(interval)
 
 
 class NestedRunnable(BaseTraceableRunnable):
@@ -1,16 +1,108 @@
-from typing import Any, Dict, List, Optional
+import asyncio
+import os
+import time
+from contextlib import nullcontext
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple, Union
 from langchain_core.language_models import BaseChatModel
-from langchain_core.messages import AIMessage, BaseMessage
-from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import PrivateAttr
+from runnables.simulation import SimulatedFailure, StageSimulation
 
 
 class SimpleLLM(BaseChatModel):
     """
     Простая LLM-заглушка для демонстрации работы цепочек.
+
+    Умеет стримить ответ кусками по `chunk_size` символов со скоростью
+    `tokens_per_second` чанков в секунду после задержки первого токена
+    `first_token_latency`. По умолчанию ответ отдаётся без задержек.
+    Профиль `simulation` (если задан) определяет задержку, скорость,
+    сбои и CPU-нагрузку вместо этих полей.
+
+    `max_concurrency` моделирует ограниченное число слотов backend'а в
+    async-пути; `agenerate_batch`/`astream_batch` обрабатывают несколько
+    запросов за один вызов (один слот, общая задержка плюс
+    `batch_item_latency` на элемент).
     """
 
     model_name: str = "simple-llm"
     temperature: float = 0.7
+    tokens_per_second: Optional[float] = None
+    chunk_size: int = 4
+    first_token_latency: float = 0.0
+    simulation: Optional[StageSimulation] = None
+    max_concurrency: Optional[int] = None
+    batch_item_latency: float = 0.0
+
+    _slots: Optional[Tuple[Any, asyncio.Semaphore]] = PrivateAttr(default=None)
+
+    @classmethod
+    def from_env(cls, simulation: Optional[StageSimulation] = None) -> "SimpleLLM":
+        """
+        SIMPLE_LLM_TOKENS_PER_SECOND=50, SIMPLE_LLM_CHUNK_SIZE=4,
+        SIMPLE_LLM_FIRST_TOKEN_LATENCY=0.2 (секунды),
+        SIMPLE_LLM_MAX_CONCURRENCY=4, SIMPLE_LLM_BATCH_ITEM_LATENCY=0.01.
+        """
+        rate = os.getenv("SIMPLE_LLM_TOKENS_PER_SECOND")
+        max_concurrency = os.getenv("SIMPLE_LLM_MAX_CONCURRENCY")
+        return cls(
+            tokens_per_second=float(rate) if rate else None,
+            chunk_size=int(os.getenv("SIMPLE_LLM_CHUNK_SIZE", "4")),
+            first_token_latency=float(os.getenv("SIMPLE_LLM_FIRST_TOKEN_LATENCY", "0")),
+            simulation=simulation,
+            max_concurrency=int(max_concurrency) if max_concurrency else None,
+            batch_item_latency=float(os.getenv("SIMPLE_LLM_BATCH_ITEM_LATENCY", "0")),
+        )
+
+    def _response(self, messages: List[BaseMessage]) -> str:
+        last_message = messages[-1].content if messages else ""
+        return f"🤖 Я получил ваше сообщение: '{last_message}'\n\n✨ Спасибо за использование! 🎉"
+
+    def _pieces(self, text: str) -> List[str]:
+        size = self.chunk_size
+        if self.simulation is not None and self.simulation.chunk_size:
+            size = self.simulation.chunk_size
+        size = max(1, size)
+        return [text[i : i + size] for i in range(0, len(text), size)]
+
+    def _token_interval(self) -> float:
+        interval = 1.0 / self.tokens_per_second if self.tokens_per_second else 0.0
+        if self.simulation is not None:
+            return self.simulation.token_interval(interval)
+        return interval
+
+    def _first_token_delay(self) -> float:
+        if self.simulation is not None:
+            return self.simulation.latency.sample()
+        return self.first_token_latency
+
+    def _fail_at(self, pieces: int) -> Optional[int]:
+        if self.simulation is None:
+            return None
+        return self.simulation.fail_at(pieces)
+
+    def _burn_cpu(self) -> None:
+        if self.simulation is not None:
+            self.simulation.burn_cpu()
+
+    async def _aburn_cpu(self) -> None:
+        if self.simulation is not None:
+            await self.simulation.aburn_cpu()
+
+    def _slot(self) -> Any:
+        """
+        Слот backend'а на время генерации (для `async with`).
+        """
+        # Не async-генератор: брошенный стрим _astream финализируется
+        # сборщиком мусора, и вложенный генератор мог быть закрыт раньше
+        # него ("generator didn't stop after athrow()")
+        if self.max_concurrency is None:
+            return nullcontext()
+        loop = asyncio.get_running_loop()
+        if self._slots is None or self._slots[0] is not loop:
+            self._slots = (loop, asyncio.Semaphore(self.max_concurrency))
+        return self._slots[1]
 
     def _generate(
         self,
@@ -19,12 +111,144 @@ class SimpleLLM(BaseChatModel):
         run_manager: Optional[Any] = None,
         **kwargs: Any,
     ) -> ChatResult:
-        last_message = messages[-1].content if messages else ""
-        res = f"🤖 Я получил ваше сообщение: '{last_message}'\n\n✨ Спасибо за использование! 🎉"
+        res = self._response(messages)
+        pieces = len(self._pieces(res))
+        fail_at = self._fail_at(pieces)
+        self._burn_cpu()
+        duration = self._first_token_delay() + self._token_interval() * (
+            pieces if fail_at is None else fail_at
+        )
+        if duration:
+            time.sleep(duration)
+        if fail_at is not None:
+            raise SimulatedFailure("Simulated LLM failure")
         message = AIMessage(content=res)
         generation = ChatGeneration(message=message)
         return ChatResult(generations=[generation])
 
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[Any] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        # Собственный async-путь: без перехода в пул потоков
+        res = self._response(messages)
+        pieces = len(self._pieces(res))
+        fail_at = self._fail_at(pieces)
+        async with self._slot():
+            await self._aburn_cpu()
+            duration = self._first_token_delay() + self._token_interval() * (
+                pieces if fail_at is None else fail_at
+            )
+            if duration:
+                await asyncio.sleep(duration)
+        if fail_at is not None:
+            raise SimulatedFailure("Simulated LLM failure")
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=res))])
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[Any] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        interval = self._token_interval()
+        pieces = self._pieces(self._response(messages))
+        fail_at = self._fail_at(len(pieces))
+        self._burn_cpu()
+        delay = self._first_token_delay()
+        if delay:
+            time.sleep(delay)
+        for idx, piece in enumerate(pieces):
+            if idx and interval:
+                time.sleep(interval)
+            if idx == fail_at:
+                raise SimulatedFailure("Simulated LLM failure")
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=piece))
+            if run_manager is not None:
+                run_manager.on_llm_new_token(piece, chunk=chunk)
+            yield chunk
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[Any] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        interval = self._token_interval()
+        pieces = self._pieces(self._response(messages))
+        fail_at = self._fail_at(len(pieces))
+        async with self._slot():
+            await self._aburn_cpu()
+            delay = self._first_token_delay()
+            if delay:
+                await asyncio.sleep(delay)
+            for idx, piece in enumerate(pieces):
+                if idx and interval:
+                    await asyncio.sleep(interval)
+                if idx == fail_at:
+                    raise SimulatedFailure("Simulated LLM failure")
+                chunk = ChatGenerationChunk(message=AIMessageChunk(content=piece))
+                if run_manager is not None:
+                    await run_manager.on_llm_new_token(piece, chunk=chunk)
+                yield chunk
+
+    async def agenerate_batch(
+        self, batch: List[List[BaseMessage]]
+    ) -> List[Union[str, Exception]]:
+        """
+        Ответы на несколько запросов за один вызов backend'а. Ошибка
+        отдельного запроса возвращается вместо его ответа.
+        """
+        responses = [self._response(messages) for messages in batch]
+        pieces = [len(self._pieces(res)) for res in responses]
+        fails = [self._fail_at(count) for count in pieces]
+        async with self._slot():
+            await self._aburn_cpu()
+            duration = (
+                self._first_token_delay()
+                + self._token_interval() * max(pieces, default=0)
+                + self.batch_item_latency * len(batch)
+            )
+            if duration:
+                await asyncio.sleep(duration)
+        return [
+            res if fail is None else SimulatedFailure("Simulated LLM failure")
+            for res, fail in zip(responses, fails)
+        ]
+
+    async def astream_batch(
+        self, batch: List[List[BaseMessage]]
+    ) -> AsyncIterator[Tuple[int, Union[str, Exception]]]:
+        """
+        Стрим нескольких ответов за один вызов: пары (номер запроса, чанк),
+        на каждом шаге генерации - по чанку каждого незавершённого ответа.
+        Ошибка запроса отдаётся вместо чанка и завершает его стрим.
+        """
+        interval = self._token_interval()
+        pieces = [self._pieces(self._response(messages)) for messages in batch]
+        fails = [self._fail_at(len(items)) for items in pieces]
+        async with self._slot():
+            await self._aburn_cpu()
+            delay = self._first_token_delay() + self.batch_item_latency * len(batch)
+            if delay:
+                await asyncio.sleep(delay)
+            for step in range(max(map(len, pieces), default=0)):
+                if step and interval:
+                    await asyncio.sleep(interval)
+                for idx, items in enumerate(pieces):
+                    fail = fails[idx]
+                    if step >= len(items) or (fail is not None and step > fail):
+                        continue
+                    if step == fail:
+                        yield idx, SimulatedFailure("Simulated LLM failure")
+                    else:
+                        yield idx, items[step]
+
     @property
     def _llm_type(self) -> str:
         return "simple"
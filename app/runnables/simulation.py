@@ -0,0 +1,238 @@
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import threading
+import time
+from typing import Dict, Literal, Optional
+
+from pydantic import BaseModel, Field, PrivateAttr
+
+# Шаги, которые умеют работать по профилю симуляции
+LLM = "llm"
+STREAMING_ECHO = "streaming_echo"
+RAISE_EXCEPTION = "raise_exception"
+
+
+class SimulatedFailure(ConnectionError):
+    """
+    Ошибка, сгенерированная профилем симуляции (имитация сбоя upstream).
+    """
+
+
+class LatencyDistribution(BaseModel):
+    """
+    Распределение задержки в секундах:
+    fixed - всегда `mean`; normal - N(mean, stddev), отсечённое снизу нулём;
+    lognormal - с заданными средним и стандартным отклонением;
+    pareto - тяжёлый хвост с параметром формы `alpha` и средним `mean`.
+    """
+
+    kind: Literal["fixed", "normal", "lognormal", "pareto"] = Field(default="fixed")
+    mean: float = Field(default=0.0)
+    stddev: float = Field(default=0.0)
+    alpha: float = Field(default=2.5)
+    max: Optional[float] = Field(default=None)
+
+    def sample(self) -> float:
+        if self.mean <= 0:
+            return 0.0
+        if self.kind == "fixed":
+            value = self.mean
+        elif self.kind == "normal":
+            value = random.gauss(self.mean, self.stddev)
+        elif self.kind == "lognormal":
+            variance = self.stddev**2
+            sigma = math.sqrt(math.log(1 + variance / self.mean**2))
+            mu = math.log(self.mean) - sigma**2 / 2
+            value = random.lognormvariate(mu, sigma)
+        else:
+            scale = self.mean * (self.alpha - 1) / self.alpha
+            value = scale * random.paretovariate(self.alpha)
+        value = max(0.0, value)
+        return min(value, self.max) if self.max is not None else value
+
+
+class FailureModel(BaseModel):
+    """
+    Вероятностные сбои: каждый вызов падает с вероятностью `probability`;
+    с вероятностью `burst_probability` сбой открывает серию из
+    `burst_length` подряд идущих ошибок. При `mid_stream` стрим обрывается
+    на случайном чанке, а не до первого.
+    """
+
+    probability: float = Field(default=0.0)
+    burst_probability: float = Field(default=0.0)
+    burst_length: int = Field(default=5)
+    mid_stream: bool = Field(default=False)
+
+    _burst_left: int = PrivateAttr(default=0)
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    def should_fail(self) -> bool:
+        with self._lock:
+            if self._burst_left > 0:
+                self._burst_left -= 1
+                return True
+            if random.random() >= self.probability:
+                return False
+            if random.random() < self.burst_probability:
+                self._burst_left = self.burst_length - 1
+            return True
+
+
+class StageSimulation(BaseModel):
+    """
+    Профиль одного шага: задержка до первого результата, скорость стрима,
+    сбои и CPU-нагрузка на вызов.
+
+    cpu_mode: inline - работа выполняется в вызывающем потоке (в async-пути
+    блокирует event loop, как синхронный код в обработчике); offload - в
+    async-пути уносится в пул потоков.
+    """
+
+    latency: LatencyDistribution = Field(default_factory=LatencyDistribution)
+    tokens_per_second: Optional[float] = Field(default=None)
+    chunk_size: Optional[int] = Field(default=None)
+    failure: FailureModel = Field(default_factory=FailureModel)
+    cpu_ms: float = Field(default=0.0)
+    cpu_mode: Literal["inline", "offload"] = Field(default="inline")
+
+    def token_interval(self, default: float = 0.0) -> float:
+        if self.tokens_per_second:
+            return 1.0 / self.tokens_per_second
+        return default
+
+    def burn_cpu(self) -> None:
+        """
+        Занимает процессор (и GIL) примерно на `cpu_ms` миллисекунд.
+        """
+        if self.cpu_ms <= 0:
+            return
+        deadline = time.perf_counter() + self.cpu_ms / 1000
+        digest = b"simulation"
+        while time.perf_counter() < deadline:
+            for _ in range(100):
+                digest = hashlib.sha256(digest).digest()
+
+    async def aburn_cpu(self) -> None:
+        if self.cpu_ms <= 0:
+            return
+        if self.cpu_mode == "offload":
+            from core.sync_offload import run_sync
+
+            await run_sync(self.burn_cpu)
+        else:
+            self.burn_cpu()
+
+    def fail_at(self, chunks: int) -> Optional[int]:
+        """
+        Номер чанка, на котором вызов должен упасть (0 - до первого),
+        или None, если вызов успешен.
+        """
+        if not self.failure.should_fail():
+            return None
+        if self.failure.mid_stream and chunks > 1:
+            return random.randrange(1, chunks)
+        return 0
+
+    def start(self) -> None:
+        """
+        Начало вызова в sync-пути: CPU-нагрузка и задержка первого результата.
+        """
+        self.burn_cpu()
+        delay = self.latency.sample()
+        if delay:
+            time.sleep(delay)
+
+    async def astart(self) -> None:
+        await self.aburn_cpu()
+        delay = self.latency.sample()
+        if delay:
+            await asyncio.sleep(delay)
+
+
+def _stages(**stages: dict) -> Dict[str, StageSimulation]:
+    return {name: StageSimulation(**config) for name, config in stages.items()}
+
+
+def builtin_profiles() -> Dict[str, Dict[str, StageSimulation]]:
+    """
+    Встроенные профили. Каждый раз создаются новые объекты: состояние
+    серий сбоев не разделяется между цепочками.
+    """
+    return {
+        # Поведение заглушек без симуляции
+        "none": {},
+        "realistic": _stages(
+            llm={
+                "latency": {"kind": "lognormal", "mean": 0.3, "stddev": 0.15},
+                "tokens_per_second": 40,
+                "chunk_size": 4,
+            },
+            streaming_echo={"tokens_per_second": 100},
+            raise_exception={"failure": {"probability": 0.3}},
+        ),
+        "heavy_tail": _stages(
+            llm={
+                "latency": {"kind": "pareto", "mean": 0.3, "alpha": 1.5, "max": 10},
+                "tokens_per_second": 40,
+                "chunk_size": 4,
+            },
+            streaming_echo={"tokens_per_second": 100},
+            raise_exception={"failure": {"probability": 0.3}},
+        ),
+        "degraded": _stages(
+            llm={
+                "latency": {"kind": "normal", "mean": 1.0, "stddev": 0.3},
+                "tokens_per_second": 15,
+                "chunk_size": 4,
+                "failure": {
+                    "probability": 0.1,
+                    "burst_probability": 0.2,
+                    "burst_length": 10,
+                    "mid_stream": True,
+                },
+            },
+            streaming_echo={"tokens_per_second": 20},
+            raise_exception={"failure": {"probability": 0.6}},
+        ),
+        "cpu_bound": _stages(
+            llm={"cpu_ms": 20, "tokens_per_second": 200, "chunk_size": 4},
+            streaming_echo={"cpu_ms": 5, "tokens_per_second": 200},
+            raise_exception={"cpu_ms": 5, "failure": {"probability": 0.3}},
+        ),
+    }
+
+
+def load_profiles() -> Dict[str, Dict[str, StageSimulation]]:
+    """
+    Встроенные профили плюс профили из JSON-файла SIMULATION_PROFILES_FILE
+    вида {"имя": {"llm": {...}, "streaming_echo": {...}}}.
+    """
+    profiles = builtin_profiles()
+    path = os.getenv("SIMULATION_PROFILES_FILE")
+    if path:
+        with open(path, encoding="utf-8") as f:
+            for name, stages in json.load(f).items():
+                profiles[name] = _stages(**stages)
+    return profiles
+
+
+def get_simulation(chain: str) -> Dict[str, StageSimulation]:
+    """
+    Профиль цепочки: SIMULATION_CHAIN_PROFILES="retry_chain=degraded,..."
+    переопределяет общий SIMULATION_PROFILE (по умолчанию "none").
+    """
+    name = os.getenv("SIMULATION_PROFILE", "none")
+    for item in os.getenv("SIMULATION_CHAIN_PROFILES", "").split(","):
+        if "=" in item:
+            key, value = item.split("=", 1)
+            if key.strip() == chain:
+                name = value.strip()
+    profiles = load_profiles()
+    if name not in profiles:
+        raise ValueError(f"Unknown simulation profile: {name}")
+    return profiles[name]
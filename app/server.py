@@ -0,0 +1,266 @@
+"""
+Запуск приложения в нескольких процессах-worker'ах.
+
+Master открывает сокет и порождает worker'ы через fork. Каждый worker
+запускает uvicorn на общем сокете и в startup-событии создаёт собственный
+Langfuse handler. Worker, отработавший `--max-requests` запросов (плюс
+случайная добавка до `--max-requests-jitter`), завершается штатно и
+заменяется новым; упавший worker перезапускается с нарастающей паузой.
+По SIGTERM/SIGINT worker'ы перестают принимать соединения, дожидаются
+текущих запросов (в том числе стримов) не дольше `--graceful-timeout` и
+отправляют накопленные трейсы.
+
+Запуск:
+    python server.py --workers 4
+    WEB_CONCURRENCY=4 WORKER_MAX_REQUESTS=10000 python server.py --preload
+"""
+
+import argparse
+import logging
+import os
+import random
+import signal
+import socket
+import sys
+import time
+from typing import Any, Dict, Optional
+
+import uvicorn
+
+from core.chain_registry import import_string
+from core.worker import WORKER_ID_ENV, WORKER_MAX_REQUESTS_ENV
+
+logger = logging.getLogger("server")
+
+# Запас сверх graceful timeout на остановку worker'а до SIGKILL
+KILL_MARGIN = 5.0
+# Worker, проживший меньше, считается упавшим на старте
+MIN_WORKER_LIFETIME = 1.0
+MAX_RESPAWN_DELAY = 10.0
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+class Master:
+    """
+    Управляет worker'ами: запуск, замена завершившихся, остановка.
+    """
+
+    def __init__(self, args: argparse.Namespace, sock: socket.socket) -> None:
+        self.args = args
+        self.sock = sock
+        self.app: Any = "app:app"
+        self.workers: Dict[int, Dict[str, Any]] = {}
+        self.respawn_at: Dict[int, float] = {}
+        self.failures: Dict[int, int] = {}
+        self.stopping = False
+
+    def preload(self) -> None:
+        """
+        Импорт приложения и сборка цепочек до fork: worker'ы получают их
+        готовыми. Langfuse handler и фоновые потоки здесь не создаются.
+        """
+        chain_registry = import_string("app:chain_registry")
+        chain_registry.warm_up()
+        self.app = import_string("app:app")
+        logger.info("Preloaded application: %s", chain_registry.stats())
+
+    def _max_requests(self) -> Optional[int]:
+        if not self.args.max_requests:
+            return None
+        return self.args.max_requests + random.randint(0, self.args.max_requests_jitter)
+
+    def spawn(self, worker_id: int) -> None:
+        max_requests = self._max_requests()
+        pid = os.fork()
+        if pid == 0:
+            self._run_worker(worker_id, max_requests)
+        self.workers[pid] = {"id": worker_id, "started": time.monotonic()}
+        logger.info(
+            "Started worker %s (pid %s, max_requests=%s)",
+            worker_id,
+            pid,
+            max_requests,
+        )
+
+    def _run_worker(self, worker_id: int, max_requests: Optional[int]) -> None:
+        # Обработчики master'а не нужны: uvicorn ставит свои
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        random.seed()
+        os.environ[WORKER_ID_ENV] = str(worker_id)
+        if max_requests:
+            os.environ[WORKER_MAX_REQUESTS_ENV] = str(max_requests)
+        code = 0
+        try:
+            config = uvicorn.Config(
+                self.app,
+                lifespan="on",
+                limit_max_requests=max_requests,
+                timeout_graceful_shutdown=self.args.graceful_timeout,
+                log_level=self.args.log_level,
+                access_log=self.args.access_log,
+            )
+            server = uvicorn.Server(config)
+            server.run(sockets=[self.sock])
+            if not server.started:
+                # Ошибка в startup-событиях
+                code = 3
+        except BaseException:
+            logger.exception("Worker %s failed", worker_id)
+            code = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(code)
+
+    def _reap(self) -> None:
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.workers.clear()
+                return
+            if pid == 0:
+                return
+            worker = self.workers.pop(pid, None)
+            if worker is None:
+                continue
+            code = os.waitstatus_to_exitcode(status)
+            if self.stopping:
+                logger.info("Worker %s (pid %s) stopped", worker["id"], pid)
+                continue
+            lifetime = time.monotonic() - worker["started"]
+            if code == 0:
+                # Лимит запросов исчерпан - штатная замена
+                logger.info("Worker %s (pid %s) recycled", worker["id"], pid)
+                self.failures[worker["id"]] = 0
+                delay = 0.0
+            else:
+                failures = self.failures.get(worker["id"], 0)
+                if lifetime < MIN_WORKER_LIFETIME:
+                    failures += 1
+                else:
+                    failures = 1
+                self.failures[worker["id"]] = failures
+                delay = min(0.1 * 2**failures, MAX_RESPAWN_DELAY)
+                logger.warning(
+                    "Worker %s (pid %s) exited with code %s, restarting in %.1fs",
+                    worker["id"],
+                    pid,
+                    code,
+                    delay,
+                )
+            self.respawn_at[worker["id"]] = time.monotonic() + delay
+
+    def _handle_signal(self, signum: int, frame: Any) -> None:
+        self.stopping = True
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, self._handle_signal)
+        signal.signal(signal.SIGINT, self._handle_signal)
+        for worker_id in range(1, self.args.workers + 1):
+            self.spawn(worker_id)
+        while not self.stopping:
+            self._reap()
+            now = time.monotonic()
+            for worker_id, at in list(self.respawn_at.items()):
+                if at <= now and not self.stopping:
+                    del self.respawn_at[worker_id]
+                    self.spawn(worker_id)
+            time.sleep(0.1)
+        self.stop()
+
+    def stop(self) -> None:
+        logger.info("Stopping %s workers", len(self.workers))
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + self.args.graceful_timeout + KILL_MARGIN
+        while self.workers and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.1)
+        for pid in list(self.workers):
+            logger.warning("Killing worker %s (pid %s)", self.workers[pid]["id"], pid)
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            os.waitpid(pid, 0)
+        self.workers.clear()
+        self.sock.close()
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=_env_int("PORT", 8000))
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=_env_int("WEB_CONCURRENCY", 1),
+        help="число worker'ов (WEB_CONCURRENCY)",
+    )
+    parser.add_argument(
+        "--preload",
+        action="store_true",
+        default=os.getenv("PRELOAD_APP") == "1",
+        help="импорт приложения и сборка цепочек до fork (PRELOAD_APP=1)",
+    )
+    parser.add_argument(
+        "--max-requests",
+        type=int,
+        default=_env_int(WORKER_MAX_REQUESTS_ENV, 0),
+        help="запросов до замены worker'а, 0 - без замены (WORKER_MAX_REQUESTS)",
+    )
+    parser.add_argument(
+        "--max-requests-jitter",
+        type=int,
+        default=_env_int("WORKER_MAX_REQUESTS_JITTER", 0),
+        help="случайная добавка к лимиту, чтобы worker'ы не менялись разом",
+    )
+    parser.add_argument(
+        "--graceful-timeout",
+        type=float,
+        default=_env_float("WORKER_GRACEFUL_TIMEOUT", 30.0),
+        help="ожидание текущих запросов при остановке, сек",
+    )
+    parser.add_argument("--log-level", default=os.getenv("LOG_LEVEL", "info"))
+    parser.add_argument(
+        "--no-access-log", dest="access_log", action="store_false", default=True
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    logging.basicConfig(
+        level=args.log_level.upper(),
+        format="%(asctime)s [%(process)d] %(levelname)s %(message)s",
+    )
+    master = Master(args, bind_socket(args.host, args.port))
+    if args.preload:
+        master.preload()
+    master.run()
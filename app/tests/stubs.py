@@ -0,0 +1,84 @@
+from core.base_traceable_runnable import BaseTraceableRunnable
+from langchain_core.callbacks import BaseCallbackHandler
+from pydantic import Field, PrivateAttr
+from typing import Any, ClassVar, Dict, List, Optional
+from uuid import UUID
+
+
+class RecordingHandler(BaseCallbackHandler):
+    """
+    Callback handler, который запоминает имена начатых span'ов
+    и метаданные, переданные при их завершении.
+    """
+
+    def __init__(self) -> None:
+        self.roots: List[str] = []
+        self.spans: List[str] = []
+        self.end_metadata: List[Dict[str, Any]] = []
+
+    def on_chain_start(
+        self,
+        serialized: Optional[Dict[str, Any]],
+        inputs: Any,
+        *,
+        parent_run_id: Optional[UUID] = None,
+        **kwargs: Any,
+    ) -> None:
+        name = kwargs.get("name") or ""
+        self.spans.append(name)
+        if parent_run_id is None:
+            self.roots.append(name)
+
+    def on_chain_end(self, outputs: Any, **kwargs: Any) -> None:
+        if kwargs.get("metadata"):
+            self.end_metadata.append(kwargs["metadata"])
+
+
+class FlakyStreamingRunnable(BaseTraceableRunnable):
+    """
+    Runnable, который стримит строку кусками по `chunk_size` символов и
+    обрывает стрим с ошибкой после `fail_after` чанков в первых
+    `failures` попытках (заглушка нестабильного upstream).
+    """
+
+    chunk_size: int = Field(default=3)
+    fail_after: int = Field(default=2)
+    failures: int = Field(default=1)
+
+    _attempts: int = PrivateAttr(default=0)
+    _offsets: List[int] = PrivateAttr(default_factory=list)
+
+    @property
+    def attempts(self) -> int:
+        return self._attempts
+
+    @property
+    def offsets(self) -> List[int]:
+        """
+        `resume_offset`, с которым начиналась каждая попытка.
+        """
+        return self._offsets
+
+    def _run(self, input: str, *, run_manager, **kwargs) -> str:
+        return input
+
+    def _stream(self, input: str, *, run_manager, resume_offset: int = 0, **kwargs):
+        self._attempts += 1
+        self._offsets.append(resume_offset)
+        rest = input[resume_offset:]
+        for idx, pos in enumerate(range(0, len(rest), self.chunk_size)):
+            if self._attempts <= self.failures and idx >= self.fail_after:
+                raise ConnectionError("Стрим оборвался")
+            yield rest[pos : pos + self.chunk_size]
+
+    async def _astream(self, input: str, *, run_manager, **kwargs):
+        for chunk in self._stream(input, run_manager=run_manager, **kwargs):
+            yield chunk
+
+
+class ResumableFlakyStreamingRunnable(FlakyStreamingRunnable):
+    """
+    FlakyStreamingRunnable, который умеет продолжать стрим с `resume_offset`.
+    """
+
+    supports_resume_offset: ClassVar[bool] = True
@@ -0,0 +1,123 @@
+import asyncio
+
+import pytest
+
+from core.admission import (
+    EVICTED,
+    PRIORITIES,
+    QUEUE_FULL,
+    QUEUE_TIMEOUT,
+    AdmissionController,
+    AdmissionMiddleware,
+    AdmissionRejected,
+)
+
+
+def test_queued_request_gets_released_slot():
+    async def scenario():
+        controller = AdmissionController(max_in_flight=1, max_queue=1)
+        await controller.acquire()
+        waiter = asyncio.ensure_future(controller.acquire())
+        await asyncio.sleep(0)
+        assert controller.stats()["queue_depth"] == 1
+        controller.release(0.01)
+        await waiter
+        return controller.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["in_flight"] == 1
+    assert stats["queue_depth"] == 0
+    assert stats["admitted"] == 2
+
+
+def test_full_queue_rejects_and_times_out():
+    async def scenario():
+        controller = AdmissionController(
+            max_in_flight=1, max_queue=1, queue_timeout=0.05
+        )
+        await controller.acquire()
+        waiter = asyncio.ensure_future(controller.acquire())
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as full:
+            await controller.acquire()
+        with pytest.raises(AdmissionRejected) as timed_out:
+            await waiter
+        return full.value, timed_out.value, controller.stats()
+
+    full, timed_out, stats = asyncio.run(scenario())
+    assert full.reason == QUEUE_FULL
+    assert timed_out.reason == QUEUE_TIMEOUT
+    assert full.retry_after >= 1
+    assert stats["in_flight"] == 1
+    assert stats["queue_depth"] == 0
+
+
+def test_high_priority_evicts_low_priority_waiter():
+    async def scenario():
+        controller = AdmissionController(max_in_flight=1, max_queue=1)
+        await controller.acquire()
+        low = asyncio.ensure_future(controller.acquire(PRIORITIES["low"]))
+        await asyncio.sleep(0)
+        high = asyncio.ensure_future(controller.acquire(PRIORITIES["high"]))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as evicted:
+            await low
+        controller.release()
+        await high
+        return evicted.value
+
+    assert asyncio.run(scenario()).reason == EVICTED
+
+
+def test_cancelled_waiter_leaves_queue():
+    async def scenario():
+        controller = AdmissionController(max_in_flight=1, max_queue=1)
+        await controller.acquire()
+        waiter = asyncio.ensure_future(controller.acquire())
+        await asyncio.sleep(0)
+        # Клиент ушёл, пока ждал места
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        depth = controller.stats()["queue_depth"]
+        controller.release()
+        return depth, controller.stats()
+
+    depth, stats = asyncio.run(scenario())
+    assert depth == 0
+    assert stats["in_flight"] == 0
+
+
+def test_middleware_rejects_with_retry_after():
+    controller = AdmissionController(max_in_flight=1, max_queue=0)
+    release = asyncio.Event()
+
+    async def app(scope, receive, send):
+        await release.wait()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+    middleware = AdmissionMiddleware(app, {"/v1": controller})
+
+    async def call(path):
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {"type": "http", "path": path, "headers": []}
+        await middleware(scope, None, send)
+        return sent
+
+    async def scenario():
+        first = asyncio.ensure_future(call("/v1/invoke"))
+        await asyncio.sleep(0)
+        rejected = await call("/v1/stream")
+        release.set()
+        return rejected, await first
+
+    rejected, admitted = asyncio.run(scenario())
+    assert rejected[0]["status"] == 503
+    assert (b"retry-after", b"1") in rejected[0]["headers"]
+    assert admitted[0]["status"] == 200
+    assert controller.stats()["in_flight"] == 0
@@ -0,0 +1,47 @@
+import asyncio
+from typing import Any, List
+
+import pytest
+
+from core.base_traceable_runnable import _aggregate_chunks
+from tests.stubs import FlakyStreamingRunnable, RecordingHandler
+
+
+@pytest.mark.parametrize(
+    "chunks, expected",
+    [
+        ([], None),
+        (["a", "b", "c"], "abc"),
+        ([{"x": "a"}, {"x": "b", "y": "c"}], {"x": "ab", "y": "c"}),
+        ([[1], [2, 3]], [1, 2, 3]),
+        # Несовместимые чанки: итог - последний чанк
+        (["a", 1], 1),
+        ([{"x": "a"}, "b"], "b"),
+        ([object, None, 3], 3),
+    ],
+)
+def test_chunks_are_aggregated_incrementally(chunks, expected):
+    assert _aggregate_chunks(chunks) == expected
+
+
+class OutputRecordingHandler(RecordingHandler):
+    def __init__(self) -> None:
+        super().__init__()
+        self.outputs: List[Any] = []
+
+    def on_chain_end(self, outputs, **kwargs):
+        self.outputs.append(outputs)
+
+
+def test_stream_span_output_is_joined_text():
+    handler = OutputRecordingHandler()
+    runnable = FlakyStreamingRunnable(failures=0)
+
+    async def consume():
+        return [
+            chunk
+            async for chunk in runnable.astream("hello world", {"callbacks": [handler]})
+        ]
+
+    assert "".join(asyncio.run(consume())) == "hello world"
+    assert handler.outputs == ["hello world"]
@@ -0,0 +1,133 @@
+import asyncio
+import time
+
+import pytest
+from langchain_core.runnables import RunnableLambda
+
+from core.caching_runnable import CachingRunnable
+from core.deadline import DEADLINE_KEY
+from core.response_cache import CacheEntry, ResponseCache
+from core.sampling import TRACE_BUFFER_KEY
+
+
+def _counting_cache():
+    calls = []
+
+    def upper(input: str) -> str:
+        calls.append(input)
+        return input.upper()
+
+    return CachingRunnable(inner_runnable=RunnableLambda(upper)), calls
+
+
+def test_service_configurable_keys_do_not_affect_cache_key():
+    cache, calls = _counting_cache()
+
+    first = {
+        "configurable": {
+            TRACE_BUFFER_KEY: object(),
+            DEADLINE_KEY: time.monotonic() + 10,
+        }
+    }
+    second = {
+        "configurable": {
+            TRACE_BUFFER_KEY: object(),
+            DEADLINE_KEY: time.monotonic() + 20,
+        }
+    }
+    assert cache.invoke("hi", first) == "HI"
+    assert cache.invoke("hi", second) == "HI"
+    assert cache.invoke("hi") == "HI"
+    assert calls == ["hi"]
+
+
+def test_user_configurable_keys_are_part_of_cache_key():
+    cache, calls = _counting_cache()
+
+    cache.invoke("hi", {"configurable": {"model": "a"}})
+    cache.invoke(
+        "hi", {"configurable": {"model": "b", DEADLINE_KEY: time.monotonic() + 10}}
+    )
+    cache.invoke(
+        "hi", {"configurable": {"model": "a", DEADLINE_KEY: time.monotonic() + 20}}
+    )
+    assert calls == ["hi", "hi"]
+
+
+def test_stream_is_replayed_from_cache():
+    cache, calls = _counting_cache()
+
+    assert "".join(cache.stream("hi")) == "HI"
+    assert "".join(cache.stream("hi")) == "HI"
+    assert calls == ["hi"]
+
+
+def test_disk_tier_is_opened_per_process(tmp_path):
+    cache = ResponseCache(disk_path=str(tmp_path / "cache.sqlite"))
+    # До первого обращения (например, в master до fork) соединения нет
+    assert cache._disk is None
+
+    cache.set("key", CacheEntry(value="v"))
+    parent = cache._disk
+    assert parent is not None
+
+    # Процесс сменился (fork): соединение открывается заново, данные на диске
+    cache._disk_pid = -1
+    cache._memory.clear()
+    assert cache.get("key").value == "v"
+    assert cache._disk is not parent
+
+
+def test_waiter_takes_over_when_leader_is_cancelled():
+    calls = []
+
+    async def slow_upper(input: str) -> str:
+        calls.append(input)
+        await asyncio.sleep(0.05)
+        return input.upper()
+
+    cache = CachingRunnable(inner_runnable=RunnableLambda(slow_upper))
+
+    async def scenario():
+        leader = asyncio.ensure_future(cache.ainvoke("hi"))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.ensure_future(cache.ainvoke("hi"))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        # Ожидающий не получает ошибку отмены, а сам идёт в upstream
+        return await waiter
+
+    assert asyncio.run(scenario()) == "HI"
+    assert calls == ["hi", "hi"]
+
+
+def test_upstream_error_is_shared_with_waiters():
+    calls = []
+
+    async def failing(input: str) -> str:
+        calls.append(input)
+        await asyncio.sleep(0.02)
+        raise ValueError(input)
+
+    cache = CachingRunnable(inner_runnable=RunnableLambda(failing))
+
+    async def scenario():
+        return await asyncio.gather(
+            cache.ainvoke("hi"), cache.ainvoke("hi"), return_exceptions=True
+        )
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(result, ValueError) for result in results)
+    assert calls == ["hi"]
+
+
+def test_async_disk_tier_round_trip(tmp_path):
+    cache, calls = _counting_cache()
+    cache.cache = ResponseCache(disk_path=str(tmp_path / "cache.sqlite"))
+
+    assert asyncio.run(cache.ainvoke("hi")) == "HI"
+    cache.cache._memory.clear()
+    assert asyncio.run(cache.ainvoke("hi")) == "HI"
+    assert calls == ["hi"]
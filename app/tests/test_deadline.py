@@ -0,0 +1,103 @@
+import asyncio
+import time
+
+import pytest
+
+from core.deadline import (
+    DeadlineExceeded,
+    DisconnectMiddleware,
+    aiter_until,
+    await_until,
+    with_timeout,
+)
+from runnables.chain_factory import create_streaming_chain
+
+
+async def _numbers(count: int, interval: float):
+    for idx in range(count):
+        await asyncio.sleep(interval)
+        yield idx
+
+
+@pytest.mark.parametrize("timeout", [0.1, 0.3, 0.5])
+def test_nested_streaming_chain_stops_at_deadline(timeout):
+    chain = create_streaming_chain({})
+
+    async def consume():
+        chunks = []
+        async for chunk in chain.astream({"input": "hi"}, with_timeout({}, timeout)):
+            chunks.append(chunk)
+        return chunks
+
+    started = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(consume())
+    assert time.monotonic() - started < timeout + 0.5
+
+
+def test_slow_consumer_is_not_cancelled_between_chunks():
+    async def consume():
+        chunks = []
+        async for chunk in aiter_until(_numbers(3, 0.01), time.monotonic() + 1):
+            # Время потребителя тоже идёт в бюджет, но не прерывается отменой
+            await asyncio.sleep(0.05)
+            chunks.append(chunk)
+        return chunks
+
+    assert asyncio.run(consume()) == [0, 1, 2]
+
+
+def test_await_until_cancels_slow_call():
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(await_until(asyncio.sleep(1), time.monotonic() + 0.05))
+
+
+def _client(messages):
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await asyncio.sleep(3600)
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    return receive, send, sent
+
+
+def test_disconnect_cancels_running_request():
+    cancelled = []
+
+    async def app(scope, receive, send):
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    receive, send, _ = _client(
+        [{"type": "http.request", "body": b""}, {"type": "http.disconnect"}]
+    )
+    asyncio.run(DisconnectMiddleware(app)({"type": "http"}, receive, send))
+
+    assert cancelled == [True]
+
+
+def test_disconnect_after_response_does_not_cancel():
+    finished = []
+
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+        # Работа после ответа (например, background task)
+        await asyncio.sleep(0.05)
+        finished.append(True)
+
+    receive, send, sent = _client(
+        [{"type": "http.request", "body": b""}, {"type": "http.disconnect"}]
+    )
+    asyncio.run(DisconnectMiddleware(app)({"type": "http"}, receive, send))
+
+    assert finished == [True]
+    assert sent[-1]["body"] == b"ok"
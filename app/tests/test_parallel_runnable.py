@@ -0,0 +1,178 @@
+import asyncio
+import threading
+import time
+from typing import List
+
+import pytest
+from langchain_core.runnables import RunnableGenerator, RunnableLambda
+
+from core.parallel_runnable import ParallelTraceableRunnable
+from core.sync_offload import get_offload_executor
+
+
+def _sleeper(active: List[int], peak: List[int], lock: threading.Lock):
+    def sleep(input: str) -> str:
+        with lock:
+            active.append(1)
+            peak.append(len(active))
+        time.sleep(0.05)
+        with lock:
+            active.pop()
+        return input
+
+    return RunnableLambda(sleep)
+
+
+def _slow(input: str) -> str:
+    time.sleep(0.1)
+    return input
+
+
+def test_branches_run_in_parallel_inside_offload_thread():
+    parallel = ParallelTraceableRunnable(
+        branches={name: RunnableLambda(_slow) for name in "abc"}
+    )
+
+    started = time.perf_counter()
+    result = get_offload_executor().submit(parallel.invoke, "x").result()
+
+    assert result == {"a": "x", "b": "x", "c": "x"}
+    assert time.perf_counter() - started < 0.25
+
+
+def test_max_concurrency_is_shared_across_calls():
+    active: List[int] = []
+    peak: List[int] = []
+    lock = threading.Lock()
+    parallel = ParallelTraceableRunnable(
+        branches={name: _sleeper(active, peak, lock) for name in "abcd"},
+        max_concurrency=2,
+    )
+
+    threads = [threading.Thread(target=parallel.invoke, args=("x",)) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert max(peak) == 2
+
+
+def test_async_max_concurrency_is_shared_across_calls():
+    active: List[int] = []
+    peak: List[int] = []
+
+    async def sleep(input: str) -> str:
+        active.append(1)
+        peak.append(len(active))
+        await asyncio.sleep(0.02)
+        active.pop()
+        return input
+
+    parallel = ParallelTraceableRunnable(
+        branches={name: RunnableLambda(sleep) for name in "abc"}, max_concurrency=2
+    )
+
+    async def main():
+        await asyncio.gather(*(parallel.ainvoke("x") for _ in range(3)))
+
+    asyncio.run(main())
+    # Лимит переживает смену event loop'а
+    asyncio.run(main())
+    assert max(peak) == 2
+
+
+def test_max_concurrency_is_shared_between_sync_and_async_calls():
+    active: List[int] = []
+    peak: List[int] = []
+    lock = threading.Lock()
+    parallel = ParallelTraceableRunnable(
+        branches={name: _sleeper(active, peak, lock) for name in "abc"},
+        max_concurrency=2,
+    )
+
+    thread = threading.Thread(target=parallel.invoke, args=("x",))
+    thread.start()
+    # Async-вызов ждёт места, не блокируя event loop
+    asyncio.run(parallel.ainvoke("x"))
+    thread.join()
+
+    assert max(peak) == 2
+
+
+def test_cancelled_async_waiter_does_not_leak_slot():
+    async def sleep(input: str) -> str:
+        await asyncio.sleep(0.05)
+        return input
+
+    parallel = ParallelTraceableRunnable(
+        branches={"a": RunnableLambda(sleep)}, max_concurrency=1
+    )
+
+    async def main():
+        running = asyncio.ensure_future(parallel.ainvoke("x"))
+        await asyncio.sleep(0.01)
+        waiting = asyncio.ensure_future(parallel.ainvoke("x"))
+        await asyncio.sleep(0.01)
+        waiting.cancel()
+        await running
+        return await asyncio.wait_for(parallel.ainvoke("x"), 1)
+
+    assert asyncio.run(main()) == {"a": "x"}
+
+
+@pytest.mark.parametrize("policy", ["fail_fast", "collect_all"])
+def test_error_policy(policy):
+    def fail(input: str) -> str:
+        raise ValueError("boom")
+
+    parallel = ParallelTraceableRunnable(
+        branches={"ok": RunnableLambda(lambda x: x), "bad": RunnableLambda(fail)},
+        error_policy=policy,
+    )
+
+    if policy == "fail_fast":
+        with pytest.raises(ValueError):
+            parallel.invoke("x")
+    else:
+        result = parallel.invoke("x")
+        assert result["ok"] == "x"
+        assert isinstance(result["bad"], ValueError)
+
+
+def test_stream_merges_branch_chunks():
+    def letters(chunks):
+        for chunk in chunks:
+            yield from chunk
+
+    parallel = ParallelTraceableRunnable(
+        branches={"a": RunnableGenerator(letters), "b": RunnableGenerator(letters)}
+    )
+
+    chunks = list(parallel.stream("xyz"))
+
+    for name in "ab":
+        assert "".join(c[name] for c in chunks if name in c) == "xyz"
+
+
+def test_closed_stream_releases_blocked_producers():
+    produced: List[int] = []
+
+    def endless(chunks):
+        for _ in chunks:
+            for idx in range(10_000):
+                produced.append(idx)
+                yield str(idx)
+
+    parallel = ParallelTraceableRunnable(branches={"a": RunnableGenerator(endless)})
+
+    stream = parallel.stream("x")
+    next(stream)
+    time.sleep(0.05)
+    # Очередь ограничена: ветка не убегает вперёд потребителя
+    assert len(produced) < 100
+    stream.close()
+    time.sleep(0.2)
+    count = len(produced)
+    time.sleep(0.1)
+    assert len(produced) == count
@@ -0,0 +1,306 @@
+import asyncio
+import time
+
+import pytest
+from langchain_core.runnables import RunnableLambda
+
+from core.resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    LatencyTracker,
+    RetryBudget,
+    backoff_delay,
+)
+from core.retry_runnable import RetryRunnable
+from tests.stubs import (
+    FlakyStreamingRunnable,
+    RecordingHandler,
+    ResumableFlakyStreamingRunnable,
+)
+
+TEXT = "abcdefghijklmno"
+
+
+def _collect(stream) -> str:
+    return "".join(stream)
+
+
+async def _acollect(stream) -> str:
+    return "".join([chunk async for chunk in stream])
+
+
+def test_stream_retry_skips_delivered_prefix():
+    inner = FlakyStreamingRunnable()
+    retry = RetryRunnable(inner_runnable=inner, max_retries=2, resume_stream=True)
+
+    assert _collect(retry.stream(TEXT)) == TEXT
+    # Вторая попытка стримит с начала, дубликат префикса отброшен
+    assert inner.attempts == 2
+    assert inner.offsets == [0, 0]
+
+
+def test_stream_retry_resumes_from_offset():
+    inner = ResumableFlakyStreamingRunnable()
+    retry = RetryRunnable(inner_runnable=inner, max_retries=2, resume_stream=True)
+
+    assert _collect(retry.stream(TEXT)) == TEXT
+    # Два чанка по 3 символа уже отданы до обрыва
+    assert inner.offsets == [0, 6]
+
+
+def test_astream_retry_resumes_from_offset():
+    inner = ResumableFlakyStreamingRunnable()
+    retry = RetryRunnable(inner_runnable=inner, max_retries=2, resume_stream=True)
+
+    assert asyncio.run(_acollect(retry.astream(TEXT))) == TEXT
+    assert inner.offsets == [0, 6]
+
+
+def test_stream_without_resume_duplicates_prefix():
+    inner = FlakyStreamingRunnable()
+    retry = RetryRunnable(inner_runnable=inner, max_retries=2, resume_stream=False)
+
+    assert _collect(retry.stream(TEXT)) == TEXT[:6] + TEXT
+
+
+def test_retry_exhaustion_raises_last_error():
+    inner = FlakyStreamingRunnable(failures=3)
+    retry = RetryRunnable(inner_runnable=inner, max_retries=2, resume_stream=True)
+
+    with pytest.raises(ConnectionError):
+        _collect(retry.stream(TEXT))
+    assert inner.attempts == 2
+
+
+def test_retry_exhaustion_returns_default_value():
+    calls = []
+
+    def fail(input: str) -> str:
+        calls.append(input)
+        raise ValueError("boom")
+
+    retry = RetryRunnable(
+        inner_runnable=RunnableLambda(fail), max_retries=3, default_value="fallback"
+    )
+
+    assert retry.invoke("x") == "fallback"
+    assert len(calls) == 3
+
+
+def _failing_retry(breaker: CircuitBreaker) -> RetryRunnable:
+    def fail(input: str) -> str:
+        raise ValueError("boom")
+
+    return RetryRunnable(
+        inner_runnable=RunnableLambda(fail), max_retries=1, circuit_breaker=breaker
+    )
+
+
+def test_circuit_breaker_transitions():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    failing = _failing_retry(breaker)
+    ok = RetryRunnable(
+        inner_runnable=RunnableLambda(lambda x: x),
+        max_retries=1,
+        circuit_breaker=breaker,
+    )
+
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            failing.invoke("x")
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        ok.invoke("x")
+
+    # После reset_timeout проба с ошибкой снова размыкает цепь
+    time.sleep(0.06)
+    with pytest.raises(ValueError):
+        failing.invoke("x")
+    assert breaker.state == CircuitBreaker.OPEN
+
+    # Успешная проба замыкает цепь
+    time.sleep(0.06)
+    assert ok.invoke("x") == "x"
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_half_open_allows_single_probe():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    with pytest.raises(ValueError):
+        _failing_retry(breaker).invoke("x")
+
+    time.sleep(0.06)
+    assert breaker.allow_request()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow_request()
+    # Проба, не сообщившая результат, через reset_timeout заменяется новой
+    time.sleep(0.06)
+    assert breaker.allow_request()
+
+
+def test_cancelled_probe_is_released():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    with pytest.raises(ValueError):
+        _failing_retry(breaker).invoke("x")
+    time.sleep(0.06)
+
+    async def slow(input: str) -> str:
+        await asyncio.sleep(1)
+        return input
+
+    probe = RetryRunnable(
+        inner_runnable=RunnableLambda(slow), max_retries=1, circuit_breaker=breaker
+    )
+
+    async def cancel_probe():
+        task = asyncio.create_task(probe.ainvoke("x"))
+        await asyncio.sleep(0.01)
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_probe())
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.allow_request()
+
+
+def test_closed_stream_probe_is_released():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    with pytest.raises(ValueError):
+        _failing_retry(breaker).invoke("x")
+    time.sleep(0.06)
+
+    retry = RetryRunnable(
+        inner_runnable=FlakyStreamingRunnable(failures=0),
+        max_retries=1,
+        circuit_breaker=breaker,
+    )
+    stream = retry.stream(TEXT)
+    next(stream)
+    stream.close()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.allow_request()
+
+
+def test_backoff_delay_grows_and_is_capped():
+    delays = [
+        backoff_delay(attempt, 0.1, multiplier=2.0, max_delay=0.3, jitter=False)
+        for attempt in range(1, 5)
+    ]
+    assert delays == pytest.approx([0.1, 0.2, 0.3, 0.3])
+    # Full jitter: случайная задержка в [0, delay]
+    for _ in range(50):
+        assert 0 <= backoff_delay(3, 0.1, max_delay=0.3) <= 0.3
+
+
+def test_retries_wait_for_backoff():
+    def fail(input: str) -> str:
+        raise ValueError("boom")
+
+    retry = RetryRunnable(
+        inner_runnable=RunnableLambda(fail),
+        max_retries=3,
+        delay=0.02,
+        jitter=False,
+        default_value="fallback",
+    )
+
+    started = time.monotonic()
+    assert retry.invoke("x") == "fallback"
+    # Паузы 0.02 и 0.04 перед второй и третьей попытками
+    assert time.monotonic() - started >= 0.06
+
+
+def test_retry_budget_limits_retries():
+    calls = []
+
+    def fail(input: str) -> str:
+        calls.append(input)
+        raise ValueError("boom")
+
+    retry = RetryRunnable(
+        inner_runnable=RunnableLambda(fail),
+        max_retries=3,
+        retry_budget=RetryBudget(ratio=0.0, max_tokens=1.0),
+    )
+
+    with pytest.raises(ValueError):
+        retry.invoke("x")
+    # Единственный токен бюджета ушёл на один ретрай
+    assert len(calls) == 2
+    with pytest.raises(ValueError):
+        retry.invoke("x")
+    assert len(calls) == 3
+
+
+def _hedged(inner, hedge_delay: float, **kwargs) -> RetryRunnable:
+    tracker = LatencyTracker()
+    tracker.record(hedge_delay)
+    return RetryRunnable(
+        inner_runnable=inner,
+        max_retries=1,
+        hedge_percentile=0.5,
+        hedge_min_samples=1,
+        latency_tracker=tracker,
+        **kwargs,
+    )
+
+
+def _slow_first_call(cancelled: list):
+    calls = []
+
+    async def call(input: str) -> str:
+        calls.append(input)
+        attempt = len(calls)
+        if attempt == 1:
+            try:
+                await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                cancelled.append(attempt)
+                raise
+            return "slow"
+        return "fast"
+
+    return RunnableLambda(call)
+
+
+def test_hedge_wins_and_slow_attempt_is_cancelled():
+    cancelled: list = []
+    handler = RecordingHandler()
+    retry = _hedged(_slow_first_call(cancelled), hedge_delay=0.02)
+
+    result = asyncio.run(retry.ainvoke("x", {"callbacks": [handler]}))
+
+    assert result == "fast"
+    assert cancelled == [1]
+    # Обе попытки - дочерние span'ы шага
+    assert handler.spans == ["RetryRunnable", "RunnableLambda", "RunnableLambda"]
+
+
+def test_hedge_is_skipped_without_retry_budget():
+    cancelled: list = []
+    retry = _hedged(
+        _slow_first_call(cancelled),
+        hedge_delay=0.02,
+        retry_budget=RetryBudget(ratio=0.0, max_tokens=0.0),
+    )
+
+    assert asyncio.run(retry.ainvoke("x")) == "slow"
+    assert cancelled == []
+
+
+def test_cancelled_caller_cancels_hedged_attempts():
+    cancelled: list = []
+    retry = _hedged(_slow_first_call(cancelled), hedge_delay=5.0)
+
+    async def cancel_caller():
+        task = asyncio.create_task(retry.ainvoke("x"))
+        await asyncio.sleep(0.02)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        # Основная попытка отменена вместе с вызовом, а не брошена
+        assert cancelled == [1]
+
+    asyncio.run(cancel_caller())
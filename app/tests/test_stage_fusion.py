@@ -0,0 +1,137 @@
+import asyncio
+from typing import AsyncIterator, Iterator, List
+
+import pytest
+
+from core.stage_fusion import FusedRunnable, fuse_stages
+from runnables.custom_runnable import (
+    EchoRunnable,
+    NestedRunnable,
+    UppercaseRunnable,
+)
+from tests.stubs import RecordingHandler
+
+
+def _chain():
+    return EchoRunnable() | UppercaseRunnable() | NestedRunnable()
+
+
+@pytest.mark.parametrize("span_mode", ["single", "children"])
+def test_fused_chain_matches_sequence(span_mode):
+    chain = _chain()
+    fused = fuse_stages(chain, span_mode)
+
+    assert isinstance(fused, FusedRunnable)
+    assert fused.invoke("hi") == chain.invoke("hi")
+    assert "".join(fused.stream("hi")) == "".join(chain.stream("hi"))
+    assert asyncio.run(fused.ainvoke("hi")) == chain.invoke("hi")
+
+
+def test_transform_streams_through_non_buffering_stages():
+    fused = fuse_stages(EchoRunnable() | UppercaseRunnable())
+    pulled: List[str] = []
+
+    def source() -> Iterator[str]:
+        for chunk in ("ab", "cd", "ef"):
+            pulled.append(chunk)
+            yield chunk
+
+    output = fused.transform(source())
+    # Первый чанк выхода готов до того, как прочитан весь вход
+    assert next(output) == "AB"
+    assert pulled == ["ab"]
+    assert list(output) == ["CD", "EF"]
+
+
+def test_atransform_streams_through_non_buffering_stages():
+    fused = fuse_stages(EchoRunnable() | UppercaseRunnable())
+    pulled: List[str] = []
+
+    async def source() -> AsyncIterator[str]:
+        for chunk in ("ab", "cd"):
+            pulled.append(chunk)
+            yield chunk
+
+    async def first_chunk() -> str:
+        output = fused.atransform(source())
+        chunk = await output.__anext__()
+        await output.aclose()
+        return chunk
+
+    assert asyncio.run(first_chunk()) == "AB"
+    assert pulled == ["ab"]
+
+
+def test_buffering_stage_collects_input():
+    fused = fuse_stages(UppercaseRunnable() | NestedRunnable())
+
+    assert list(fused.transform(iter(["ab", "cd"]))) == ["[Nested] ABCD"]
+
+
+@pytest.mark.parametrize("mode", ["invoke", "stream"])
+def test_single_span_mode_records_timings_on_fused_span(mode):
+    handler = RecordingHandler()
+    fused = fuse_stages(EchoRunnable() | UppercaseRunnable(), "single")
+    config = {"callbacks": [handler]}
+
+    if mode == "invoke":
+        fused.invoke("hi", config)
+    else:
+        list(fused.stream("hi", config))
+
+    assert handler.spans == [fused.get_name()]
+    [metadata] = handler.end_metadata
+    assert set(metadata["stage_timings_ms"]) == {
+        "0:EchoRunnable",
+        "1:UppercaseRunnable",
+    }
+
+
+def test_repeated_stage_class_keeps_each_timing():
+    handler = RecordingHandler()
+    fused = fuse_stages(UppercaseRunnable() | UppercaseRunnable(), "single")
+
+    fused.invoke("hi", {"callbacks": [handler]})
+
+    [metadata] = handler.end_metadata
+    assert set(metadata["stage_timings_ms"]) == {
+        "0:UppercaseRunnable",
+        "1:UppercaseRunnable",
+    }
+
+
+def test_children_span_mode_creates_span_per_stage():
+    handler = RecordingHandler()
+    fused = fuse_stages(EchoRunnable() | UppercaseRunnable(), "children")
+
+    list(fused.stream("hi", {"callbacks": [handler]}))
+
+    # Конвейер запускает шаги с конца: последний шаг первым читает вход
+    assert sorted(handler.spans) == sorted(
+        [fused.get_name(), "EchoRunnable", "UppercaseRunnable"]
+    )
+    assert handler.end_metadata == []
+
+
+class ClosingRecordingHandler(RecordingHandler):
+    def __init__(self) -> None:
+        super().__init__()
+        self.closed: List[str] = []
+
+    def on_chain_end(self, outputs, **kwargs):
+        self.closed.append("end")
+
+    def on_chain_error(self, error, **kwargs):
+        self.closed.append(type(error).__name__)
+
+
+def test_children_spans_are_closed_when_stream_is_closed_early():
+    handler = ClosingRecordingHandler()
+    fused = fuse_stages(EchoRunnable() | UppercaseRunnable(), "children")
+
+    stream = fused.stream("hi", {"callbacks": [handler]})
+    next(stream)
+    stream.close()
+
+    # Span'ы обоих шагов закрыты, хотя стрим не дочитан
+    assert handler.closed == ["GeneratorExit", "GeneratorExit"]
@@ -0,0 +1,71 @@
+import asyncio
+from typing import ClassVar, List
+
+import pytest
+
+from core.sampling import TraceSampler
+from core.trace_sampling_runnable import TraceSamplingRunnable
+from runnables.custom_runnable import UppercaseRunnable
+from tests.stubs import RecordingHandler
+
+
+class BatchCountingRunnable(UppercaseRunnable):
+    batches: ClassVar[List[List[str]]] = []
+
+    def _run_batch(self, inputs, *, run_managers, **kwargs):
+        self.batches.append(list(inputs))
+        # Ошибка отдельного элемента возвращается вместо его результата
+        return [
+            ValueError(input) if input == "boom" else input.upper() for input in inputs
+        ]
+
+
+def _root(ratio: float, handler: RecordingHandler) -> TraceSamplingRunnable:
+    BatchCountingRunnable.batches = []
+    return TraceSamplingRunnable(
+        inner_runnable=BatchCountingRunnable(),
+        sampler=TraceSampler(default_ratio=ratio, keep_errors=True),
+        endpoint="/test",
+        callbacks=[handler],
+    )
+
+
+@pytest.mark.parametrize("ratio", [0.0, 1.0])
+def test_batch_uses_inner_native_batch(ratio):
+    handler = RecordingHandler()
+    root = _root(ratio, handler)
+
+    assert root.batch(["a", "b", "c"]) == ["A", "B", "C"]
+    assert BatchCountingRunnable.batches == [["a", "b", "c"]]
+    # Семплированные элементы трейсятся по отдельности, несемплированные - нет
+    assert len(handler.roots) == (3 if ratio else 0)
+
+
+def test_abatch_uses_inner_native_batch():
+    handler = RecordingHandler()
+    root = _root(1.0, handler)
+
+    assert asyncio.run(root.abatch(["a", "b"])) == ["A", "B"]
+    assert BatchCountingRunnable.batches == [["a", "b"]]
+    assert len(handler.roots) == 2
+
+
+def test_batch_error_is_exported_only_for_failed_item():
+    handler = RecordingHandler()
+    root = _root(0.0, handler)
+
+    with pytest.raises(ValueError):
+        root.batch(["a", "boom"])
+    # Хвостовое правило ошибок выгружает буфер только упавшего элемента
+    assert len(handler.roots) == 1
+
+
+def test_batch_returns_item_errors_when_requested():
+    handler = RecordingHandler()
+    root = _root(0.0, handler)
+
+    results = asyncio.run(root.abatch(["a", "boom"], return_exceptions=True))
+
+    assert results[0] == "A"
+    assert isinstance(results[1], ValueError)
+    assert len(handler.roots) == 1